@@ -1,5 +1,8 @@
 
-# Settings for the database to be used with the classifier
+# Settings for the database to be used with the classifier. Each process keeps
+# a pool of at most 'pool_size' connections (default 8), enough for the
+# threads serving requests, BATCH_WORKERS and the feedback trainer, closed
+# after 'pool_idle_timeout' seconds unused (default 300), both optional
 DB = {
         'dbname':,
         'host':,
@@ -9,3 +12,44 @@ DB = {
 
 # The category we want to test for
 X  = ''
+
+# Margin the score of a category must beat every other by for a page to be
+# classified in it, pages too close to call are reported as uncertain. The
+# scores are (1 + sum of log probabilities) * prior, as for EARLY_EXIT_MARGIN,
+# so these aren't ratios of probabilities. Pick them with utils/evaluate.py,
+# categories left out get 0.0 and always decide
+THRESHOLDS = { }
+
+# Memory cap in bytes for the feature counts cached by each web process
+MODEL_CACHE_BYTES = 64 * 1024 * 1024
+
+# Pages to classify are cut off after this many bytes or seconds, the seconds
+# counting from the first connection to the page (retries and redirects too)
+PAGE_MAX_BYTES = 2 * 1024 * 1024
+PAGE_DEADLINE  = 10
+
+# Stop downloading a page once the score of the best category beats the others
+# by this much, None to always read the whole page. Pages cut short are cached
+# by url only, pages read to the end also by content
+EARLY_EXIT_MARGIN = None
+
+# Classification results are cached for this many seconds, up to this many
+# results per process, and shared between processes through a SQLite database
+# at RESULT_CACHE_PATH (None to keep them only in memory)
+RESULT_CACHE_TTL  = 60 * 60
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_PATH = None
+
+# Threads classifying the items of batch requests (shared by all the batches a
+# process serves) and maximum number of items in a batch
+BATCH_WORKERS   = 8
+BATCH_MAX_ITEMS = 1000
+
+# Record the counters and timings served at /metrics (they cost a little time
+# on every page when on)
+METRICS_ENABLED = False
+
+# Mistakes reported by users are queued in this SQLite database, and trained in
+# batches at least every FEEDBACK_INTERVAL seconds
+FEEDBACK_QUEUE_PATH = 'feedback.db'
+FEEDBACK_INTERVAL   = 5
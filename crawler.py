@@ -6,8 +6,111 @@
 This script goes to specific websites and downloads some pages in order to
 build a decently sized training data set.
 '''
-import urllib2, os, codecs, re, time
-from BeautifulSoup import BeautifulSoup
+import urlparse, httplib, socket, threading, os, sys, codecs, re, time, HTMLParser, hashlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from BeautifulSoup import BeautifulSoup, UnicodeDammit
+import metrics
+
+# number of pages downloaded at the same time by crawl
+WORKERS = 4
+# pages per worker downloaded ahead of the one being written or trained, more
+# wait until the consumer catches up, so memory stays bounded
+READ_AHEAD = 4
+# seconds to wait between two requests to the same host
+HOST_DELAY = 1.0
+# seconds before giving up on connecting to a host or reading from it
+TIMEOUT = 30
+# times a failed download is retried, waiting RETRY_BACKOFF * 2**attempt
+# seconds before each retry
+RETRIES = 2
+RETRY_BACKOFF = 1.0
+# redirects followed before giving up on a page
+MAX_REDIRECTS = 5
+USER_AGENT = 'is_it_x crawler'
+# tags whose contents are left out of the text of a page
+SKIPPED_TAGS = ('script', 'style')
+# pages are cut off after MAX_BYTES bytes or DEADLINE seconds from the first
+# connection (retries and redirects included), and read CHUNK_SIZE bytes at a
+# time
+MAX_BYTES  = 4 * 1024 * 1024
+DEADLINE   = 30
+CHUNK_SIZE = 16 * 1024
+# limits of crawl_links: links followed from a seed, pages downloaded in all
+# and from a single host
+MAX_DEPTH          = 2
+MAX_PAGES          = 1000
+MAX_PAGES_PER_HOST = 100
+# links to files with these extensions aren't followed, they aren't pages
+SKIPPED_EXTENSIONS = (
+                      '.jpg', '.jpeg', '.png', '.gif', '.svg', '.ico', '.css',
+                      '.js', '.pdf', '.zip', '.gz', '.mp3', '.mp4', '.avi',
+                     )
+
+def normalize_url(url):
+    '''
+    Returns url in a canonical form, so the same page is always known by the
+    same url: lowercase scheme and host, no default port, no fragment, and
+    at least / as path. Urls without a scheme are taken to be http.
+    '''
+    url = url.strip()
+    if '://' not in url:
+        url = 'http://' + url
+    parts = urlparse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    if (scheme, host.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        host = host.rsplit(':', 1)[0]
+    return urlparse.urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+def document_digest(content):
+    '''
+    Returns the digest identifying the text content of a page.
+    '''
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+def page_links(base_url, hrefs):
+    '''
+    Returns the urls that hrefs, found in the page at base_url, link to:
+    absolute, normalized, in the order they were found and without
+    duplicates. Links that aren't to web pages (mailto:, javascript:, images,
+    ...) are left out.
+    '''
+    links, seen = [ ], set()
+    for href in hrefs:
+        url = urlparse.urljoin(base_url, href.strip())
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            continue
+        if parts.path.lower().endswith(SKIPPED_EXTENSIONS):
+            continue
+        url = normalize_url(url)
+        if url not in seen:
+            seen.add(url)
+            links.append(url)
+    return links
+
+def domain(host):
+    '''
+    Returns the domain of host, without the www. in front.
+    '''
+    host = host.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+def in_domains(host, domains):
+    '''
+    Returns whether host is one of domains or a subdomain of one.
+    '''
+    host = domain(host)
+    for name in domains:
+        if host == name or host.endswith('.' + name):
+            return True
+    return False
+
 class CrawlerError(Exception):
     '''
     Defines a crawler exception. Doesn't do much other than give it an error.
@@ -21,88 +124,823 @@ class CrawlerError(Exception):
     def __str__(self):
         return repr(self)
 
+class TemporaryError(Exception):
+    '''
+    A download failed in a way that may go away if we try again (server
+    errors, dropped connections).
+    '''
+    pass
+
+def sniff_charset(data):
+    '''
+    Returns the charset declared in a meta tag in data, or None.
+    '''
+    match = re.search('<meta[^>]+charset=["\']?([-\w.:]+)', data, re.I)
+    if match:
+        return match.group(1)
+    return None
+
+def incremental_decoder(charset):
+    '''
+    Returns an incremental decoder for charset, or for UTF-8 if charset is
+    None or unknown. Undecodable bytes are replaced.
+    '''
+    try:
+        return codecs.getincrementaldecoder(charset or 'utf-8')('replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')('replace')
+
+# size of the pages downloaded, and time spent downloading and parsing them
+FETCH_BYTES   = metrics.Histogram('isitx_fetch_bytes', 'Bytes downloaded per page', metrics.BYTES_BUCKETS)
+FETCH_SECONDS = metrics.Histogram('isitx_fetch_seconds', 'Time downloading pages')
+PARSE_SECONDS = metrics.Histogram('isitx_parse_seconds', 'Time extracting the text of pages')
+
+def text_fragments(chunks, charset=None, page_url=None):
+    '''
+    Generates the text in the html given as a sequence of byte chunks, a few
+    strings at a time as the chunks are parsed with a TextExtractor. The html
+    is decoded with charset, or the one declared in a meta tag at the start
+    of the page, falling back to UTF-8. Throws a CrawlerError for page_url if
+    the html can't be parsed.
+    '''
+    decoder = None
+    extractor = TextExtractor()
+    # the chunks download in between, only the parsing is timed
+    parsing = 0.0
+    try:
+        for chunk in chunks:
+            started = time.time()
+            if decoder is None:
+                decoder = incremental_decoder(charset or sniff_charset(chunk))
+            extractor.feed(decoder.decode(chunk))
+            parsing += time.time() - started
+            for fragment in extractor.pop_fragments():
+                yield fragment
+        started = time.time()
+        if decoder is not None:
+            extractor.feed(decoder.decode('', True))
+        extractor.close()
+        parsing += time.time() - started
+    except HTMLParser.HTMLParseError:
+        raise CrawlerError(page_url)
+    finally:
+        PARSE_SECONDS.observe(parsing)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    for fragment in extractor.pop_fragments():
+        yield fragment
+
+class HostLimiter(object):
+    '''
+    Spaces the requests to each host at least delay seconds apart, while
+    requests to different hosts go out right away. Shared by all the threads
+    of a crawler.
+    '''
+    def __init__(self, delay=HOST_DELAY):
+        self.delay = delay
+        self.lock  = threading.Lock()
+        self.next_request = { }
+
+    def wait(self, host):
+        '''
+        Blocks until it's polite to send a request to host.
+        '''
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_request.get(host, now))
+            self.next_request[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+class DeadlineSocket(object):
+    '''
+    Wraps the socket of a connection so that no read or write goes past an
+    absolute deadline, however slowly the host sends: every call gets the
+    time left as its timeout, instead of a timeout of its own. Once the
+    deadline passes, reads return nothing, like at the end of the stream,
+    so httplib hands back what it got so far, and expired is set.
+    '''
+    def __init__(self, sock, timeout):
+        '''
+        sock: the socket of the connection.
+        timeout: seconds a single call can wait at most.
+        '''
+        self.sock     = sock
+        self.timeout  = timeout
+        # absolute time, set for every request (None for no deadline)
+        self.deadline = None
+        self.expired  = False
+
+    def remaining(self):
+        '''
+        Sets the timeout of the socket for the next call, and returns the
+        seconds left before the deadline (None if there's none).
+        '''
+        if self.deadline is None:
+            self.sock.settimeout(self.timeout)
+            return None
+        remaining = self.deadline - time.time()
+        if remaining > 0:
+            self.sock.settimeout(min(self.timeout, remaining))
+        return remaining
+
+    def recv(self, size, *args):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self.expired = True
+            return ''
+        try:
+            return self.sock.recv(size, *args)
+        except socket.timeout:
+            # timed out on the deadline rather than on the timeout of a
+            # single call
+            if remaining is not None and remaining <= self.timeout:
+                self.expired = True
+                return ''
+            raise
+
+    def sendall(self, data, *args):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise socket.timeout('deadline passed')
+        return self.sock.sendall(data, *args)
+
+    def makefile(self, mode='r', bufsize=-1):
+        # reads through the file go through recv
+        return socket._fileobject(self, mode, bufsize)
+
+    def close(self):
+        # httplib closes the connection while responses may still be reading
+        # from it, the socket is closed once they're all gone
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+class Connections(threading.local):
+    '''
+    The open connections of a thread, by (scheme, host), kept alive between
+    requests to the same host.
+    '''
+    def __init__(self):
+        self.open = { }
+
 class Crawler(object):
     '''
     The crawler goes to a page and downloads the text content along with any
     urls in it, labels it, and appends all this to the training data set for
     that label
     '''
-    def __init__(self, data_dir=None, verbose=False):
+    def __init__(self, data_dir=None, verbose=False, workers=WORKERS,
+                 timeout=TIMEOUT, delay=HOST_DELAY, retries=RETRIES,
+                 fast_parser=False, max_bytes=MAX_BYTES, deadline=DEADLINE,
+                 frontier=None):
         '''
         data_dir: location to store the data downloaded
+        frontier: a frontier.Frontier remembering what was crawled, to skip
+                  urls already downloaded, resume interrupted crawls and
+                  never write the same document twice
+        workers: number of pages downloaded at the same time
+        timeout: seconds before giving up on connecting to or reading from a
+                 host
+        delay: seconds between two requests to the same host
+        retries: times a failed download is retried
+        fast_parser: extract the text of pages with the streaming
+                     TextExtractor instead of BeautifulSoup
+        max_bytes: bytes read from a page before cutting it off
+        deadline: seconds spent downloading a page before cutting it off
         '''
         self.data_dir = data_dir
         self.verbose  = verbose
+        self.workers  = workers
+        self.timeout  = timeout
+        self.retries  = retries
+        self.fast_parser = fast_parser
+        self.max_bytes   = max_bytes
+        self.deadline    = deadline
+        self.frontier    = frontier
+        # (response, digest) of the pages iter_documents generated with
+        # record False, by url (a list, a url can be given more than once),
+        # until given to record_done
+        self.unrecorded  = { }
+        # url of those pages, by digest: their documents count as written
+        # already, so a copy downloaded meanwhile isn't generated twice
+        self.reserved    = { }
+        self.limiter  = HostLimiter(delay)
+        self.connections = Connections()
         if data_dir is None:
             self.download = False
         else:
             self.download = True
 
-    def crawl(self, pages, label):
+    def crawl(self, pages, label, refetch=False):
         '''
         pages: a list of pages to crawl
         label: label to give to the content downloaded, also name of the file
                to which the content gets downloaded
+        refetch: with a frontier, download again the pages it already has
+                 (only what changed since is downloaded)
+
+        The documents are written in the order of pages, each one as soon as
+        it's downloaded (see iter_documents).
+        '''
+        file = None
+        if self.download:
+            file = codecs.open(self.data_dir + os.sep + label, 'a', 'utf-8')
+        try:
+            for page, content in self.iter_documents(pages, label, refetch):
+                if file is not None:
+                    file.write(content)
+                    file.flush()
+        finally:
+            if file is not None:
+                file.close()
+
+    def iter_documents(self, pages, label, refetch=False, record=True):
+        '''
+        Generates (page_url, content) for the pages downloaded, in the order
+        of pages, as they come: the pages are downloaded by a pool of worker
+        threads, at most READ_AHEAD pages per worker ahead of the consumer.
+        label and refetch are as for crawl: with a frontier, only the pages it
+        doesn't have yet are downloaded, along with any left pending by an
+        interrupted crawl, and documents it already has are left out.
+
+        A page is recorded done in the frontier once the consumer asks for
+        the next one, or with record False only when given to record_done,
+        for consumers that are done with a page later on (e.g. once the
+        batch it's trained in is written, see
+        page_classifier.Classifier.train_stream).
+        '''
+        if self.frontier is None:
+            pages = [ (page, None, None) for page in pages ]
+        else:
+            self.add_pages(pages, label, refetch)
+            pages = self.frontier.pending(label)
+        pool = ThreadPool(self.workers)
+        try:
+            results = self.fetch_ahead(pool, self.try_download_content, pages)
+            for page, content, response in results:
+                digest = self.check_document(page, content, response)
+                if digest is None:
+                    continue
+                if not record:
+                    # left for record_done, which can come before the
+                    # consumer asks for the next page
+                    self.unrecorded.setdefault(page, [ ]).append((response, digest))
+                    self.reserved[digest] = page
+                yield page, content
+                # only recorded once the consumer is done with it, so an
+                # interruption in between downloads it again rather than
+                # losing it
+                if record:
+                    self.record(page, response, 'done', digest)
+        finally:
+            pool.close()
+
+    def record_done(self, pages):
+        '''
+        Records done in the frontier pages generated by iter_documents with
+        record False.
+        '''
+        for page in pages:
+            unrecorded = self.unrecorded[page]
+            response, digest = unrecorded.pop(0)
+            if not unrecorded:
+                del self.unrecorded[page]
+            self.record(page, response, 'done', digest)
+            # the frontier has it now
+            if self.reserved.get(digest) == page:
+                del self.reserved[digest]
+
+    def fetch_ahead(self, pool, function, pages):
+        '''
+        Generates function(page) for every page in pages, in order, run by
+        pool with at most READ_AHEAD pages per worker in flight or waiting to
+        be consumed.
         '''
-        documents = [ ]
+        pending = deque()
         for page in pages:
-            # if there's problems with data from a page, ignored it and get
-            # content from the next page
+            pending.append(pool.apply_async(function, (page,)))
+            if len(pending) >= self.workers * READ_AHEAD:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def crawl_links(self, seeds, label, max_depth=MAX_DEPTH, max_pages=MAX_PAGES,
+                    max_per_host=MAX_PAGES_PER_HOST, same_domain=True):
+        '''
+        seeds: the pages the crawl starts from
+        label: label to give to the content downloaded, as for crawl
+        max_depth: links followed from a seed to a page, 0 downloads the seeds
+                   only
+        max_pages: pages downloaded in all
+        max_per_host: pages downloaded from a single host
+        same_domain: only follow links to the domains of the seeds and their
+                     subdomains
+
+        Crawls breadth first: the seeds are downloaded by the pool of worker
+        threads, then the pages they link to, and so on, every document being
+        written as soon as it's downloaded. Every url is downloaded once,
+        whatever the links to it look like (see normalize_url). With a
+        frontier, the pages are recorded in it and documents already written
+        aren't written again. The crawl doesn't resume from the frontier
+        though: run again, it starts over from the seeds and downloads every
+        page again, to find its links.
+        '''
+        seeds = [ normalize_url(seed) for seed in seeds if seed.strip() ]
+        domains = set([ domain(urlparse.urlsplit(seed).netloc) for seed in seeds ])
+        seen, hosts = set(), { }
+        level = seeds
+        file = None
+        if self.download:
+            file = codecs.open(self.data_dir + os.sep + label, 'a', 'utf-8')
+        pool = ThreadPool(self.workers)
+        try:
+            for depth in range(max_depth + 1):
+                # the urls of this level not seen yet and within the limits
+                pages = [ ]
+                for url in level:
+                    if len(seen) >= max_pages:
+                        break
+                    host = urlparse.urlsplit(url).netloc
+                    if url in seen or hosts.get(host, 0) >= max_per_host:
+                        continue
+                    if same_domain and not in_domains(host, domains):
+                        continue
+                    seen.add(url)
+                    hosts[host] = hosts.get(host, 0) + 1
+                    pages.append(url)
+                if not pages:
+                    break
+                if self.frontier is not None:
+                    self.add_pages(pages, label)
+                level = [ ]
+                results = self.fetch_ahead(
+                                           pool,
+                                           self.try_download_links,
+                                           [ (page, None, None) for page in pages ]
+                                          )
+                for page, content, response, links in results:
+                    self.store(file, page, content, response)
+                    if depth < max_depth:
+                        level.extend([ link for link in links if link not in seen ])
+        finally:
+            pool.close()
+            if file is not None:
+                file.close()
+
+    def add_pages(self, pages, label, refetch=False):
+        '''
+        Adds pages to the frontier under label, warning about the ones it
+        already has under another label: they aren't crawled again as label.
+        '''
+        for url, other in self.frontier.add(pages, label, refetch):
+            sys.stderr.write(
+                             'Not crawling %s as %s, it was crawled as %s\n'
+                             % (url, label, other)
+                            )
+
+    def check_document(self, page_url, content, response):
+        '''
+        Returns the digest of content, downloaded from page_url, if it's a
+        new document, or None if it couldn't be downloaded or the frontier
+        says it was already written, recording so in the frontier. Documents
+        generated by iter_documents but not given to record_done yet count as
+        written.
+        '''
+        # if there's problems with data from a page, ignored it and get
+        # content from the next page
+        if content is None:
+            self.record(page_url, response)
+            return None
+        digest = document_digest(content)
+        owner = None
+        if self.frontier is not None:
+            owner = self.reserved.get(digest) or self.frontier.owner(digest)
+        if owner is not None:
+            # a page fetched again without change is still done
+            self.record(page_url, response, 'done' if owner == page_url else 'duplicate')
+            return None
+        if self.verbose: print 'Downloading content for: ', page_url
+        return digest
+
+    def store(self, file, page_url, content, response):
+        '''
+        Writes content, downloaded from page_url, to file (if not None)
+        unless the frontier says it was already written, and records what
+        happened in the frontier. Returns whether content was written.
+        '''
+        digest = self.check_document(page_url, content, response)
+        if digest is None:
+            return False
+        if file is not None:
+            file.write(content)
+            file.flush()
+        # only recorded once written, so an interruption in between downloads
+        # it again rather than losing it
+        self.record(page_url, response, 'done', digest)
+        return True
+
+    def record(self, page_url, response, state=None, digest=None):
+        '''
+        Records in the frontier, if any, what happened to page_url given the
+        response it got (None if the download failed). state defaults to
+        done for unchanged pages and failed otherwise.
+        '''
+        if self.frontier is None:
+            return
+        if response is None:
+            self.frontier.record(page_url, 'failed')
+            return
+        if state is None:
+            state = 'done' if response.status == httplib.NOT_MODIFIED else 'failed'
+        self.frontier.record(
+                             page_url,
+                             state,
+                             response.getheader('etag'),
+                             response.getheader('last-modified'),
+                             digest
+                            )
+
+    def try_download_content(self, page, links=None):
+        '''
+        page: (page_url, etag, last_modified), the validators of the copy we
+              already have if any.
+        links: if given, a list the hrefs in the page are added to.
+
+        Returns (page_url, content, response), content being None if it
+        couldn't be downloaded or didn't change, and response None if it
+        couldn't be downloaded.
+        '''
+        page_url, etag, last_modified = page
+        headers = { }
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        try:
+            response = self.open_page(page_url, headers)
+            if response.status == httplib.NOT_MODIFIED:
+                return page_url, None, response
+            data = ''.join(self.read_chunks(response))
+            return page_url, self.document_text(data, response.charset, links), response
+        except Exception:
+            return page_url, None, None
+
+    def try_download_links(self, page):
+        '''
+        Like try_download_content, but returns (page_url, content, response,
+        links) with the urls the page links to (see page_links).
+        '''
+        hrefs = [ ]
+        page_url, content, response = self.try_download_content(page, hrefs)
+        if content is None:
+            return page_url, content, response, [ ]
+        return page_url, content, response, page_links(response.url, hrefs)
+
+    def connection(self, scheme, host):
+        '''
+        Returns the open connection of this thread to host, opening one if
+        needed.
+        '''
+        key = (scheme, host)
+        if key not in self.connections.open:
+            if scheme == 'https':
+                connection_class = httplib.HTTPSConnection
+            else:
+                connection_class = httplib.HTTPConnection
+            self.connections.open[key] = connection_class(host, timeout=self.timeout)
+        return self.connections.open[key]
+
+    def close_connection(self, scheme, host):
+        '''
+        Closes and forgets the connection of this thread to host.
+        '''
+        connection = self.connections.open.pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def connect(self, connection, deadline=None):
+        '''
+        Connects connection, if it isn't connected, giving up at deadline,
+        and has its reads and writes give up at deadline too. Returns its
+        DeadlineSocket.
+        '''
+        if connection.sock is None:
+            connection.timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout('deadline passed')
+                connection.timeout = min(self.timeout, remaining)
+            connection.connect()
+        if not isinstance(connection.sock, DeadlineSocket):
+            connection.sock = DeadlineSocket(connection.sock, self.timeout)
+        connection.sock.deadline = deadline
+        connection.sock.expired  = False
+        return connection.sock
+
+    def request(self, page_url, headers=None, deadline=None):
+        '''
+        Sends a single GET for page_url, with the extra headers if given,
+        over a kept alive connection and returns the response, its body still
+        unread. Connecting, sending and reading give up at deadline, an
+        absolute time, if given.
+        '''
+        request_headers = {
+                           'User-Agent': USER_AGENT,
+                           'Accept-Encoding': 'identity',
+                          }
+        request_headers.update(headers or { })
+        parts = urlparse.urlsplit(page_url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            raise CrawlerError(page_url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        self.limiter.wait(parts.netloc)
+        # a kept alive connection may have been closed by the server since we
+        # last used it, so give it a second chance with a new connection
+        reused = (parts.scheme, parts.netloc) in self.connections.open
+        while True:
+            connection = self.connection(parts.scheme, parts.netloc)
+            try:
+                sock = self.connect(connection, deadline)
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+                response.sock = sock
+                response.connection_key = (parts.scheme, parts.netloc)
+                response.page_url = page_url
+                return response
+            except (httplib.HTTPException, socket.error):
+                self.close_connection(parts.scheme, parts.netloc)
+                if not reused:
+                    raise
+                reused = False
+
+    def open_page(self, page_url, headers=None):
+        '''
+        Returns the response for page_url with its body unread, following
+        redirects and retrying with exponential backoff when the failure may
+        be temporary. Throws a CrawlerError if the page can't be downloaded.
+        headers are sent with the request, e.g. to make it conditional, in
+        which case the response may be a 304 Not Modified.
+
+        The whole download, from the first connection to the last byte read
+        by read_chunks, takes at most deadline seconds: connecting, retries
+        and redirects count towards it, and the page is given up on when
+        time runs out before its body starts.
+
+        The response also has the charset declared in its headers (or None),
+        the time the download started and its deadline, for read_chunks, and
+        the url it came from after redirects.
+        '''
+        started = time.time()
+        deadline = started + self.deadline
+        for attempt in range(self.retries + 1):
+            if attempt:
+                backoff = RETRY_BACKOFF * 2 ** (attempt - 1)
+                # no use waiting for a retry there's no time left for
+                if time.time() + backoff >= deadline:
+                    break
+                time.sleep(backoff)
             try:
-                content = self.download_content(page)
-                if self.verbose: print 'Downloading content for: ', page
-            except Exception:
+                url = page_url
+                for redirect in range(MAX_REDIRECTS + 1):
+                    try:
+                        response = self.request(url, headers, deadline)
+                        if response.status < 200 or response.status >= 300:
+                            # read the body so the connection can be reused
+                            response.read()
+                    except (httplib.HTTPException, socket.error):
+                        raise TemporaryError(url)
+                    if response.status in (301, 302, 303, 307, 308):
+                        url = urlparse.urljoin(url, response.getheader('location', ''))
+                        continue
+                    if response.status >= 500:
+                        raise TemporaryError(url)
+                    if response.status >= 400:
+                        raise CrawlerError(page_url)
+                    response.charset = response.msg.getparam('charset')
+                    response.started  = started
+                    response.deadline = deadline
+                    response.url      = url
+                    return response
+                raise CrawlerError(page_url)
+            except TemporaryError:
                 continue
-            documents.append(content)
-            # just in case I am hitting the same site, this is just a hack
-            time.sleep(1)
-        if self.download:
-            documents_to_write = '\n'.join(documents)
-            with codecs.open(self.data_dir + os.sep + label, 'a', 'utf-8') as file:
-                file.write(documents_to_write)
+        raise CrawlerError(page_url)
+
+    def read_chunks(self, response):
+        '''
+        Generates the body of response in chunks of at most CHUNK_SIZE bytes.
+        Stops early, leaving the page truncated, once max_bytes have been
+        read or at the deadline of the download (see open_page), even in the
+        middle of a chunk.
+        '''
+        read = 0
+        complete = False
+        try:
+            while read < self.max_bytes:
+                if response.sock.expired or time.time() >= response.deadline:
+                    break
+                try:
+                    chunk = response.read(min(CHUNK_SIZE, self.max_bytes - read))
+                except httplib.IncompleteRead, error:
+                    # a chunked body cut off by the deadline
+                    if not response.sock.expired:
+                        raise
+                    chunk = error.partial
+                if not chunk:
+                    # the socket reads nothing once the deadline is gone
+                    complete = not response.sock.expired
+                    break
+                read += len(chunk)
+                yield chunk
+        except (httplib.HTTPException, socket.error):
+            raise CrawlerError(response.page_url)
+        finally:
+            FETCH_BYTES.observe(read)
+            FETCH_SECONDS.observe(time.time() - response.started)
+            # a connection with a half read body can't be used again
+            if not complete:
+                self.close_connection(*response.connection_key)
+
+    def fetch(self, page_url):
+        '''
+        Returns the body of page_url (see open_page and read_chunks).
+        '''
+        return ''.join(self.read_chunks(self.open_page(page_url)))
 
     def download_content(self, page_url):
         '''
         Opens the page, downloads the content, and returns it as a string.
-        Throws an <exceptiontyp> exception if page_url is an invalid url.
+        Throws a CrawlerError exception if page_url is an invalid url or the
+        page can't be downloaded.
+        '''
+        response = self.open_page(page_url)
+        data = ''.join(self.read_chunks(response))
+        return self.document_text(data, response.charset)
+
+    def document_text(self, data, charset=None, links=None):
+        '''
+        Returns the text of the html data as a document of the training data:
+        a single line. The hrefs of its links are added to links if given.
         '''
         regex = re.compile('\n')
-        # If the page_url is invalid, catch the urllib2 exception and
-        # throw an crawler exception to be caught by the client code
-        # using this object. This way the client doesn't need to know
-        # about the urllib2 exceptions to use the crawler
-        try:
-            data = urllib2.urlopen(page_url).read()
-        except urllib2.URLError:
-            raise CrawlerError('page_url')
-        soup = BeautifulSoup(data)
-        content = regex.sub(' ', self.parse_content(soup))
+        content = regex.sub(' ', self.extract_text(data, charset, links))
         return content + '\n'
 
-    def parse_content(self, soup):
+    def stream_content(self, page_url):
         '''
-        Takes the html of the page and extracts the text from it along with any
-        urls found in the page.
+        Generates the text of page_url a few strings at a time as the page
+        downloads, so the caller can stop reading whenever it has enough
+        (see text_fragments).
+        '''
+        response = self.open_page(page_url)
+        fragments = text_fragments(
+                                   self.read_chunks(response),
+                                   response.charset,
+                                   page_url
+                                  )
+        for fragment in fragments:
+            yield fragment
+
+    def extract_text(self, data, charset=None, links=None):
         '''
-        value = soup.string
-        if value == None:
-            content = soup.contents
-            result_text = u''
-            for tag in content:
+        Returns the text in the html data, with the streaming parser if the
+        crawler was created with fast_parser, or with BeautifulSoup otherwise
+        or when the streaming parser can't make sense of the page. charset is
+        the encoding declared for data, if any. The hrefs of the links in the
+        page are added to links if given.
+        '''
+        with metrics.timer(PARSE_SECONDS):
+            if self.fast_parser:
+                extractor = TextExtractor()
                 try:
-                    if tag.name == 'style' or tag.name == 'script':
-                        # we dont' care about this data, yet
-                        continue
-                except AttributeError:
-                    # if tag has no name attribute, we don't really care
-                    # still, get its contents
-                    #print 'ERROR: %s has no name' % (tag,)
+                    if charset:
+                        markup = UnicodeDammit(data, [ charset ]).unicode
+                    else:
+                        markup = UnicodeDammit(data).unicode
+                    extractor.feed(markup)
+                    extractor.close()
+                    if links is not None:
+                        links.extend(extractor.links)
+                    return extractor.text()
+                except HTMLParser.HTMLParseError:
                     pass
-                subtext = self.parse_content(tag)
-                result_text += u' ' + subtext
-            return result_text
-        else:
-            return value.strip( )
+            return self.parse_content(BeautifulSoup(data, fromEncoding=charset), links)
+
+    def parse_content(self, soup, links=None):
+        '''
+        Takes the html of the page and extracts the text from it along with any
+        urls found in the page, added to links if given.
+
+        The tree is walked with an explicit stack, so deeply nested pages
+        can't hit the recursion limit, and the text is joined only once at
+        the end.
+        '''
+        fragments = [ ]
+        stack = [ soup ]
+        while stack:
+            tag = stack.pop()
+            value = tag.string
+            if value is not None:
+                value = value.strip()
+                if value:
+                    fragments.append(value)
+                continue
+            # push the children backwards so they come off the stack in the
+            # order they are in the page
+            for child in reversed(tag.contents):
+                # we dont' care about this data, yet. Strings have no name
+                # attribute, we still want their contents
+                if getattr(child, 'name', None) in SKIPPED_TAGS:
+                    continue
+                stack.append(child)
+        if links is not None:
+            links.extend([ a['href'] for a in soup.findAll('a', href=True) ])
+        return u' '.join(fragments)
+
+class TextExtractor(HTMLParser.HTMLParser):
+    '''
+    Streaming alternative to parsing the page with BeautifulSoup: collects
+    the text as the html is fed to it, without building a tree, and keeps the
+    same text parse_content would (strings, comments and declarations, but
+    nothing inside SKIPPED_TAGS), and the hrefs of the links.
+    '''
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.fragments = [ ]
+        self.links     = [ ]
+        # pieces of the string being read, the parser hands over text in
+        # pieces split around entities
+        self.pieces   = [ ]
+        self.skipping = 0
+
+    def flush(self):
+        '''
+        Ends the string being read, at a tag or the end of the page.
+        '''
+        text = u''.join(self.pieces).strip()
+        if text:
+            self.fragments.append(text)
+        self.pieces = [ ]
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush()
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag in SKIPPED_TAGS and self.skipping:
+            self.skipping -= 1
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.pieces.append(data)
+
+    def handle_entityref(self, name):
+        # BeautifulSoup leaves entities alone, so do we
+        self.handle_data(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        self.handle_data(u'&#%s;' % name)
+
+    def handle_comment(self, data):
+        self.flush()
+        self.handle_data(data)
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+        self.handle_data(decl)
+        self.flush()
+
+    def close(self):
+        HTMLParser.HTMLParser.close(self)
+        self.flush()
+
+    def text(self):
+        '''
+        Returns the text collected so far.
+        '''
+        return u' '.join(self.fragments)
+
+    def pop_fragments(self):
+        '''
+        Returns the strings collected since the last call.
+        '''
+        fragments, self.fragments = self.fragments, [ ]
+        return fragments
 
 if __name__ == '__main__':
     crawler = Crawler('data')
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+#
+# filename: evaluation.py
+#
+'''
+Measuring how well a trained classifier does on labelled documents it wasn't
+trained with, like the ones in tests/data/test_sports and test_tech.
+
+Documents are scored in batches rather than one classify at a time: every
+document is tokenized once, the counts of all their features are read in one
+go, and the scores of every document in every category come out as a matrix
+(vectorized when NumPy is installed, see scoring.py). Cross-validation works
+the same way from count tables kept in memory, so it never touches the
+database, and the thresholds of the classifier can be picked by sweeping
+them over the score matrix.
+'''
+from scoring import log_probabilities, default_log_probability, numpy
+from page_classifier import merge_counts
+
+def read_labelled(labelled_files):
+    '''
+    Returns the (document, category) pairs in labelled_files, a list of
+    (filename, category) with a document per line.
+    '''
+    documents = [ ]
+    for filename, cat in labelled_files:
+        with open(filename, 'r') as file:
+            documents.extend([ (line, cat) for line in file if line.strip() ])
+    return documents
+
+def scores_from_counts(doc_features, counts, category_counts, weight=1.0, assumed_p=0.5):
+    '''
+    Returns (categories, scores) where scores[i][j] is the score of the
+    document with the features doc_features[i] in categories[j], the same
+    as Classifier.scores gives, from the counts of the features, {feature:
+    {category: count}}, and of the categories.
+    '''
+    categories = sorted(category_counts)
+    total = float(sum(category_counts.values()))
+    priors = [ category_counts[cat] / total for cat in categories ]
+    table = log_probabilities(counts, category_counts, weight, assumed_p)
+    default = default_log_probability(weight, assumed_p)
+    if numpy is None:
+        scores = [ ]
+        for features in doc_features:
+            sums = [ 0.0 ] * len(categories)
+            for feature in features:
+                row = table.get(feature)
+                for j, cat in enumerate(categories):
+                    sums[j] += default if row is None else row[cat]
+            scores.append([ (1 + s) * p for s, p in zip(sums, priors) ])
+        return categories, scores
+    # one row per feature with counts, and a last one for the unseen ones
+    index = dict([ (feature, i) for i, feature in enumerate(table) ])
+    rows = numpy.array(
+                       [ [ table[feature][cat] for cat in categories ] for feature in table ]
+                       + [ [ default ] * len(categories) ]
+                      ).reshape(len(table) + 1, len(categories))
+    unseen = len(table)
+    sums = numpy.array(
+                       [
+                        rows[[ index.get(feature, unseen) for feature in features ]].sum(axis=0)
+                        for features in doc_features
+                       ]
+                      ).reshape(len(doc_features), len(categories))
+    return categories, ((1 + sums) * numpy.array(priors)).tolist()
+
+def score_matrix(classifier, documents, model=None, weight=1.0, assumed_p=0.5):
+    '''
+    Returns (categories, scores) for documents, (document, category) pairs,
+    with the counts of classifier, or of model if given (see
+    scores_from_counts).
+    '''
+    if model is None:
+        model = classifier.storage
+    doc_features = [ list(classifier.get_features(document)) for document, cat in documents ]
+    vocabulary = set()
+    for features in doc_features:
+        vocabulary.update(features)
+    counts = model.feature_counts(list(vocabulary))
+    return scores_from_counts(doc_features, counts, model.category_counts(), weight, assumed_p)
+
+def decisions(classifier, categories, scores):
+    '''
+    Returns the category classifier decides on for each row of scores,
+    None when uncertain (see Classifier.decide).
+    '''
+    return [ classifier.decide(dict(zip(categories, row))) for row in scores ]
+
+def accuracy(classifier, documents, model=None):
+    '''
+    Returns the fraction of documents, (document, category) pairs, that
+    classifier puts in their category, reading the counts from model if
+    given (see page_classifier.Classifier.scores).
+    '''
+    if not documents:
+        return 0.0
+    categories, scores = score_matrix(classifier, documents, model)
+    decided = decisions(classifier, categories, scores)
+    correct = sum([ 1 for (document, cat), best in zip(documents, decided) if best == cat ])
+    return float(correct) / len(documents)
+
+def cross_validate(classifier, documents, folds=5, weight=1.0, assumed_p=0.5):
+    '''
+    Scores every document of documents, (document, category) pairs, with a
+    model trained on the other folds, the documents being dealt into folds
+    round robin. Returns (categories, scores,
+    labels) with the rows of scores and labels in the order of documents.
+
+    Only the get_features of classifier is used: the counts of each fold are
+    kept in memory, and the model for a fold is every count minus its own.
+    '''
+    doc_features = [ list(classifier.get_features(document)) for document, cat in documents ]
+    labels = [ cat for document, cat in documents ]
+    tables = [ ]
+    for fold in range(folds):
+        features, categories = { }, { }
+        for i in range(fold, len(documents), folds):
+            cat = labels[i]
+            for feature in doc_features[i]:
+                features[(feature, cat)] = features.get((feature, cat), 0) + 1
+            categories[cat] = categories.get(cat, 0) + 1
+        tables.append((features, categories))
+    all_features, all_categories = merge_counts(tables)
+    scores = [ None ] * len(documents)
+    categories = sorted(all_categories)
+    for fold, (fold_features, fold_categories) in enumerate(tables):
+        # the model without this fold, as {feature: {category: count}}
+        counts = { }
+        for (feature, cat), count in all_features.items():
+            count -= fold_features.get((feature, cat), 0)
+            if count:
+                counts.setdefault(feature, { })[cat] = float(count)
+        category_counts = dict(
+                               [
+                                (cat, float(all_categories[cat] - fold_categories.get(cat, 0)))
+                                for cat in categories
+                               ]
+                              )
+        held_out = range(fold, len(documents), folds)
+        fold_cats, fold_scores = scores_from_counts(
+                                                    [ doc_features[i] for i in held_out ],
+                                                    counts,
+                                                    category_counts,
+                                                    weight,
+                                                    assumed_p
+                                                   )
+        for i, row in zip(held_out, fold_scores):
+            scores[i] = row
+    return categories, scores, labels
+
+def threshold_sweep(categories, scores, labels, thresholds):
+    '''
+    Returns the precision and recall of each category for each threshold in
+    thresholds, as a list of dictionaries with the keys category, threshold,
+    precision, recall and predicted (the number of documents put in the
+    category, the others it scored best on are left uncertain). The
+    threshold of a category is applied like Classifier.decide does when the
+    category scores best: it's the margin the category's score must beat
+    every other by.
+    '''
+    margins = [ ]
+    for row in scores:
+        ranked = sorted(zip(row, categories), reverse=True)
+        margin = ranked[0][0] - ranked[1][0] if len(ranked) > 1 else float('inf')
+        margins.append((ranked[0][1], margin))
+    report = [ ]
+    for cat in categories:
+        actual = sum([ 1 for label in labels if label == cat ])
+        for threshold in thresholds:
+            predicted = true_positives = 0
+            for (best, margin), label in zip(margins, labels):
+                if best != cat:
+                    continue
+                if margin < threshold:
+                    continue
+                predicted += 1
+                if label == cat:
+                    true_positives += 1
+            report.append(
+                          {
+                           'category': cat,
+                           'threshold': threshold,
+                           'precision': float(true_positives) / predicted if predicted else 0.0,
+                           'recall': float(true_positives) / actual if actual else 0.0,
+                           'predicted': predicted,
+                          }
+                         )
+    return report
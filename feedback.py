@@ -0,0 +1,202 @@
+#!/usr/bin/python
+#
+# filename: feedback.py
+#
+'''
+Learning from the mistakes users report, without making them wait for it.
+
+Reports go into a FeedbackQueue, a SQLite file shared by every process of the
+web frontend, which is all a request pays for. A FeedbackTrainer thread takes
+them out in batches, downloads the pages, trains the classifier with the whole
+batch in a single add_counts and lets the caches know the model changed.
+
+A report stays in the queue until the batch it's in is trained, so nothing is
+lost if a process dies halfway: reports claimed by a trainer that didn't
+finish with them are taken again after CLAIM_TIMEOUT seconds, and released
+by the next trainer to start.
+'''
+import sqlite3, threading, time, traceback
+import crawler, page_classifier
+
+# seconds between two looks at the queue, when nobody wakes the trainer
+FEEDBACK_INTERVAL = 5
+# reports trained together
+FEEDBACK_BATCH_SIZE = 100
+# seconds after which reports claimed by a trainer are up for grabs again
+CLAIM_TIMEOUT = 10 * 60
+
+class FeedbackQueue(object):
+    '''
+    Durable queue of (url, category) reports, oldest first.
+    '''
+    schema = '''
+             CREATE TABLE IF NOT EXISTS feedback_tbl (
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 url TEXT NOT NULL,
+                 category TEXT NOT NULL,
+                 reported REAL NOT NULL,
+                 claimed REAL
+             );
+             '''
+
+    def __init__(self, path):
+        '''
+        path: the SQLite database holding the queue.
+        '''
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('''PRAGMA journal_mode=WAL''')
+        self.db.executescript(self.schema)
+
+    def put(self, url, category):
+        '''
+        Queues the report that the page at url is in category.
+        '''
+        with self.lock:
+            self.db.execute(
+                            '''
+                            INSERT INTO feedback_tbl (url, category, reported)
+                            VALUES (?, ?, ?)
+                            ''',
+                            (url, category, time.time())
+                           )
+
+    def claim(self, limit=FEEDBACK_BATCH_SIZE):
+        '''
+        Returns up to limit reports, (id, url, category), that no other
+        trainer is working on, and marks them as claimed.
+        '''
+        now = time.time()
+        with self.lock:
+            # the write lock is taken up front, so two processes can't claim
+            # the same reports
+            self.db.execute('''BEGIN IMMEDIATE''')
+            try:
+                rows = self.db.execute(
+                                       '''
+                                       SELECT id, url, category FROM feedback_tbl
+                                       WHERE claimed IS NULL OR claimed < ?
+                                       ORDER BY id LIMIT ?
+                                       ''',
+                                       (now - CLAIM_TIMEOUT, limit)
+                                      ).fetchall()
+                self.db.executemany(
+                                    '''UPDATE feedback_tbl SET claimed = ? WHERE id = ?''',
+                                    [ (now, row[0]) for row in rows ]
+                                   )
+                self.db.execute('''COMMIT''')
+            except Exception:
+                self.db.execute('''ROLLBACK''')
+                raise
+        return rows
+
+    def release(self, timeout=None):
+        '''
+        Unclaims the reports claimed more than timeout seconds ago,
+        CLAIM_TIMEOUT by default, returns how many there were.
+        '''
+        if timeout is None:
+            timeout = CLAIM_TIMEOUT
+        with self.lock:
+            return self.db.execute(
+                                   '''
+                                   UPDATE feedback_tbl SET claimed = NULL
+                                   WHERE claimed IS NOT NULL AND claimed < ?
+                                   ''',
+                                   (time.time() - timeout,)
+                                  ).rowcount
+
+    def done(self, ids):
+        '''
+        Removes the reports with ids from the queue.
+        '''
+        with self.lock:
+            self.db.executemany(
+                                '''DELETE FROM feedback_tbl WHERE id = ?''',
+                                [ (report_id,) for report_id in ids ]
+                               )
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('''SELECT COUNT(*) FROM feedback_tbl''').fetchone()[0]
+
+class FeedbackTrainer(threading.Thread):
+    '''
+    Background thread training a classifier with the reports in a queue.
+    '''
+    def __init__(self, queue, classifier, page_crawler=None, on_trained=None,
+                 interval=FEEDBACK_INTERVAL, batch_size=FEEDBACK_BATCH_SIZE):
+        '''
+        queue: the FeedbackQueue the reports are taken from.
+        classifier: the page_classifier.Classifier trained, used only by this
+                    thread.
+        page_crawler: downloads the reported pages.
+        on_trained: called with no arguments after every batch trained, to
+                    refresh the caches of the model.
+        '''
+        threading.Thread.__init__(self)
+        self.daemon       = True
+        self.queue        = queue
+        self.classifier   = classifier
+        self.page_crawler = page_crawler or crawler.Crawler()
+        self.on_trained   = on_trained
+        self.interval     = interval
+        self.batch_size   = batch_size
+        self.wakeup       = threading.Event()
+        self.trained      = 0
+
+    def wake(self):
+        '''
+        Has the trainer look at the queue right away.
+        '''
+        self.wakeup.set()
+
+    def run(self):
+        try:
+            # a trainer killed halfway through a batch, e.g. at interpreter
+            # shutdown, leaves its reports claimed
+            if self.queue.release():
+                self.wakeup.set()
+        except Exception:
+            traceback.print_exc()
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                # keep going while there's a backlog
+                while self.train_batch() == self.batch_size:
+                    pass
+            except Exception:
+                # the reports stay in the queue, they'll be tried again
+                traceback.print_exc()
+
+    def train_batch(self):
+        '''
+        Trains the classifier with a batch of reports, returns how many
+        were taken from the queue.
+        '''
+        reports = self.queue.claim(self.batch_size)
+        if not reports:
+            return 0
+        tables = [ ]
+        for report_id, url, category in reports:
+            try:
+                text = self.page_crawler.download_content(url)
+            except crawler.CrawlerError:
+                # the page is gone, nothing to learn from it
+                continue
+            tables.append(
+                          page_classifier.count_features(
+                                                         [ text ],
+                                                         category,
+                                                         self.classifier.get_features
+                                                        )
+                         )
+        features, categories = page_classifier.merge_counts(tables)
+        if categories:
+            self.classifier.add_counts(features, categories)
+        self.queue.done([ report[0] for report in reports ])
+        self.trained += len(tables)
+        if self.on_trained is not None:
+            self.on_trained()
+        return len(reports)
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+#
+# filename: frontier.py
+#
+'''
+Memory of the crawler between runs, kept in a SQLite file.
+
+The frontier knows every url given to the crawler, under its label, and what
+happened to it (a url has a single label: given again under another one, it's
+left under the first and reported by Frontier.add):
+
+ pending     --> still to be downloaded, a run that stopped halfway picks
+                 these up where it left off
+ done        --> downloaded and written to the file of its label
+ duplicate   --> downloaded, but the same document was already written
+ failed      --> couldn't be downloaded
+
+Downloaded urls keep the ETag and Last-Modified the server sent, so fetching
+them again is a conditional GET that costs nothing when the page didn't
+change, and the digest of every document written, so the same document is
+never written twice under any url (see crawler.document_digest).
+'''
+import sqlite3, time
+from crawler import normalize_url
+
+class Frontier(object):
+    '''
+    The state of the crawl, given to crawler.Crawler to make it resumable.
+    Used by the thread running Crawler.crawl only.
+    '''
+    schema = '''
+             CREATE TABLE IF NOT EXISTS url_tbl (
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 url TEXT NOT NULL UNIQUE,
+                 label TEXT NOT NULL,
+                 state TEXT NOT NULL,
+                 etag TEXT,
+                 last_modified TEXT,
+                 fetched REAL
+             );
+             CREATE INDEX IF NOT EXISTS url_state_idx ON url_tbl(label, state);
+             CREATE TABLE IF NOT EXISTS digest_tbl (
+                 digest TEXT NOT NULL PRIMARY KEY,
+                 url TEXT NOT NULL
+             );
+             '''
+
+    def __init__(self, path):
+        '''
+        path: the SQLite database holding the frontier.
+        '''
+        self.db = sqlite3.connect(path)
+        self.db.execute('''PRAGMA journal_mode=WAL''').fetchall()
+        self.db.executescript(self.schema)
+        self.db.commit()
+
+    def add(self, urls, label, refetch=False):
+        '''
+        Adds urls to the frontier under label. Urls already in it are left
+        alone, unless refetch is True: then they are downloaded again (with a
+        conditional GET if they were downloaded before). Returns the urls
+        that were already in it under another label, as (url, label), which
+        aren't added.
+        '''
+        urls = [ normalize_url(url) for url in urls if url.strip() ]
+        conflicts = [ ]
+        for url in urls:
+            row = self.db.execute(
+                                  '''SELECT label FROM url_tbl WHERE url = ?''',
+                                  (url,)
+                                 ).fetchone()
+            if row is not None and row[0] != label:
+                conflicts.append((url, row[0]))
+        self.db.executemany(
+                            '''
+                            INSERT OR IGNORE INTO url_tbl (url, label, state)
+                            VALUES (?, ?, 'pending')
+                            ''',
+                            [ (url, label) for url in urls ]
+                           )
+        if refetch:
+            self.db.executemany(
+                                '''
+                                UPDATE url_tbl SET state = 'pending'
+                                WHERE url = ? AND label = ?
+                                ''',
+                                [ (url, label) for url in urls ]
+                               )
+        self.db.commit()
+        return conflicts
+
+    def pending(self, label):
+        '''
+        Returns the urls of label still to be downloaded, as (url, etag,
+        last_modified) in the order they were added.
+        '''
+        return self.db.execute(
+                               '''
+                               SELECT url, etag, last_modified FROM url_tbl
+                               WHERE label = ? AND state = 'pending'
+                               ORDER BY id
+                               ''',
+                               (label,)
+                              ).fetchall()
+
+    def owner(self, digest):
+        '''
+        Returns the url the document with digest was written for, None if it
+        wasn't written yet.
+        '''
+        row = self.db.execute(
+                              '''SELECT url FROM digest_tbl WHERE digest = ?''',
+                              (digest,)
+                             ).fetchone()
+        return row and row[0]
+
+    def record(self, url, state, etag=None, last_modified=None, digest=None):
+        '''
+        Records what happened to url, and the digest of the document written
+        for it if any, in a single transaction. Validators that aren't given
+        keep their previous value.
+        '''
+        self.db.execute(
+                        '''
+                        UPDATE url_tbl SET state = ?, fetched = ?,
+                        etag = COALESCE(?, etag),
+                        last_modified = COALESCE(?, last_modified)
+                        WHERE url = ?
+                        ''',
+                        (state, time.time(), etag, last_modified, url)
+                       )
+        if digest is not None:
+            self.db.execute(
+                            '''
+                            INSERT OR IGNORE INTO digest_tbl (digest, url)
+                            VALUES (?, ?)
+                            ''',
+                            (digest, url)
+                           )
+        self.db.commit()
+
+    def counts(self, label):
+        '''
+        Returns the number of urls of label in every state.
+        '''
+        return dict(
+                    self.db.execute(
+                                    '''
+                                    SELECT state, COUNT(*) FROM url_tbl
+                                    WHERE label = ? GROUP BY state
+                                    ''',
+                                    (label,)
+                                   ).fetchall()
+                   )
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+#
+# filename: hashed_storage.py
+#
+'''
+Store with a fixed memory footprint for very large vocabularies.
+
+Features aren't stored: each one is hashed into one of 2^bits buckets, and
+every category keeps a dense array with a count per bucket. The model takes
+4 * 2^bits bytes per category however many words it has seen, a lookup is a
+hash and an index, and two models with the same number of buckets merge by
+adding up their arrays. The price is that features sharing a bucket share a
+count, which costs a little accuracy when the buckets are few for the
+vocabulary.
+
+The model lives in memory, and in a file if the store is given a path:
+it's read when the store is opened and written by save and close.
+
+Layout of the file (integers are little endian unsigned 32 bits):
+
+ header     --> magic, version, bits, generation, #categories
+ categories --> for each category, the length of its UTF-8 name, the name and
+                its count of documents
+ counts     --> for each category, in the same order, its 2^bits counts
+'''
+import array, os, struct, sys, threading, zlib
+from storage import Storage
+
+# buckets are 2^HASH_BITS by default, 4MB per category
+HASH_BITS = 20
+
+MAGIC   = 'ISITXHSH'
+VERSION = 1
+HEADER  = struct.Struct('<8sIIII')
+INT     = struct.Struct('<I')
+
+def bucket(feat, mask):
+    '''
+    Returns the bucket of feat, the same on every platform and process.
+    '''
+    if isinstance(feat, unicode):
+        feat = feat.encode('utf-8')
+    return zlib.crc32(feat) & mask
+
+def empty_counts(bits):
+    return array.array('I', [ 0 ]) * (1 << bits)
+
+class HashedStorage(Storage):
+    '''
+    Keeps the counts of hashed features in an array per category.
+    '''
+    def __init__(self, bits=HASH_BITS, path=None):
+        '''
+        bits: the model has 2^bits buckets, ignored when loading an existing
+              file, which has its own.
+        path: file the model is read from, if it exists, and saved to.
+        '''
+        self.lock = threading.RLock()
+        self.path = path
+        self.bits = bits
+        self.category_table = { }
+        self.arrays = { }
+        self.current_generation = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+        self.mask = (1 << self.bits) - 1
+
+    def feature_counts(self, features):
+        with self.lock:
+            counts = { }
+            for feat in features:
+                i = bucket(feat, self.mask)
+                feat_counts = dict(
+                                   [
+                                    (cat, float(cat_array[i]))
+                                    for cat, cat_array in self.arrays.items()
+                                    if cat_array[i]
+                                   ]
+                                  )
+                if feat_counts:
+                    counts[feat] = feat_counts
+            return counts
+
+    def category_counts(self):
+        with self.lock:
+            return dict(self.category_table)
+
+    def iter_features(self):
+        '''
+        The feature names are gone, so there are none to go over: exporting
+        to a model file or pruning a hashed model isn't possible.
+        '''
+        raise NotImplementedError('hashed models do not keep feature names')
+
+    def iter_buckets(self):
+        '''
+        Goes over the buckets that have counts, numbered from 0 to
+        2^bits - 1, with their counts.
+        '''
+        with self.lock:
+            arrays = self.arrays.items()
+        for i in xrange(1 << self.bits):
+            counts = dict(
+                          [
+                           (cat, float(cat_array[i]))
+                           for cat, cat_array in arrays
+                           if cat_array[i]
+                          ]
+                         )
+            if counts:
+                yield i, counts
+
+    def category_array(self, cat):
+        '''
+        Returns the array of counts of cat, creating it if needed.
+        '''
+        if cat not in self.arrays:
+            self.arrays[cat] = empty_counts(self.bits)
+            self.category_table.setdefault(cat, 0.0)
+        return self.arrays[cat]
+
+    def add_counts(self, features, categories):
+        with self.lock:
+            for (feat, cat), count in features.items():
+                self.category_array(cat)[bucket(feat, self.mask)] += int(count)
+            for cat, count in categories.items():
+                self.category_array(cat)
+                self.category_table[cat] += count
+            self.current_generation += 1
+
+    def merge(self, other):
+        '''
+        Adds the counts of other, a HashedStorage with as many buckets, to
+        this one.
+        '''
+        if other.bits != self.bits:
+            raise ValueError('can only merge models with the same number of buckets')
+        with self.lock:
+            for cat, other_array in other.arrays.items():
+                cat_array = self.category_array(cat)
+                for i in xrange(len(other_array)):
+                    if other_array[i]:
+                        cat_array[i] += other_array[i]
+            for cat, count in other.category_table.items():
+                self.category_table[cat] += count
+            self.current_generation += 1
+
+    def remove_features(self, features):
+        '''
+        Empties the buckets of features, which also drops the counts of any
+        other feature sharing them.
+        '''
+        with self.lock:
+            for feat in features:
+                i = bucket(feat, self.mask)
+                for cat_array in self.arrays.values():
+                    cat_array[i] = 0
+            self.current_generation += 1
+
+    def generation(self):
+        with self.lock:
+            return self.current_generation
+
+    def changed_features(self, since):
+        # there are no feature names to log, and lookups are cheap enough for
+        # caches to just start over
+        return None
+
+    def reset(self):
+        with self.lock:
+            self.category_table = { }
+            self.arrays = { }
+            self.current_generation += 1
+
+    def load(self, path):
+        '''
+        Reads the model in path.
+        '''
+        with open(path, 'rb') as file:
+            magic, version, self.bits, self.current_generation, n_categories = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('%s is not a version %d hashed model' % (path, VERSION))
+            categories = [ ]
+            for i in range(n_categories):
+                length, = INT.unpack(file.read(INT.size))
+                cat = file.read(length).decode('utf-8')
+                count, = INT.unpack(file.read(INT.size))
+                self.category_table[cat] = float(count)
+                categories.append(cat)
+            for cat in categories:
+                cat_array = array.array('I')
+                cat_array.fromfile(file, 1 << self.bits)
+                if sys.byteorder != 'little':
+                    cat_array.byteswap()
+                self.arrays[cat] = cat_array
+
+    def save(self, path=None):
+        '''
+        Writes the model to path, by default the one the store was opened
+        with. Like model_file.export_model, the file is written next to path
+        and renamed over it once complete.
+        '''
+        path = path or self.path
+        with self.lock:
+            categories = sorted(self.arrays)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(
+                           HEADER.pack(
+                                       MAGIC,
+                                       VERSION,
+                                       self.bits,
+                                       self.current_generation,
+                                       len(categories)
+                                      )
+                          )
+                for cat in categories:
+                    name = cat.encode('utf-8') if isinstance(cat, unicode) else cat
+                    file.write(INT.pack(len(name)))
+                    file.write(name)
+                    file.write(INT.pack(int(self.category_table[cat])))
+                for cat in categories:
+                    cat_array = self.arrays[cat]
+                    if sys.byteorder != 'little':
+                        cat_array = array.array('I', cat_array)
+                        cat_array.byteswap()
+                    cat_array.tofile(file)
+            os.rename(tmp_path, path)
+
+    def close(self):
+        '''
+        Saves the model if the store has a file.
+        '''
+        if self.path is not None:
+            self.save()
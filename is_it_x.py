@@ -10,13 +10,223 @@ URL structure:
  /                --> main page with form for url
  /classify/       --> retrieves data from url, classifies it and shows result
  /report_mistake/ --> reports a mistaken classification, trains app with page
+                     (not found for read only models)
+ /api/classify/   --> classifies a batch of urls and documents, as json
+ /stats/          --> hit and miss counters of the caches, as json
+ /metrics         --> counters and timings of every stage, for Prometheus
  /error/          --> prints out error when given an invalid URL
 '''
-from flask import Flask, request, render_template, redirect, url_for
+from flask import Flask, Response, request, render_template, redirect, url_for, jsonify, g
+from flask import has_request_context, abort
+from multiprocessing.pool import ThreadPool
 from config import *
-import crawler, page_classifier
+import threading, time, traceback
+import crawler, page_classifier, model_cache, result_cache, metrics, feedback
+from storage import SQLStorage
 app = Flask(__name__)
 
+# time taken by each page submitted, from the first cache lookup to the answer
+CLASSIFY_SECONDS = metrics.Histogram('isitx_classify_url_seconds', 'Time classifying submitted pages')
+metrics.enable(METRICS_ENABLED)
+
+# results of classifying pages, by url and by content
+results = result_cache.ResultCache(
+                                   RESULT_CACHE_TTL,
+                                   RESULT_CACHE_SIZE,
+                                   RESULT_CACHE_PATH
+                                  )
+
+# the classifier and its cached model are shared by every request this process
+# serves, they get created on the first classification
+classifier = None
+model      = None
+model_lock = threading.Lock()
+
+# pages of batch requests are classified by this many threads in total, so
+# large batches queue up behind each other instead of taking over the server
+batch_pool = ThreadPool(BATCH_WORKERS)
+
+# mistakes reported by users are queued and trained in the background, by a
+# trainer started along with the model
+feedback_queue   = feedback.FeedbackQueue(FEEDBACK_QUEUE_PATH)
+feedback_trainer = None
+
+def trainer_storage(storage):
+    '''
+    Returns the store the feedback trainer writes the model through. Stores
+    in a database get one of their own, sharing the pool of connections of
+    the process (MySQL) or with a connection of its own (SQLite). The others
+    keep the model in this process, and the trainer has to write to the very
+    store the requests read.
+    '''
+    if isinstance(storage, SQLStorage):
+        return DB
+    return storage
+
+def get_model(hold=True):
+    '''
+    Returns the shared classifier and model cache, refreshed with any changes
+    to the model made since the last request. With hold, the request keeps
+    a connection to the database from now on (see hold_connection).
+    '''
+    global classifier, model, feedback_trainer
+    with model_lock:
+        if model is None:
+            classifier = page_classifier.Classifier(page_classifier.get_words, DB)
+            for category, threshold in THRESHOLDS.items():
+                classifier.set_threshold(category, threshold)
+            model = model_cache.ModelCache(classifier.storage, MODEL_CACHE_BYTES)
+            # models in files opened read only can't learn from mistakes
+            if not classifier.storage.read_only:
+                feedback_trainer = feedback.FeedbackTrainer(
+                                                            feedback_queue,
+                                                            page_classifier.Classifier(
+                                                                                       page_classifier.get_words,
+                                                                                       trainer_storage(classifier.storage)
+                                                                                      ),
+                                                            crawler.Crawler(
+                                                                            max_bytes=PAGE_MAX_BYTES,
+                                                                            deadline=PAGE_DEADLINE
+                                                                           ),
+                                                            model.refresh,
+                                                            FEEDBACK_INTERVAL
+                                                           )
+                feedback_trainer.start()
+    if hold:
+        hold_connection()
+    model.refresh()
+    return classifier, model
+
+def hold_connection():
+    '''
+    Has the current request, if any, use a single connection to the
+    database, checked out now and put back when it ends. Until then every
+    read of the model checks one out for itself.
+    '''
+    if has_request_context() and getattr(g, 'storage', None) is None:
+        classifier.storage.acquire()
+        g.storage = classifier.storage
+
+@app.teardown_request
+def release_storage(exception):
+    '''
+    Puts back the connection to the database the request used, if any.
+    '''
+    storage = getattr(g, 'storage', None)
+    if storage is not None:
+        g.storage = None
+        storage.release(exception is not None)
+
+def best_category(scores):
+    '''
+    Returns the result for a document with scores: its category (None if
+    it's too close to call, see Classifier.decide) and its score for every
+    category.
+    '''
+    return {
+            'category': classifier.decide(scores),
+            'scores': scores,
+           }
+
+def classify_url(url, timings=None):
+    '''
+    Returns the classification of the page at url, as a dictionary with its
+    category and its score for every category. Pages whose url or content
+    was already classified with the current model come from the result
+    cache, anything else is downloaded and classified. Throws a
+    crawler.CrawlerError if the page can't be downloaded.
+
+    timings: if given, a dictionary where the seconds spent downloading and
+             classifying the page are stored, under fetch and classify (both
+             under classify when they overlap, see EARLY_EXIT_MARGIN).
+    '''
+    if timings is None:
+        timings = { }
+    with metrics.timer(CLASSIFY_SECONDS):
+        # no connection is held while the page downloads
+        classifier, model = get_model(hold=False)
+        classification = results.get_url(url, model.generation)
+        if classification is not None:
+            return classification
+        started = time.time()
+        page_crawler = crawler.Crawler(
+                                       max_bytes=PAGE_MAX_BYTES,
+                                       deadline=PAGE_DEADLINE
+                                      )
+        response = page_crawler.open_page(url)
+        if EARLY_EXIT_MARGIN is None:
+            # the whole page is read anyway, so we can look for its content
+            # in the cache before parsing it
+            chunks = list(page_crawler.read_chunks(response))
+            timings['fetch'] = time.time() - started
+            digest = result_cache.content_digest(''.join(chunks))
+            classification = results.get_content(url, digest, model.generation)
+            if classification is not None:
+                return classification
+            hold_connection()
+            started = time.time()
+            fragments = crawler.text_fragments(chunks, response.charset, url)
+            classification = best_category(classifier.scores_stream(fragments, model))
+            timings['classify'] = time.time() - started
+        else:
+            # we stop downloading the page as soon as the classification is
+            # clear, hashing it on the way. The download goes on between
+            # reads of the model, which check out a connection each
+            chunks = result_cache.HashedChunks(page_crawler.read_chunks(response))
+            fragments = crawler.text_fragments(chunks, response.charset, url)
+            classification = best_category(
+                                           classifier.scores_stream(
+                                                                    fragments,
+                                                                    model,
+                                                                    EARLY_EXIT_MARGIN
+                                                                   )
+                                          )
+            # downloading and parsing overlap, they're timed as one
+            timings['classify'] = time.time() - started
+            fragments.close()
+            # a page read to the end is cached by content, one cut short only
+            # by url
+            digest = chunks.digest() or result_cache.url_digest(url)
+        results.put(url, digest, model.generation, classification)
+        return classification
+
+def full_url(url):
+    '''
+    Returns url with http:// in front if it has no scheme, for bare host
+    names like example.com.
+    '''
+    url = url.strip()
+    if '://' not in url:
+        url = 'http://' + url
+    return url
+
+def classify_item(item):
+    '''
+    Classifies an item of a batch request: a url to download or a text
+    document. Returns the item's entry in the response.
+    '''
+    started = time.time()
+    timings = { }
+    entry = dict(item)
+    try:
+        if 'url' in item:
+            entry.update(classify_url(full_url(item['url']), timings))
+        else:
+            classifier, model = get_model()
+            entry.update(best_category(classifier.scores(item['text'], model)))
+            timings['classify'] = time.time() - started
+    except crawler.CrawlerError, error:
+        entry['error'] = str(error)
+    except Exception, error:
+        # a bad item mustn't fail the whole batch
+        traceback.print_exc()
+        entry['error'] = '%s: %s' % (error.__class__.__name__, error)
+    timings['total'] = time.time() - started
+    entry['seconds'] = timings
+    # no need to send the documents back
+    entry.pop('text', None)
+    return entry
+
 @app.route('/')
 def main_page():
     '''
@@ -33,30 +243,113 @@ def classify():
     in category X
     '''
     if request.method == 'POST':
-        # create our crawler and classifier
-        page_crawler = crawler.Crawler()
-        classifier   = page_classifier.Classifier(page_classifier.get_words,DB)
-        url = request.form['domain']
-        if url[:7] != 'http://':
-            url = 'http://' + url
+        url = full_url(request.form['domain'])
         url_error = ''
-        # get the page's content
+        # get the classification for the page's content
         try:
-            url_content = page_crawler.download_content(url)
+            classification = classify_url(url)
         except crawler.CrawlerError:
             return redirect(url_for('error'))
-        # get the classification for the text
         # determine if text is classified as X and return as such
-        classification = classifier.classify(url_content)
-        if classification == X:
+        if classification['category'] is None:
+            result = "Can't tell whether %s is %s" % (url, X)
+        elif classification['category'] == X:
             result = 'Yes %s is %s' % (url, X)
         else:
             result = 'No %s is NOT %s' % (url, X)
-
-        return render_template('result.html', message=result, url=url)
+        # the categories the user can say the page is in instead, if the
+        # model can be trained
+        others = sorted(
+                        [
+                         category for category in classification['scores']
+                         if category != classification['category']
+                         and feedback_trainer is not None
+                        ]
+                       )
+        return render_template(
+                               'result.html',
+                               message=result,
+                               url=url,
+                               categories=others
+                              )
     else:
         return redirect(url_for('main_page'))
 
+@app.route('/report_mistake/', methods=['GET', 'POST'])
+def report_mistake():
+    '''
+    Queues the page the user says was misclassified to be trained under the
+    category they picked. The training happens in the background, the page
+    answers right away.
+    '''
+    if request.method != 'POST':
+        return redirect(url_for('main_page'))
+    classifier, model = get_model()
+    if feedback_trainer is None:
+        abort(404)
+    url = request.form['url']
+    category = request.form['category']
+    if category not in model.category_counts():
+        return redirect(url_for('error'))
+    feedback_queue.put(url, category)
+    feedback_trainer.wake()
+    return render_template('reported.html', url=url, category=category)
+
+@app.route('/api/classify/', methods=['POST'])
+def api_classify():
+    '''
+    Classifies a batch of pages and documents. Takes json like
+
+        {"urls": ["http://...", ...], "documents": ["some text", ...]}
+
+    and returns, in the same order (urls first), the category, the score
+    for every category and the seconds spent on each item. Items that
+    failed have an error instead. Urls without a scheme are taken to be
+    http.
+    '''
+    batch = request.get_json(silent=True)
+    if not isinstance(batch, dict):
+        return jsonify(error='expected a json object'), 400
+    for key in ('urls', 'documents'):
+        values = batch.get(key, [ ])
+        if not isinstance(values, list) or not all([ isinstance(value, basestring) for value in values ]):
+            return jsonify(error='%s must be a list of strings' % key), 400
+    items  = [ {'url': url} for url in batch.get('urls', [ ]) ]
+    items += [ {'text': text} for text in batch.get('documents', [ ]) ]
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify(error='at most %d items per batch' % BATCH_MAX_ITEMS), 400
+    started = time.time()
+    entries = batch_pool.map(classify_item, items)
+    return jsonify(results=entries, seconds=time.time() - started)
+
+@app.route('/stats/')
+def stats():
+    '''
+    Returns the hit and miss counters of the caches of this process as json.
+    '''
+    classifier, model = get_model()
+    return jsonify(
+                   results=results.stats(),
+                   model={'hits': model.hits, 'misses': model.misses}
+                  )
+
+@app.route('/metrics')
+def metrics_page():
+    '''
+    Returns the metrics of this process, and the counters of its caches, in
+    the Prometheus text format.
+    '''
+    classifier, model = get_model()
+    cache = results.stats()
+    gauges = [
+              ('isitx_model_cache_hits', 'Features found in the model cache', model.hits),
+              ('isitx_model_cache_misses', 'Features read from the store', model.misses),
+              ('isitx_result_cache_url_hits', 'Pages answered from the result cache by url', cache['url_hits']),
+              ('isitx_result_cache_content_hits', 'Pages answered from the result cache by content', cache['content_hits']),
+              ('isitx_result_cache_misses', 'Pages classified from scratch', cache['misses']),
+             ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/error/')
 def error():
     '''
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#
+# filename: metrics.py
+#
+'''
+In process counters and histograms for the stages of classifying a page, and
+their rendering in the Prometheus text format.
+
+Modules declare their metrics once, at import time:
+
+    PARSE_SECONDS = metrics.Histogram('isitx_parse_seconds', 'Time parsing pages')
+
+and record to them on the hot path. Recording is off until enable() is
+called, and while off it costs a function call and a test.
+'''
+import threading, time
+
+# buckets of the histograms of seconds, bytes and counts of things
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS   = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS   = (10, 30, 100, 300, 1000, 3000, 10000, 30000)
+
+enabled  = False
+registry = [ ]
+lock     = threading.Lock()
+
+def enable(on=True):
+    '''
+    Turns recording on (or off) for every metric.
+    '''
+    global enabled
+    enabled = on
+
+class Counter(object):
+    '''
+    A count that only goes up.
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name  = name
+        self.help  = help
+        self.value = 0
+        registry.append(self)
+
+    def inc(self, amount=1):
+        if not enabled:
+            return
+        with lock:
+            self.value += amount
+
+    def samples(self):
+        return [ (self.name, '', self.value) ]
+
+class Histogram(object):
+    '''
+    Counts of observed values by bucket, with their sum.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=SECONDS_BUCKETS):
+        self.name    = name
+        self.help    = help
+        self.buckets = tuple(buckets)
+        self.counts  = [ 0 ] * (len(self.buckets) + 1)
+        self.sum     = 0.0
+        registry.append(self)
+
+    def observe(self, value):
+        if not enabled:
+            return
+        # the last count is for values above every bucket
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        with lock:
+            counts, total = list(self.counts), self.sum
+        samples = [ ]
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            samples.append((self.name + '_bucket', '{le="%s"}' % bound, cumulative))
+        samples.append((self.name + '_sum', '', total))
+        samples.append((self.name + '_count', '', cumulative))
+        return samples
+
+class Timer(object):
+    '''
+    Context manager observing the seconds spent in its block into a
+    histogram.
+    '''
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.time() - self.started)
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+null_timer = NullTimer()
+
+def timer(histogram):
+    '''
+    Returns a context manager timing its block into histogram, or one doing
+    nothing when recording is off.
+    '''
+    if not enabled:
+        return null_timer
+    return Timer(histogram)
+
+def render(gauges=None):
+    '''
+    Returns every metric in the Prometheus text format, followed by gauges,
+    a list of (name, help, value) read by the caller at render time.
+    '''
+    lines = [ ]
+    for metric in registry:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            lines.append('%s%s %s' % (name, labels, repr(float(value))))
+    for name, help, value in gauges or [ ]:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %s' % (name, repr(float(value))))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+#
+# filename: model_cache.py
+#
+'''
+A long lived, in process copy of the parts of the trained model that
+classification reads, so the web frontend doesn't go to the database for every
+feature of every page it classifies.
+'''
+import sys, threading
+from collections import OrderedDict
+from scoring import log_sums, count_rows, numpy
+
+# default memory cap for the cached feature counts, in bytes
+MODEL_CACHE_BYTES = 64 * 1024 * 1024
+
+def row_size(feat, row):
+    '''
+    Rough number of bytes taken by the count row of feat.
+    '''
+    return sys.getsizeof(feat) + sys.getsizeof(row)
+
+def entry_size(feat, counts):
+    '''
+    Rough number of bytes taken by the cache entry of feat.
+    '''
+    size = sys.getsizeof(feat) + sys.getsizeof(counts)
+    for cat, count in counts.items():
+        size += sys.getsizeof(cat) + sys.getsizeof(count)
+    return size
+
+class ModelCache(object):
+    '''
+    Snapshot of the category counts and an LRU cache of feature counts read
+    from a source (a storage.Storage). It can be given as the model to
+    Classifier.classify and Classifier.scores.
+
+    Every call to refresh checks the generation of the model in the database.
+    If the model changed, only the features logged as changed are read again;
+    the whole cache is dropped only when the log doesn't go back far enough.
+
+    With NumPy, the cache also keeps the counts of each feature as the row
+    of the count matrix scoring works on (see log_sums), so scoring a page
+    whose features are cached skips gathering them. The rows don't depend on
+    the counts of the categories, they stay valid as documents are added and
+    are dropped only when their feature changes or a category is added.
+
+    Threads check out a connection of the source before taking the lock of
+    the cache, never the other way around: a thread holding the lock while
+    waiting for a connection would keep out the threads holding them.
+    '''
+    def __init__(self, source, max_bytes=MODEL_CACHE_BYTES):
+        '''
+        source: where the counts are read from, must have the feature_counts,
+                category_counts, generation, changed_features, sync and
+                checkout methods of storage.Storage.
+        max_bytes: memory cap for the cached feature counts and count rows.
+        '''
+        self.source    = source
+        self.max_bytes = max_bytes
+        self.lock      = threading.RLock()
+        self.features  = OrderedDict()
+        self.size      = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.generation = None
+        self.categories = { }
+        # rows of scoring.count_rows for cached features that have counts,
+        # with the categories in the order of columns
+        self.rows      = { }
+        self.columns   = [ ]
+        self.rows_size = 0
+
+    def clear(self):
+        '''
+        Drops every cached feature.
+        '''
+        with self.lock:
+            self.features = OrderedDict()
+            self.size = 0
+            self.clear_rows()
+
+    def clear_rows(self):
+        '''
+        Drops every cached count row.
+        '''
+        self.rows = { }
+        self.rows_size = 0
+
+    def forget_row(self, feat):
+        '''
+        Drops the count row of feat, if cached.
+        '''
+        row = self.rows.pop(feat, None)
+        if row is not None:
+            self.rows_size -= row_size(feat, row)
+
+    def refresh(self):
+        '''
+        Brings the cache up to date with the generation of the model in the
+        source. Cheap when nothing changed: a single query.
+        '''
+        with self.source.checkout():
+            with self.lock:
+                self.source.sync()
+                generation = self.source.generation()
+                if generation == self.generation:
+                    return
+                if self.generation is None:
+                    changed = None
+                else:
+                    changed = self.source.changed_features(self.generation)
+                if changed is None:
+                    self.clear()
+                else:
+                    # read again the changed features we had cached, anything
+                    # else will be read when it's needed
+                    stale = [ feat for feat in changed if feat in self.features ]
+                    for feat in stale:
+                        self.forget(feat)
+                    self.store(stale, self.source.feature_counts(stale))
+                categories = self.source.category_counts()
+                # rows have a column per category, new categories need new
+                # rows, new counts of the categories don't
+                if set(categories) != set(self.columns):
+                    self.clear_rows()
+                    self.columns = sorted(categories)
+                self.categories = categories
+                self.generation = generation
+
+    def forget(self, feat):
+        '''
+        Removes feat from the cache.
+        '''
+        counts = self.features.pop(feat)
+        self.forget_row(feat)
+        self.size -= entry_size(feat, counts)
+
+    def store(self, features, counts):
+        '''
+        Caches the counts of features, including the ones not in counts
+        (features never seen), then evicts the least recently used features
+        until the cache fits in max_bytes.
+        '''
+        for feat in features:
+            if feat in self.features:
+                continue
+            feat_counts = counts.get(feat, { })
+            self.features[feat] = feat_counts
+            self.size += entry_size(feat, feat_counts)
+        while self.size + self.rows_size > self.max_bytes and self.features:
+            feat, feat_counts = self.features.popitem(last=False)
+            self.forget_row(feat)
+            self.size -= entry_size(feat, feat_counts)
+
+    def feature_counts(self, features):
+        '''
+        Same as Classifier.feature_counts, reading from the source only the
+        features that aren't cached.
+        '''
+        with self.source.checkout():
+            with self.lock:
+                counts = { }
+                missing = [ ]
+                for feat in features:
+                    if feat in self.features:
+                        # move it to the most recently used end
+                        feat_counts = self.features.pop(feat)
+                        self.features[feat] = feat_counts
+                        if feat_counts:
+                            counts[feat] = feat_counts
+                        self.hits += 1
+                    else:
+                        missing.append(feat)
+                self.misses += len(missing)
+                if missing:
+                    loaded = self.source.feature_counts(missing)
+                    counts.update(loaded)
+                    self.store(missing, loaded)
+                return counts
+
+    def log_sums(self, features, category_counts=None, weight=1.0, assumed_p=0.5):
+        '''
+        Same as scoring.log_sums for features, reading the counts through
+        the cache and scoring them from the cached count rows. The sums are
+        for category_counts, the snapshot of the cache by default.
+        '''
+        with self.source.checkout():
+            with self.lock:
+                if self.generation is None:
+                    self.refresh()
+                if category_counts is None:
+                    category_counts = self.categories
+                counts = self.feature_counts(features)
+                if numpy is None or set(category_counts) != set(self.columns):
+                    return log_sums(features, counts, category_counts, weight, assumed_p)
+                missing = dict(
+                               [
+                                (feat, feat_counts)
+                                for feat, feat_counts in counts.items()
+                                if feat not in self.rows
+                               ]
+                              )
+                rows = count_rows(missing, self.columns)
+                for feat, row in rows.items():
+                    # only rows for features in the cache, so they're evicted
+                    # along with them
+                    if feat in self.features:
+                        self.rows[feat] = row
+                        self.rows_size += row_size(feat, row)
+                rows.update(
+                            [
+                             (feat, self.rows[feat])
+                             for feat in counts if feat in self.rows
+                            ]
+                           )
+                # the rows are in the order of columns
+                ordered = OrderedDict([ (cat, category_counts[cat]) for cat in self.columns ])
+                return log_sums(features, counts, ordered, weight, assumed_p, rows)
+
+    def category_counts(self):
+        '''
+        Same as Classifier.category_counts, from the snapshot.
+        '''
+        with self.source.checkout():
+            with self.lock:
+                if self.generation is None:
+                    self.refresh()
+                return dict(self.categories)
+
+    def total_count(self):
+        '''
+        Total number of documents in the snapshot.
+        '''
+        return sum(self.category_counts().values())
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#
+# filename: model_file.py
+#
+'''
+Compact, read only model files for the web processes that only classify.
+
+export_model dumps the counts of a store into a single binary file, and
+MappedStorage serves them straight from a memory mapped copy of it: opening
+the model is one mmap call, lookups read the mapped pages in place, and every
+process mapping the same file shares one copy in the page cache.
+
+Layout of the file (all integers are little endian unsigned 32 bits):
+
+ header          --> magic, version, generation, #categories, #features
+ category counts --> #categories integers
+ name offsets    --> #categories + #features + 1 offsets into the names
+ feature counts  --> #features rows of #categories integers
+ names           --> the UTF-8 category names followed by the feature names,
+                     in byte order so features can be binary searched
+'''
+import mmap, os, struct
+from storage import Storage
+
+MAGIC   = 'ISITXMDL'
+VERSION = 1
+HEADER  = struct.Struct('<8sIIII')
+INT     = struct.Struct('<I')
+
+def encode(name):
+    '''
+    Returns name as a UTF-8 byte string.
+    '''
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+def export_model(storage, filename):
+    '''
+    Writes the counts in storage to filename. The file is written next to
+    filename and renamed over it once complete, so processes opening it
+    never see a half written model.
+    '''
+    categories = sorted(storage.category_counts().items())
+    cat_index = dict([ (cat, i) for i, (cat, count) in enumerate(categories) ])
+    features = sorted(
+                      [
+                       (encode(feat), counts)
+                       for feat, counts in storage.iter_features()
+                      ]
+                     )
+    names = [ encode(cat) for cat, count in categories ]
+    names.extend([ feat for feat, counts in features ])
+    offsets = [ 0 ]
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as file:
+        file.write(
+                   HEADER.pack(
+                               MAGIC,
+                               VERSION,
+                               storage.generation(),
+                               len(categories),
+                               len(features)
+                              )
+                  )
+        file.write(
+                   struct.pack(
+                               '<%dI' % len(categories),
+                               *[ int(count) for cat, count in categories ]
+                              )
+                  )
+        file.write(struct.pack('<%dI' % len(offsets), *offsets))
+        for feat, counts in features:
+            row = [ 0 ] * len(categories)
+            for cat, count in counts.items():
+                if cat in cat_index:
+                    row[cat_index[cat]] = int(count)
+            file.write(struct.pack('<%dI' % len(row), *row))
+        file.write(''.join(names))
+    os.rename(tmp_filename, filename)
+
+class MappedStorage(Storage):
+    '''
+    Read only store over a model file written by export_model.
+    '''
+    read_only = True
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.model_generation, self.n_categories, self.n_features = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d model file' % (filename, VERSION))
+        # where each section of the file starts
+        self.category_start = HEADER.size
+        self.offsets_start  = self.category_start + INT.size * self.n_categories
+        self.counts_start   = self.offsets_start + INT.size * (self.n_categories + self.n_features + 1)
+        self.names_start    = self.counts_start + INT.size * self.n_categories * self.n_features
+        # the categories are few, decode them once
+        self.category_names = [
+                               self.name(i).decode('utf-8')
+                               for i in range(self.n_categories)
+                              ]
+        self.category_table = dict(
+                                   [
+                                    (cat, float(count))
+                                    for cat, count in zip(
+                                                          self.category_names,
+                                                          struct.unpack_from(
+                                                                             '<%dI' % self.n_categories,
+                                                                             self.map,
+                                                                             self.category_start
+                                                                            )
+                                                         )
+                                   ]
+                                  )
+
+    def name(self, i):
+        '''
+        Returns the i-th name in the file, as bytes. Names 0 to n_categories-1
+        are categories, the rest are features.
+        '''
+        start, end = struct.unpack_from('<2I', self.map, self.offsets_start + INT.size * i)
+        return self.map[self.names_start + start:self.names_start + end]
+
+    def find(self, feat):
+        '''
+        Returns the row of feat in the counts, or None if it isn't in the
+        model.
+        '''
+        feat = encode(feat)
+        low, high = 0, self.n_features
+        while low < high:
+            middle = (low + high) // 2
+            if self.name(self.n_categories + middle) < feat:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_features and self.name(self.n_categories + low) == feat:
+            return low
+        return None
+
+    def row(self, i):
+        '''
+        Returns the {category: count} dictionary for the i-th feature.
+        '''
+        counts = struct.unpack_from(
+                                    '<%dI' % self.n_categories,
+                                    self.map,
+                                    self.counts_start + INT.size * self.n_categories * i
+                                   )
+        return dict(
+                    [
+                     (cat, float(count))
+                     for cat, count in zip(self.category_names, counts)
+                     if count
+                    ]
+                   )
+
+    def feature_counts(self, features):
+        counts = { }
+        for feat in features:
+            i = self.find(feat)
+            if i is not None:
+                counts[feat] = self.row(i)
+        return counts
+
+    def category_counts(self):
+        return dict(self.category_table)
+
+    def iter_features(self):
+        for i in range(self.n_features):
+            yield self.name(self.n_categories + i).decode('utf-8'), self.row(i)
+
+    def generation(self):
+        return self.model_generation
+
+    def changed_features(self, since):
+        # the file never changes under us
+        return set()
+
+    def add_counts(self, features, categories):
+        raise NotImplementedError('model files are read only')
+
+    def remove_features(self, features):
+        raise NotImplementedError('model files are read only')
+
+    def reset(self):
+        raise NotImplementedError('model files are read only')
+
+    def close(self):
+        '''
+        Unmaps the file.
+        '''
+        self.map.close()
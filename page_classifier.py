@@ -4,35 +4,201 @@
 #
 #
 from nltk.corpus import stopwords
-from nltk.tokenize import WhitespaceTokenizer
 from nltk import WordNetLemmatizer, FreqDist
-STOPWORDS = stopwords.words('english')
-import codecs, re, math
-import MySQLdb as mysql
+STOPWORDS = frozenset(stopwords.words('english'))
+import codecs, re, math, itertools, os, time
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from storage import open_storage
+import metrics
+from scoring import weighted_average, score_features, log_sums, scores_from_log_sums
+
+# number of documents whose counts are added up in memory before being written
+# to the database in a single transaction when training
+TRAINING_BATCH_SIZE = 1000
+# maximum number of words whose lemma is remembered by a Tokenizer
+LEMMA_CACHE_SIZE = 100000
+# characters of a streamed document read between checks of its scores
+STREAM_TEXT_SIZE = 8192
+# bytes of a training file counted by each task when training in parallel
+TRAINING_SHARD_SIZE = 4 * 1024 * 1024
+
+# time spent in each stage of scoring a document, and its size
+TOKENIZE_SECONDS = metrics.Histogram('isitx_tokenize_seconds', 'Time splitting documents into features')
+LOOKUP_SECONDS   = metrics.Histogram('isitx_lookup_seconds', 'Time reading the counts of the features of documents')
+SCORING_SECONDS  = metrics.Histogram('isitx_scoring_seconds', 'Time scoring documents once their counts are read')
+DOCUMENT_TOKENS  = metrics.Histogram('isitx_document_tokens', 'Unique features scored per document', metrics.COUNT_BUCKETS)
+
+class Tokenizer(object):
+    '''
+    Splits documents into lemmatized words. Everything that doesn't depend on
+    the document (regexes, stopwords, lemmatizer) is set up once, and the
+    lemmas of words already seen are remembered, so a single tokenizer is
+    meant to be reused for every document.
+    '''
+    def __init__(self, stopwords=STOPWORDS, cache_size=LEMMA_CACHE_SIZE):
+        '''
+        stopwords: words to leave out.
+        cache_size: maximum number of lemmas remembered, the cache is emptied
+                    when it fills up.
+        '''
+        # replacing every non-alphanumeric character with a space and then
+        # splitting on whitespace leaves runs of alphanumeric characters, so
+        # match those directly
+        self.word_regex = re.compile('\w+')
+        self.stopwords  = frozenset(stopwords)
+        self.lemmatizer = WordNetLemmatizer()
+        self.cache_size = cache_size
+        self.lemmas     = { }
+
+    def lemmatize(self, word):
+        '''
+        Returns the lemma of word, from the cache if possible.
+        '''
+        try:
+            return self.lemmas[word]
+        except KeyError:
+            pass
+        if len(self.lemmas) >= self.cache_size:
+            self.lemmas = { }
+        lemma = self.lemmatizer.lemmatize(word)
+        self.lemmas[word] = lemma
+        return lemma
+
+    def iter_words(self, document):
+        '''
+        Generates the lemmatized words of document one at a time, without
+        building the list of all its words.
+        '''
+        stopwords = self.stopwords
+        for match in self.word_regex.finditer(document.lower()):
+            word = match.group()
+            if len(word) > 2 and word not in stopwords:
+                yield self.lemmatize(word)
+
+    def words(self, document):
+        '''
+        Return the frequency distribution of the words in document
+        '''
+        return FreqDist(self.iter_words(document))
+
+# the tokenizer shared by every call to get_words
+default_tokenizer = Tokenizer()
 
 def get_words(document):
     '''
     Return a list of unique words in document
     '''
-    regex1 = re.compile('\W')          # match non-alphanumeric
-    regex2 = re.compile('&(#)*(\w)*;')  # match html entities
-    regex3 = re.compile('( ){2,}')      # match more than 2 spaces
-    lemmatizer = WordNetLemmatizer()
-    tokenizer  = WhitespaceTokenizer()
-    # lowercase document, remove punctuation, and html entities
-    document   = regex3.sub(' ', regex2.sub(' ', regex1.sub(' ', document.lower())))
-    words = [
-             lemmatizer.lemmatize(word)
-             for word in tokenizer.tokenize(document)
-             if word not in STOPWORDS and len(word) > 2
-            ]
-    return FreqDist(words)
+    return default_tokenizer.words(document)
+
+def join_fragments(fragments, size):
+    '''
+    Generates the fragments of text joined by spaces into pieces of at least
+    size characters (but the last).
+    '''
+    pieces = [ ]
+    length = 0
+    for fragment in fragments:
+        pieces.append(fragment)
+        length += len(fragment) + 1
+        if length >= size:
+            yield u' '.join(pieces)
+            pieces = [ ]
+            length = 0
+    if pieces:
+        yield u' '.join(pieces)
 
 def simple_get_words(document):
     splitter = re.compile('\\W*')
     words = [s.lower() for s in splitter.split(document) if len(s) > 2 and len(s)<20]
     return dict([(w,1) for w in words])
 
+def count_features(items, cat, get_features):
+    '''
+    Returns the count table of items classified under cat: a pair of
+    dictionaries, {(feature, cat): count} and {cat: documents}, as taken by
+    Classifier.add_counts.
+    '''
+    features = { }
+    documents = 0
+    for item in items:
+        # increment the count for each feature in cat
+        for feature in get_features(item):
+            features[(feature, cat)] = features.get((feature, cat), 0) + 1
+        documents += 1
+    categories = { }
+    if documents:
+        categories[cat] = documents
+    return features, categories
+
+def merge_counts(tables):
+    '''
+    Adds up count tables (see count_features) into a single one. Merging is
+    associative, so partial tables can be merged in any grouping and order.
+    '''
+    features, categories = { }, { }
+    for table_features, table_categories in tables:
+        for key, count in table_features.items():
+            features[key] = features.get(key, 0) + count
+        for cat, count in table_categories.items():
+            categories[cat] = categories.get(cat, 0) + count
+    return features, categories
+
+def file_shards(filename, shard_size=TRAINING_SHARD_SIZE):
+    '''
+    Splits filename into (start, end) byte ranges of about shard_size bytes.
+    A line belongs to the shard its first byte falls in.
+    '''
+    size = os.path.getsize(filename)
+    return [
+            (start, min(start + shard_size, size))
+            for start in range(0, size, shard_size)
+           ]
+
+def read_shard(filename, start, end):
+    '''
+    Generates the lines of filename that start between the bytes start and
+    end.
+    '''
+    with open(filename, 'r') as file:
+        if start > 0:
+            # skip the end of the line the previous shard started
+            file.seek(start - 1)
+            file.readline()
+        while file.tell() < end:
+            line = file.readline()
+            if not line:
+                break
+            yield line
+
+def count_shard(task):
+    '''
+    Returns the count table of a shard of a training file, in a worker of
+    Classifier.train_parallel.
+    '''
+    filename, start, end, cat, get_features = task
+    return count_features(read_shard(filename, start, end), cat, get_features)
+
+def count_batch(task):
+    '''
+    Returns the count table of a batch of documents, in a worker of
+    Classifier.train_stream.
+    '''
+    documents, cat, get_features = task
+    return count_features(documents, cat, get_features)
+
+def batches(items, size):
+    '''
+    Generates lists of size items (but the last) taken from items, which is
+    only read as the lists are needed.
+    '''
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            break
+        yield batch
+
 class Classifier(object):
     '''
     An implementation of a naive Bayes classifier based on the material from
@@ -41,23 +207,18 @@ class Classifier(object):
     def __init__(self, get_features, db):
         '''
         Initializes the classifier with an empty feature count, category count,
-        thresholds, and a connection to the database.
+        thresholds, and the store for the trained model.
 
         The arguments:
             - get_features: a function that takes a string or document and
                             returns a list of features.
-            - db: a dictionary with the information to connect to the database
-                  where the classifier stores the trained model. This dict has
-                  the following keys: dbname, host, usr, passwd.
-        '''
-        # set our connection to the database
-        self.db = mysql.connect(
-                                host=db['host'],
-                                user=db['usr'],
-                                passwd=db['passwd'],
-                                db=db['dbname']
-                               )
-        self.cursor = self.db.cursor()
+            - db: where the classifier stores the trained model, either a
+                  storage.Storage or a dictionary describing one (see
+                  storage.open_storage). A dictionary with the keys dbname,
+                  host, usr, passwd connects to MySQL.
+        '''
+        # set our store for the counts
+        self.storage = open_storage(db)
         # we set our function to extract features, we can use the same
         # classifier for different kinds of features
         self.get_features = get_features
@@ -69,126 +230,177 @@ class Classifier(object):
         Increment the count of feat in cat. If cat doesn't exist for feature,
         add it and increment.
         '''
-        # get the count
-        count = self.feature_count(feat, cat)
-        if count == 0:
-            # create record for this feature on this category
-            self.cursor.execute(
-                                '''
-                                INSERT INTO feature_tbl
-                                (feature, category, count) VALUES (%s, %s, %s)
-                                ''',
-                                (feat, cat, 1)
-                               )
-        else:
-            # update the count for feature in category
-            self.cursor.execute(
-                                '''
-                                UPDATE feature_tbl SET count=%s
-                                WHERE feature=%s AND category=%s
-                                ''',
-                                (count+1, feat, cat)
-                               )
-        self.db.commit()
+        self.storage.add_counts({(feat, cat): 1}, { })
 
     def increment_category(self, cat):
         '''
         Increment the count of a category
         '''
-        # get the category count
-        count = self.category_count(cat)
-        if count == 0:
-            # create new record for category
-            self.cursor.execute(
-                                '''
-                                INSERT INTO category_tbl (category, count)
-                                VALUES (%s, %s)
-                                ''',
-                                (cat, 1)
-                               )
-        else:
-            # increment the count of the category
-            self.cursor.execute(
-                                '''
-                                UPDATE category_tbl SET count=%s
-                                WHERE category=%s
-                                ''',
-                                (count+1, cat)
-                               )
-        self.db.commit()
+        self.storage.add_counts({ }, {cat: 1})
 
     def feature_count(self, feat, cat):
         '''
         Returns the number of counts feat is in cat
         '''
-        self.cursor.execute(
-                            '''
-                            SELECT count FROM feature_tbl
-                            WHERE feature=%s AND category=%s
-                            ''',
-                            (feat, cat)
-                           )
-        result = self.cursor.fetchone()
-        if result == None:
-            return 0.0
-        else:
-            return float(result[0])
+        return self.storage.feature_count(feat, cat)
 
     def category_count(self, cat):
         '''
         Return the count of documents in cat
         '''
-        self.cursor.execute(
-                       '''
-                       SELECT count FROM category_tbl
-                       WHERE category=%s
-                       ''',
-                       (cat,)
-                      )
-        result = self.cursor.fetchone()
-        if result == None:
-            return 0.0
-        else:
-            return float(result[0])
+        return self.storage.category_count(cat)
+
+    def feature_counts(self, features):
+        '''
+        Returns a dictionary mapping each feature in features to a dictionary
+        of {category: count}, all fetched in one batch. Features never seen
+        are left out.
+        '''
+        return self.storage.feature_counts(features)
+
+    def category_counts(self):
+        '''
+        Returns a dictionary mapping each category to its count of documents
+        '''
+        return self.storage.category_counts()
 
     def total_count(self):
         '''
         Returns the total number of documents.
         '''
-        self.cursor.execute('''SELECT SUM(count) FROM category_tbl''')
-        total_document_count = int(self.cursor.fetchone()[0])
-        return total_document_count
+        return self.storage.total_count()
 
     def categories(self):
         '''
         Returns a list of all categories
         '''
-        self.cursor.execute('''SELECT category FROM category_tbl''')
-        categories = [ category for category, in self.cursor.fetchall() ]
-        return categories
+        return self.storage.categories()
+
+    def add_counts(self, features, categories):
+        '''
+        Adds counts to the model in a single transaction (see
+        storage.Storage.add_counts).
+        '''
+        self.storage.add_counts(features, categories)
 
     def train(self, item, cat):
         '''
         Takes an item classified under cat, extracts its features, and
         increments the count of that feature inside that cat.
         '''
-        item_features = self.get_features(item)
-        # increment the count for each feature in cat
-        for feature in item_features:
-            self.increment_feature(feature, cat)
-        # increment the count for cat
-        self.increment_category(cat)
+        self.train_batch([item], cat)
+
+    def train_batch(self, items, cat):
+        '''
+        Trains the classifier with every item in items under cat. The feature
+        counts are added up in memory and written with add_counts, so the
+        whole batch costs a single transaction.
+        '''
+        features, categories = count_features(items, cat, self.get_features)
+        if categories:
+            self.add_counts(features, categories)
 
-    def train_from_file(self, filename, cat):
+    def train_from_file(self, filename, cat, batch_size=TRAINING_BATCH_SIZE):
         '''
         Retrieve documents in training file (as single line entries) and train
-        the classifier with them.
+        the classifier with them. The file is read lazily, batch_size lines at
+        a time, and each batch is written in its own transaction.
         '''
-        lines = [ ]
         with open(filename, 'r') as file:
-            lines = file.readlines()
-            for item in lines:
-                self.train(item, cat)
+            while True:
+                lines = list(itertools.islice(file, batch_size))
+                if not lines:
+                    break
+                self.train_batch(lines, cat)
+
+    def train_parallel(self, files, workers=None, shard_size=TRAINING_SHARD_SIZE):
+        '''
+        Trains the classifier with the documents in files, a list of
+        (filename, cat), counting them with a pool of workers processes (one
+        per core by default). The files are split into shards that are
+        tokenized and counted separately, and the merged counts are written
+        in a single add_counts.
+
+        get_features must be a module level function for the workers to get
+        a copy of it.
+        '''
+        tasks = [
+                 (filename, start, end, cat, self.get_features)
+                 for filename, cat in files
+                 for start, end in file_shards(filename, shard_size)
+                ]
+        pool = Pool(workers)
+        try:
+            features, categories = merge_counts(pool.imap_unordered(count_shard, tasks))
+        finally:
+            pool.close()
+            pool.join()
+        if categories:
+            self.add_counts(features, categories)
+
+    def train_stream(self, documents, cat, workers=None, batch_size=TRAINING_BATCH_SIZE,
+                     on_trained=None):
+        '''
+        Trains the classifier with documents, any iterable of documents such
+        as the generator of crawler.Crawler.iter_documents, as they come.
+        Documents are gathered in batches of batch_size, tokenized and
+        counted by a pool of workers processes (one per core by default)
+        while the next ones are read, and each batch is written in its own
+        add_counts once counted. At most one batch per worker is counted at
+        a time, reading documents waits for the workers beyond that, so
+        memory stays bounded whatever the pace of documents. Returns the
+        number of documents trained.
+
+        on_trained: if given, documents are (key, document) pairs instead,
+                    and on_trained is called with the keys of every batch
+                    once its add_counts is done, e.g. to record the pages
+                    trained with (see crawler.Crawler.record_done).
+
+        get_features must be a module level function for the workers to get
+        a copy of it.
+        '''
+        workers = workers or cpu_count()
+        pool = Pool(workers)
+        # (keys, result) of the batches being counted
+        pending = deque()
+        trained = 0
+        try:
+            for batch in batches(documents, batch_size):
+                keys = None
+                if on_trained is not None:
+                    keys = [ key for key, document in batch ]
+                    batch = [ document for key, document in batch ]
+                pending.append((keys, pool.apply_async(count_batch, ((batch, cat, self.get_features),))))
+                if len(pending) >= workers:
+                    trained += self.add_batch(pending.popleft(), on_trained)
+            while pending:
+                trained += self.add_batch(pending.popleft(), on_trained)
+        finally:
+            pool.close()
+            pool.join()
+        return trained
+
+    def add_batch(self, counted, on_trained=None):
+        '''
+        Adds a batch counted by train_stream, (keys, result of its
+        count_batch), to the model and passes its keys on to on_trained if
+        given. Returns the number of documents in it.
+        '''
+        keys, result = counted
+        trained = self.add_count_table(result.get())
+        if on_trained is not None:
+            on_trained(keys)
+        return trained
+
+    def add_count_table(self, table):
+        '''
+        Adds the count table of a batch (see count_features) to the model,
+        returns the number of documents in it.
+        '''
+        features, categories = table
+        if categories:
+            self.add_counts(features, categories)
+        return sum(categories.values())
 
     def reset_classifier(self):
         '''
@@ -196,9 +408,7 @@ class Classifier(object):
         dictionary. Very helpful for testing and for use in the python shell
         '''
         # clear the feature and category tables in the DB
-        self.cursor.execute('''DELETE FROM feature_tbl''')
-        self.cursor.execute('''DELETE FROM category_tbl''')
-        self.db.commit()
+        self.storage.reset()
         self.thresholds = { }
 
     # calculate probabilities
@@ -227,8 +437,7 @@ class Classifier(object):
                           ]
                          )
         # calculate the weighted average
-        weighted_prob = ((weight * assumed_p) + (total_count*basic_p)) / (weight+total_count)
-        return weighted_prob
+        return weighted_average(basic_p, total_count, weight, assumed_p)
 
     def document_probability(self, document, cat):
         '''
@@ -251,12 +460,46 @@ class Classifier(object):
         document_probability = self.document_probability(document, cat)
         return document_probability * category_probability
 
+    def scores(self, document, model=None, weight=1.0, assumed_p=0.5):
+        '''
+        Calculates the probability of document for every category at once.
+        Works just like probability, but the feature and category counts are
+        loaded up front with a handful of queries and every category is
+        scored from that snapshot (see scoring.score_features).
+
+        model is where the counts are read from, anything with feature_counts
+        and category_counts methods (like a model_cache.ModelCache) will do.
+        It defaults to the store of the classifier. Models that also have a
+        log_sums method (like model_cache.ModelCache) score the features
+        themselves, from counts they keep ready for it.
+        '''
+        if model is None:
+            model = self.storage
+        with metrics.timer(TOKENIZE_SECONDS):
+            features = list(self.get_features(document))
+        DOCUMENT_TOKENS.observe(len(features))
+        if hasattr(model, 'log_sums'):
+            # the model looks the features up and scores them in one go,
+            # timed as scoring
+            with metrics.timer(SCORING_SECONDS):
+                category_counts = model.category_counts()
+                sums = model.log_sums(features, category_counts, weight, assumed_p)
+                return scores_from_log_sums(sums, category_counts)
+        with metrics.timer(LOOKUP_SECONDS):
+            counts = model.feature_counts(features)
+            category_counts = model.category_counts()
+        with metrics.timer(SCORING_SECONDS):
+            return score_features(features, counts, category_counts, weight, assumed_p)
+
     # classification functions
     def set_threshold(self, cat, threshold):
         '''
         Set a threshold for cat to determine minimum differences in their
-        probabilities in order to be classifed under a given category
+        probabilities in order to be classifed under a given category (see
+        decide). Thresholds are margins on the scores, and can't be negative.
         '''
+        if threshold < 0:
+            raise ValueError('the threshold of %s must be 0 or more, not %r' % (cat, threshold))
         self.thresholds[cat] = threshold
 
     def get_threshold(self, cat):
@@ -264,27 +507,94 @@ class Classifier(object):
         Returns the threshold for cat
         '''
         if cat not in self.thresholds:
-            return 1.0
+            return 0.0
         return self.thresholds[cat]
 
-    def classify(self, document):
+    def classify(self, document, model=None):
+        '''
+        Find what category document falls into, reading the counts from model
+        if given (see scores), or None if it's too close to call (see
+        decide).
+        '''
+        return self.decide(self.scores(document, model))
+
+    def decide(self, probabilities):
         '''
-        Find what category document falls into
+        Returns the category with the highest probability, or None when it
+        isn't clear enough: the score of the best category must beat every
+        other by its threshold. The scores are the ones of scores, (1 + the
+        sum of the log probabilities of the features) * the prior of the
+        category, so the threshold is a margin on that scale, like the margin
+        of scores_stream, not a ratio of probabilities. The default threshold
+        of 0.0 always decides.
         '''
-        probabilities = { }
-        #max = 0.0
         # get category with highest probability for document
-        for category in self.categories():
-            probabilities[category] = self.probability(document, category)
-            #print 'Probablity document is in %s: %f' % (category, probabilities[category])
-            #if probabilities[category] > max:
-            #    max = probabilities[category]
-            #    best = category
         best = max(probabilities, key=probabilities.get)
-        # check that probability exceeds the threshold * next best category
-        #for category, probability in probabilities.items():
-        #    if category == best:
-        #        continue
-        #    if probability * self.get_threshold(best) > probabilities[best]:
-        #        return None
+        # check that the score exceeds the next best category by the margin
+        margin = self.get_threshold(best)
+        for category, probability in probabilities.items():
+            if category == best:
+                continue
+            if probabilities[best] - probability < margin:
+                return None
         return best
+
+    def scores_stream(self, fragments, model=None, margin=None):
+        '''
+        Calculates the probability for every category of a document given as
+        a sequence of text fragments (e.g. crawler.Crawler.stream_content),
+        reading the fragments only as long as needed: once the score of the
+        best category beats every other by margin, the rest of the document
+        is left unread. With no margin the whole document is read, and the
+        result is the same as scores on the joined fragments.
+        '''
+        if model is None:
+            model = self.storage
+        category_counts = model.category_counts()
+        precomputed = hasattr(model, 'log_sums')
+        sums = dict([ (category, 0.0) for category in category_counts ])
+        seen = set()
+        # seconds spent in each stage, the fragments are parsed in between
+        tokenizing = looking_up = scoring = 0.0
+        for text in join_fragments(fragments, STREAM_TEXT_SIZE):
+            started = time.time()
+            # score only the features we haven't seen in earlier text
+            features = [
+                        feature
+                        for feature in self.get_features(text)
+                        if feature not in seen
+                       ]
+            tokenized = time.time()
+            tokenizing += tokenized - started
+            if not features:
+                continue
+            seen.update(features)
+            if precomputed:
+                # looked up and scored in one go, timed as scoring
+                looked_up = time.time()
+                text_sums = model.log_sums(features, category_counts)
+            else:
+                counts = model.feature_counts(features)
+                looked_up = time.time()
+                text_sums = log_sums(features, counts, category_counts)
+            looking_up += looked_up - tokenized
+            for category, p in text_sums.items():
+                sums[category] += p
+            if margin is not None:
+                scores = sorted(scores_from_log_sums(sums, category_counts).values())
+                if len(scores) < 2 or scores[-1] - scores[-2] >= margin:
+                    scoring += time.time() - looked_up
+                    break
+            scoring += time.time() - looked_up
+        TOKENIZE_SECONDS.observe(tokenizing)
+        LOOKUP_SECONDS.observe(looking_up)
+        SCORING_SECONDS.observe(scoring)
+        DOCUMENT_TOKENS.observe(len(seen))
+        return scores_from_log_sums(sums, category_counts)
+
+    def classify_stream(self, fragments, model=None, margin=None):
+        '''
+        Find what category a document given as a sequence of text fragments
+        falls into, reading no more of it than needed (see scores_stream).
+        '''
+        return self.decide(self.scores_stream(fragments, model, margin))
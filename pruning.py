@@ -0,0 +1,98 @@
+#!/usr/bin/python
+#
+# filename: pruning.py
+#
+'''
+Keeping the model small: every word ever seen in training ends up in the
+model, including typos and junk that only show up once and say nothing about
+the category of a page. These functions pick the features worth keeping and
+remove the rest from a store.
+
+Features are ranked by their information gain, how much knowing whether a
+document has the feature tells about its category. As get_words returns each
+word of a document once, the count of a feature in a category is the number
+of documents of the category it appears in.
+'''
+import math
+from storage import MemoryStorage
+
+def entropy(counts):
+    '''
+    Returns the entropy, in bits, of the distribution given by counts.
+    '''
+    total = float(sum(counts))
+    if total <= 0:
+        return 0.0
+    return -sum([ c / total * math.log(c / total, 2) for c in counts if c > 0 ])
+
+def information_gain(feat_counts, category_counts):
+    '''
+    Returns the information gain of a feature with counts feat_counts,
+    {category: documents with the feature}, in a model with category_counts,
+    {category: documents}.
+    '''
+    categories = category_counts.keys()
+    total = float(sum(category_counts.values()))
+    if total <= 0:
+        return 0.0
+    with_feat = [ min(feat_counts.get(cat, 0.0), category_counts[cat]) for cat in categories ]
+    without_feat = [ category_counts[cat] - n for cat, n in zip(categories, with_feat) ]
+    p_feat = sum(with_feat) / total
+    return (
+            entropy(category_counts.values())
+            - p_feat * entropy(with_feat)
+            - (1 - p_feat) * entropy(without_feat)
+           )
+
+def select_features(storage, min_count=1, min_gain=0.0, top_n=None):
+    '''
+    Returns the set of features of storage worth keeping: the ones seen in
+    at least min_count documents, with an information gain of at least
+    min_gain and, if top_n is given, among the top_n with the most gain for
+    the category they are most frequent in.
+    '''
+    category_counts = storage.category_counts()
+    by_category = { }
+    for feat, counts in storage.iter_features():
+        if sum(counts.values()) < min_count:
+            continue
+        gain = information_gain(counts, category_counts)
+        if gain < min_gain:
+            continue
+        # the category where the feature is most frequent, relative to the
+        # size of the category
+        cat = max(
+                  counts,
+                  key=lambda c: counts[c] / category_counts[c] if category_counts.get(c) else 0.0
+                 )
+        by_category.setdefault(cat, [ ]).append((gain, feat))
+    keep = set()
+    for cat, ranked in by_category.items():
+        ranked.sort(reverse=True)
+        if top_n is not None:
+            ranked = ranked[:top_n]
+        keep.update([ feat for gain, feat in ranked ])
+    return keep
+
+def prune(storage, keep):
+    '''
+    Removes from storage every feature not in keep, and returns how many
+    were removed.
+    '''
+    removed = [ feat for feat, counts in storage.iter_features() if feat not in keep ]
+    if removed:
+        storage.remove_features(removed)
+    return len(removed)
+
+def copy_model(storage):
+    '''
+    Returns a MemoryStorage with the counts of storage, to try a pruning
+    out before applying it.
+    '''
+    copy = MemoryStorage()
+    features = { }
+    for feat, counts in storage.iter_features():
+        for cat, count in counts.items():
+            features[(feat, cat)] = count
+    copy.add_counts(features, storage.category_counts())
+    return copy
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+#
+# filename: result_cache.py
+#
+'''
+Cache of classification results, so pages submitted over and over aren't
+downloaded, parsed and scored every time.
+
+Results are cached at two levels:
+ url     --> the digest of the content last downloaded from a (normalized) url
+ content --> the result for a digest, so the same page served under another
+             url is scored only once
+
+Both levels live in size bounded LRU dictionaries with a time to live, and
+optionally in a SQLite database shared by all the processes of the web
+frontend. A result is only valid for the generation of the model it was
+computed with, so training the classifier invalidates it.
+'''
+import hashlib, json, sqlite3, threading, time
+from collections import OrderedDict
+from crawler import normalize_url
+
+# seconds a result stays valid
+RESULT_TTL = 60 * 60
+# results kept in memory by each process
+RESULT_CACHE_SIZE = 10000
+# puts between two purges of the expired rows of the shared database
+PURGE_INTERVAL = 1000
+
+def content_digest(data):
+    '''
+    Returns the digest identifying the content data.
+    '''
+    return hashlib.sha1(data).hexdigest()
+
+def url_digest(url):
+    '''
+    Returns the digest standing for the content of url when only part of it
+    was read: it's only ever found again through url.
+    '''
+    return content_digest('url:' + normalize_url(url).encode('utf-8'))
+
+class HashedChunks(object):
+    '''
+    Passes the chunks of a page through, hashing them on the way, for pages
+    that may not be read to the end.
+    '''
+    def __init__(self, chunks):
+        self.chunks   = chunks
+        self.hash     = hashlib.sha1()
+        self.complete = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.hash.update(chunk)
+            yield chunk
+        self.complete = True
+
+    def close(self):
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+
+    def digest(self):
+        '''
+        Returns the content digest of the page if every chunk went through,
+        None otherwise.
+        '''
+        if not self.complete:
+            return None
+        return self.hash.hexdigest()
+
+class LRU(object):
+    '''
+    Dictionary of at most size entries, each with an expiration time.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, now):
+        '''
+        Returns the value for key, or None if it's missing or expired.
+        '''
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < now:
+            return None
+        # move it to the most recently used end
+        self.entries[key] = entry
+        return value
+
+    def put(self, key, value, expires):
+        self.entries.pop(key, None)
+        self.entries[key] = (expires, value)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+class ResultCache(object):
+    '''
+    The two level cache of results. Results are anything json can encode.
+    '''
+    schema = '''
+             CREATE TABLE IF NOT EXISTS url_tbl (
+                 url TEXT NOT NULL PRIMARY KEY,
+                 digest TEXT NOT NULL,
+                 expires REAL NOT NULL
+             );
+             CREATE TABLE IF NOT EXISTS result_tbl (
+                 digest TEXT NOT NULL,
+                 generation INTEGER NOT NULL,
+                 result TEXT NOT NULL,
+                 expires REAL NOT NULL,
+                 PRIMARY KEY (digest, generation)
+             );
+             '''
+
+    def __init__(self, ttl=RESULT_TTL, size=RESULT_CACHE_SIZE, path=None):
+        '''
+        ttl: seconds a result stays valid.
+        size: maximum number of urls and of results kept in memory.
+        path: SQLite database shared with other processes, None to keep the
+              results only in memory.
+        '''
+        self.ttl      = ttl
+        self.lock     = threading.Lock()
+        self.urls     = LRU(size)
+        self.contents = LRU(size)
+        self.url_hits     = 0
+        self.content_hits = 0
+        self.misses       = 0
+        self.puts         = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('''PRAGMA journal_mode=WAL''')
+            self.db.executescript(self.schema)
+            self.db.commit()
+
+    def get_url(self, url, generation):
+        '''
+        Returns the result for url computed with the given generation of the
+        model, or None.
+        '''
+        url = normalize_url(url)
+        now = time.time()
+        with self.lock:
+            digest = self.urls.get(url, now)
+            if digest is None and self.db is not None:
+                row = self.db.execute(
+                                      '''
+                                      SELECT digest, expires FROM url_tbl
+                                      WHERE url = ? AND expires >= ?
+                                      ''',
+                                      (url, now)
+                                     ).fetchone()
+                if row is not None:
+                    digest = row[0]
+                    self.urls.put(url, digest, row[1])
+            result = None
+            if digest is not None:
+                result = self.lookup(digest, generation, now)
+            if result is None:
+                self.misses += 1
+            else:
+                self.url_hits += 1
+            return result
+
+    def get_content(self, url, digest, generation):
+        '''
+        Returns the result for the content with digest, computed with the
+        given generation of the model, or None. A hit also remembers digest
+        as the content of url.
+        '''
+        now = time.time()
+        with self.lock:
+            result = self.lookup(digest, generation, now)
+            if result is None:
+                return None
+            self.content_hits += 1
+            # the url lookup that came before this was counted as a miss
+            self.misses -= 1
+        self.put_url(normalize_url(url), digest, now + self.ttl)
+        return result
+
+    def lookup(self, digest, generation, now):
+        '''
+        Returns the result for (digest, generation) from memory or the shared
+        database, or None. Must be called with the lock held.
+        '''
+        result = self.contents.get((digest, generation), now)
+        if result is None and self.db is not None:
+            row = self.db.execute(
+                                  '''
+                                  SELECT result, expires FROM result_tbl
+                                  WHERE digest = ? AND generation = ?
+                                  AND expires >= ?
+                                  ''',
+                                  (digest, generation, now)
+                                 ).fetchone()
+            if row is not None:
+                result = json.loads(row[0])
+                self.contents.put((digest, generation), result, row[1])
+        return result
+
+    def put_url(self, url, digest, expires):
+        '''
+        Remembers digest as the content of the (normalized) url.
+        '''
+        with self.lock:
+            self.urls.put(url, digest, expires)
+            if self.db is not None:
+                self.db.execute(
+                                '''
+                                INSERT OR REPLACE INTO url_tbl
+                                (url, digest, expires) VALUES (?, ?, ?)
+                                ''',
+                                (url, digest, expires)
+                               )
+                self.db.commit()
+
+    def put(self, url, digest, generation, result):
+        '''
+        Caches result as the result for url, whose content has digest, with
+        the given generation of the model.
+        '''
+        now = time.time()
+        expires = now + self.ttl
+        self.put_url(normalize_url(url), digest, expires)
+        with self.lock:
+            self.contents.put((digest, generation), result, expires)
+            self.puts += 1
+            if self.db is not None:
+                self.db.execute(
+                                '''
+                                INSERT OR REPLACE INTO result_tbl
+                                (digest, generation, result, expires)
+                                VALUES (?, ?, ?, ?)
+                                ''',
+                                (digest, generation, json.dumps(result), expires)
+                               )
+                if self.puts % PURGE_INTERVAL == 0:
+                    self.db.execute('''DELETE FROM url_tbl WHERE expires < ?''', (now,))
+                    self.db.execute('''DELETE FROM result_tbl WHERE expires < ?''', (now,))
+                self.db.commit()
+
+    def stats(self):
+        '''
+        Returns the hit and miss counters of this process.
+        '''
+        with self.lock:
+            return {
+                    'url_hits': self.url_hits,
+                    'content_hits': self.content_hits,
+                    'misses': self.misses,
+                    'urls': len(self.urls.entries),
+                    'results': len(self.contents.entries),
+                   }
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+#
+# filename: scoring.py
+#
+'''
+Scoring of documents against every category of a model at once, given the
+counts already loaded for the features of the document.
+
+When NumPy is installed the counts are gathered into a features x categories
+matrix and every category is scored in one vectorized pass, so scoring
+against 20 categories costs about the same as against 2. Without NumPy the
+same numbers are computed with plain Python loops.
+'''
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def weighted_average(basic_p, total_count, weight=1.0, assumed_p=0.5):
+    '''
+    Weighted average between the assumed probability of a feature and its
+    observed probability, where total_count is the number of times the
+    feature has been seen across all categories.
+    '''
+    return ((weight * assumed_p) + (total_count*basic_p)) / (weight+total_count)
+
+def score_features(features, counts, category_counts, weight=1.0, assumed_p=0.5):
+    '''
+    Returns a dictionary with the probability of a document with features in
+    every category, computed like Classifier.probability.
+
+    The arguments:
+        - features: list of the unique features of the document.
+        - counts: {feature: {category: count}} for the features, as returned
+                  by Storage.feature_counts.
+        - category_counts: {category: count}, as returned by
+                           Storage.category_counts.
+    '''
+    sums = log_sums(features, counts, category_counts, weight, assumed_p)
+    return scores_from_log_sums(sums, category_counts)
+
+def log_sums(features, counts, category_counts, weight=1.0, assumed_p=0.5, rows=None):
+    '''
+    Returns a dictionary with the sum of the logs of the weighted
+    probabilities of features in every category. Sums for different sets of
+    features add up, so a document can be scored a piece at a time.
+
+    rows: optionally, rows of count_rows for categories in the order of
+          category_counts, with a row for every feature that has counts.
+          NumPy then stacks them instead of gathering the counts again.
+    '''
+    if numpy is None:
+        return python_log_sums(features, counts, category_counts, weight, assumed_p)
+    return numpy_log_sums(features, counts, category_counts, weight, assumed_p, rows)
+
+def scores_from_log_sums(sums, category_counts):
+    '''
+    Turns the log sums of a document into its probability in every category.
+    '''
+    total = sum(category_counts.values())
+    return dict(
+                [
+                 (category, (1 + sums[category]) * (category_count / total))
+                 for category, category_count in category_counts.items()
+                ]
+               )
+
+def log_probabilities(counts, category_counts, weight=1.0, assumed_p=0.5):
+    '''
+    Returns {feature: {category: log of the weighted probability}} for every
+    feature in counts and every category, the terms log_sums adds up.
+    Features not in counts have default_log_probability in every category.
+    '''
+    table = { }
+    for feature, feat_counts in counts.items():
+        total = sum([ feat_counts.get(c, 0.0) for c in category_counts ])
+        row = { }
+        for category, category_count in category_counts.items():
+            if category_count == 0:
+                basic_p = 0
+            else:
+                basic_p = feat_counts.get(category, 0.0) / category_count
+            row[category] = math.log(weighted_average(basic_p, total, weight, assumed_p))
+        table[feature] = row
+    return table
+
+def default_log_probability(weight=1.0, assumed_p=0.5):
+    '''
+    Returns the log of the weighted probability of a feature never seen,
+    the same in every category.
+    '''
+    return math.log(weighted_average(0.0, 0.0, weight, assumed_p))
+
+def python_log_sums(features, counts, category_counts, weight=1.0, assumed_p=0.5):
+    '''
+    log_sums, one feature and category at a time.
+    '''
+    # total count for each feature in all categories
+    feature_totals = { }
+    for feature in features:
+        feat_counts = counts.get(feature, { })
+        feature_totals[feature] = sum(
+                                      [
+                                       feat_counts.get(c, 0.0)
+                                       for c in category_counts
+                                      ]
+                                     )
+    sums = { }
+    for category, category_count in category_counts.items():
+        p = 0.0
+        for feature in features:
+            if category_count == 0:
+                basic_p = 0
+            else:
+                basic_p = counts.get(feature, { }).get(category, 0.0) / category_count
+            p += math.log(
+                          weighted_average(
+                                           basic_p,
+                                           feature_totals[feature],
+                                           weight,
+                                           assumed_p
+                                          )
+                         )
+        sums[category] = p
+    return sums
+
+def count_matrix(features, counts, categories):
+    '''
+    Returns the features x categories matrix of counts, row i holding the
+    counts of features[i].
+    '''
+    column = dict([ (cat, j) for j, cat in enumerate(categories) ])
+    matrix = numpy.zeros((len(features), len(categories)))
+    for i, feature in enumerate(features):
+        for cat, count in counts.get(feature, { }).items():
+            if cat in column:
+                matrix[i, column[cat]] = count
+    return matrix
+
+def count_rows(counts, categories):
+    '''
+    Returns {feature: its row of count_matrix} for the features in counts.
+    Rows only depend on the counts of their feature and on the list of
+    categories, not on the counts of the categories, so they can be kept
+    while documents are added to the model (see model_cache.ModelCache).
+    '''
+    features = list(counts)
+    matrix = count_matrix(features, counts, categories)
+    # copies, so that a row kept doesn't keep the whole matrix
+    return dict([ (feature, row.copy()) for feature, row in zip(features, matrix) ])
+
+def numpy_log_sums(features, counts, category_counts, weight=1.0, assumed_p=0.5, rows=None):
+    '''
+    log_sums, all the features and categories in one pass.
+    '''
+    categories = list(category_counts)
+    cat_counts = numpy.array([ category_counts[cat] for cat in categories ], dtype=float)
+    if rows is None:
+        matrix = count_matrix(features, counts, categories)
+    elif features:
+        unseen = numpy.zeros(len(categories))
+        matrix = numpy.vstack([ rows.get(feature, unseen) for feature in features ])
+    else:
+        matrix = numpy.zeros((0, len(categories)))
+    # total count for each feature in all categories, as a column
+    totals = matrix.sum(axis=1)[:, numpy.newaxis]
+    # features of empty categories have a basic probability of 0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        basic_p = numpy.where(cat_counts > 0, matrix / cat_counts, 0.0)
+    weighted_p = ((weight * assumed_p) + (totals * basic_p)) / (weight + totals)
+    return dict(zip(categories, numpy.log(weighted_p).sum(axis=0).tolist()))
@@ -0,0 +1,833 @@
+#!/usr/bin/python
+#
+# filename: storage.py
+#
+'''
+Stores for the counts of a trained classifier. Every store has the same
+interface, so the classifier can keep its model in memory, in a SQLite file,
+or in MySQL depending on the deployment:
+
+ MemoryStorage --> plain dictionaries, nothing survives the process
+ SQLiteStorage --> a local SQLite database (WAL mode)
+ MySQLStorage  --> the MySQL database described in utils/create_schema.sql
+
+model_file.MappedStorage adds a read only store over a memory mapped file.
+
+The MySQL stores of a process share a ConnectionPool per database: rather than
+connecting for every classifier, each operation checks out a connection and
+puts it back when done. A thread can hold on to one for a longer scope, like
+a web request or a training job, with Storage.checkout or acquire/release.
+'''
+import os, sqlite3, threading, time
+import metrics
+try:
+    import MySQLdb as mysql
+except ImportError:
+    # only needed for MySQLStorage
+    mysql = None
+
+# maximum number of features looked up in a single IN (...) query, so that
+# huge pages don't go over the server's max_allowed_packet
+FEATURE_CHUNK_SIZE = 500
+# number of model generations kept in the log of changed features, caches that
+# fall further behind than this reload the whole model
+CHANGE_LOG_GENERATIONS = 1000
+# the log keeps at most CHANGE_LOG_ROWS features in all, dropping the oldest
+# generations first, and a batch changing more than CHANGE_LOG_BATCH features
+# isn't logged at all: reading back that many features costs more than
+# reloading, so the caches start over instead
+CHANGE_LOG_ROWS  = 100000
+CHANGE_LOG_BATCH = 10000
+
+# connections a MySQL pool opens at most, seconds a connection can sit idle in
+# it before being closed, seconds idle after which a connection is checked
+# before being handed out, and seconds a thread waits for a connection when
+# they're all taken
+POOL_SIZE         = 8
+POOL_IDLE_TIMEOUT = 5 * 60
+POOL_CHECK_AFTER  = 30
+POOL_WAIT         = 30
+
+# round trips to the database made to read the model
+STORAGE_QUERIES = metrics.Counter('isitx_storage_queries_total', 'Queries reading the model from the database')
+
+def open_storage(db):
+    '''
+    Returns the store described by db, which can be a Storage (returned as
+    is) or a dictionary. The 'backend' key of the dictionary picks the store:
+        - 'mysql' (the default): the keys dbname, host, usr, passwd are used
+                                 to connect to the database, pool_size and
+                                 pool_idle_timeout, if given, size the pool
+                                 of connections (see ConnectionPool).
+        - 'sqlite': the key path is the database file.
+        - 'memory': no other keys needed.
+        - 'mmap': the key path is a model file written by
+                  model_file.export_model, opened read only.
+        - 'hashed': features hashed into 2^bits buckets (the key bits,
+                    hashed_storage.HASH_BITS by default), kept in the file
+                    at the key path if given.
+    '''
+    if isinstance(db, Storage):
+        return db
+    backend = db.get('backend', 'mysql')
+    if backend == 'memory':
+        return MemoryStorage()
+    elif backend == 'sqlite':
+        return SQLiteStorage(db['path'])
+    elif backend == 'mysql':
+        return MySQLStorage(db)
+    elif backend == 'mmap':
+        # imported here as model_file builds on this module
+        from model_file import MappedStorage
+        return MappedStorage(db['path'])
+    elif backend == 'hashed':
+        from hashed_storage import HashedStorage, HASH_BITS
+        return HashedStorage(db.get('bits', HASH_BITS), db.get('path'))
+    raise ValueError('unknown storage backend: %s' % backend)
+
+class PoolTimeout(Exception):
+    '''
+    Raised when no connection of a pool was put back in time.
+    '''
+    pass
+
+def check_connection(connection):
+    '''
+    Raises an exception if connection is no longer usable.
+    '''
+    cursor = connection.cursor()
+    cursor.execute('''SELECT 1''')
+    cursor.fetchall()
+    cursor.close()
+
+class ConnectionPool(object):
+    '''
+    Connections to a database shared by the threads of a process. A thread
+    gets one for as long as it needs it, and puts it back for the others.
+
+    At most size connections are open at once, threads wait up to wait
+    seconds for one to be put back when they're all taken. Connections idle
+    for more than idle_timeout seconds are closed (before the server drops
+    them), and the ones idle for more than POOL_CHECK_AFTER seconds are
+    checked before being handed out, and replaced if they're broken.
+    '''
+    def __init__(self, connect, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 wait=POOL_WAIT, check=check_connection):
+        '''
+        connect: function returning a new connection.
+        check: function raising an exception for a broken connection.
+        '''
+        self.connect      = connect
+        self.size         = size
+        self.idle_timeout = idle_timeout
+        self.wait         = wait
+        self.check        = check
+        self.condition    = threading.Condition()
+        # (connection, time it was put back), the most recently used last
+        self.idle   = [ ]
+        self.opened = 0
+
+    def get(self):
+        '''
+        Returns a connection, opening one if none is idle and there's room.
+        Throws a PoolTimeout if none comes free in time.
+        '''
+        deadline = time.time() + self.wait
+        with self.condition:
+            while True:
+                self.close_idle()
+                if self.idle:
+                    connection, since = self.idle.pop()
+                    break
+                if self.opened < self.size:
+                    # take the slot now, connect outside the lock
+                    self.opened += 1
+                    connection, since = None, None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout('no connection put back in %s seconds' % self.wait)
+                self.condition.wait(remaining)
+        if connection is not None and time.time() - since > POOL_CHECK_AFTER:
+            try:
+                self.check(connection)
+            except Exception:
+                close_quietly(connection)
+                connection = None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                self.discard(None)
+                raise
+        return connection
+
+    def put(self, connection, broken=False):
+        '''
+        Gives back connection, which gets closed if it's broken.
+        '''
+        if broken:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.time()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        '''
+        Closes connection, if any, and frees its slot.
+        '''
+        if connection is not None:
+            close_quietly(connection)
+        with self.condition:
+            self.opened -= 1
+            self.condition.notify()
+
+    def close_idle(self, idle_timeout=None):
+        '''
+        Closes the connections idle for more than idle_timeout seconds, by
+        default the one of the pool. Called with the condition held.
+        '''
+        if idle_timeout is None:
+            idle_timeout = self.idle_timeout
+        oldest = time.time() - idle_timeout
+        while self.idle and self.idle[0][1] < oldest:
+            connection, since = self.idle.pop(0)
+            close_quietly(connection)
+            self.opened -= 1
+
+    def close(self):
+        '''
+        Closes every idle connection.
+        '''
+        with self.condition:
+            self.close_idle(-1)
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+# the pools of the process, by database, see mysql_pool
+pools      = { }
+pools_lock = threading.Lock()
+
+def mysql_pool(db):
+    '''
+    Returns the pool of connections of this process to the MySQL database
+    described by db (see open_storage), creating it on first use.
+    '''
+    # a forked process (e.g. a web worker) gets its own pool, sharing the
+    # sockets of its parent would mix up their conversations
+    key = (os.getpid(), db['host'], db['usr'], db['dbname'])
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(
+                                        lambda: mysql.connect(
+                                                              host=db['host'],
+                                                              user=db['usr'],
+                                                              passwd=db['passwd'],
+                                                              db=db['dbname']
+                                                             ),
+                                        db.get('pool_size', POOL_SIZE),
+                                        db.get('pool_idle_timeout', POOL_IDLE_TIMEOUT),
+                                        check=lambda connection: connection.ping()
+                                       )
+        return pools[key]
+
+class Checkout(object):
+    '''
+    Context manager holding on to a connection of a store for its block, see
+    Storage.acquire.
+    '''
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store.acquire()
+        return self.store
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.store.release(exc_type is not None)
+
+class Storage(object):
+    '''
+    Interface of the stores. Subclasses implement the batched operations
+    (feature_counts, category_counts, add_counts), the single count lookups
+    are built on top of them.
+
+    Every change to the counts bumps the generation of the store and records
+    which features changed in it, so that caches of the model can refresh
+    only those (see model_cache.py).
+    '''
+    # stores that can't be trained, whose changes raise NotImplementedError
+    read_only = False
+
+    def feature_counts(self, features):
+        '''
+        Returns a dictionary mapping each feature in features to a dictionary
+        of {category: count}, features never seen are left out.
+        '''
+        raise NotImplementedError
+
+    def category_counts(self):
+        '''
+        Returns a dictionary mapping each category to its count of documents
+        '''
+        raise NotImplementedError
+
+    def iter_features(self):
+        '''
+        Returns an iterator over (feature, {category: count}) for every
+        feature in the model.
+        '''
+        raise NotImplementedError
+
+    def add_counts(self, features, categories):
+        '''
+        Adds counts to the model in a single transaction.
+
+        The arguments:
+            - features: a dictionary mapping (feature, category) to the number
+                        to add to the count of feature in category.
+            - categories: a dictionary mapping category to the number of
+                          documents to add to its count.
+        '''
+        raise NotImplementedError
+
+    def remove_features(self, features):
+        '''
+        Deletes every count of features from the model in a single
+        transaction. Removals aren't logged feature by feature (they can
+        cover most of the model), the caches of the model reload it whole
+        instead.
+        '''
+        raise NotImplementedError
+
+    def generation(self):
+        '''
+        Returns the generation of the model, which goes up every time the
+        counts change.
+        '''
+        raise NotImplementedError
+
+    def changed_features(self, since):
+        '''
+        Returns the set of features whose counts changed after generation
+        since, or None if the log no longer covers every generation since then
+        and the whole model has to be considered changed.
+        '''
+        raise NotImplementedError
+
+    def reset(self):
+        '''
+        Clears out all the counts.
+        '''
+        raise NotImplementedError
+
+    def sync(self):
+        '''
+        Makes the next reads see the counts written by other connections.
+        '''
+        pass
+
+    def close(self):
+        '''
+        Done with the store, stores kept in files write them out.
+        '''
+        pass
+
+    def acquire(self):
+        '''
+        Holds on to a connection for the calling thread until the matching
+        release, so that the operations in between share it instead of each
+        checking one out. Calls nest. Stores without a pool of connections
+        have nothing to do.
+        '''
+        pass
+
+    def release(self, failed=False):
+        '''
+        Ends the matching acquire, the outermost one gives the connection
+        back. failed tells the operations ended in an error, and whatever
+        they left uncommitted is rolled back.
+        '''
+        pass
+
+    def checkout(self):
+        '''
+        Returns a context manager acquiring the store for its block.
+        '''
+        return Checkout(self)
+
+    def feature_count(self, feat, cat):
+        '''
+        Returns the number of counts feat is in cat
+        '''
+        return self.feature_counts([feat]).get(feat, { }).get(cat, 0.0)
+
+    def category_count(self, cat):
+        '''
+        Return the count of documents in cat
+        '''
+        return self.category_counts().get(cat, 0.0)
+
+    def categories(self):
+        '''
+        Returns a list of all categories
+        '''
+        return self.category_counts().keys()
+
+    def total_count(self):
+        '''
+        Returns the total number of documents.
+        '''
+        return int(sum(self.category_counts().values()))
+
+class MemoryStorage(Storage):
+    '''
+    Keeps the counts in dictionaries. Fast and handy for tests and small
+    models, but the model is gone when the process ends.
+    '''
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.features = { }
+        self.category_table = { }
+        self.current_generation = 0
+        self.changes = { }
+        self.change_rows = 0
+
+    def feature_counts(self, features):
+        with self.lock:
+            return dict(
+                        [
+                         (feat, dict(self.features[feat]))
+                         for feat in features if feat in self.features
+                        ]
+                       )
+
+    def category_counts(self):
+        with self.lock:
+            return dict(self.category_table)
+
+    def iter_features(self):
+        with self.lock:
+            features = self.features.items()
+        for feat, counts in features:
+            yield feat, dict(counts)
+
+    def add_counts(self, features, categories):
+        with self.lock:
+            for (feat, cat), count in features.items():
+                feat_counts = self.features.setdefault(feat, { })
+                feat_counts[cat] = feat_counts.get(cat, 0.0) + count
+            for cat, count in categories.items():
+                self.category_table[cat] = self.category_table.get(cat, 0.0) + count
+            self.current_generation += 1
+            self.log_changes(set([ feat for feat, cat in features ]))
+
+    def log_changes(self, features):
+        '''
+        Records features as changed in the current generation, within the
+        limits of the log (see CHANGE_LOG_ROWS and CHANGE_LOG_BATCH).
+        '''
+        if len(features) <= CHANGE_LOG_BATCH:
+            self.changes[self.current_generation] = features
+            self.change_rows += len(features)
+        oldest = self.current_generation - CHANGE_LOG_GENERATIONS
+        while self.changes and (min(self.changes) <= oldest or self.change_rows > CHANGE_LOG_ROWS):
+            self.change_rows -= len(self.changes.pop(min(self.changes)))
+
+    def remove_features(self, features):
+        with self.lock:
+            for feat in features:
+                self.features.pop(feat, None)
+            self.current_generation += 1
+            self.changes = { }
+            self.change_rows = 0
+
+    def generation(self):
+        return self.current_generation
+
+    def changed_features(self, since):
+        with self.lock:
+            changed = set()
+            for generation in range(since + 1, self.current_generation + 1):
+                if generation not in self.changes:
+                    return None
+                changed |= self.changes[generation]
+            if len(changed) > CHANGE_LOG_BATCH:
+                return None
+            return changed
+
+    def reset(self):
+        with self.lock:
+            self.features = { }
+            self.category_table = { }
+            # a generation with no log tells the caches to drop everything
+            self.current_generation += 1
+            self.changes = { }
+            self.change_rows = 0
+
+class SQLStorage(Storage):
+    '''
+    Common code for the stores backed by a DB-API connection, self.db, with
+    a cursor, self.cursor. Queries are written with %s placeholders and
+    translated to the placeholder of the module. Every operation runs in a
+    checkout, so stores with a pool of connections have one for it.
+    '''
+    placeholder = '%s'
+
+    def query(self, sql):
+        '''
+        Returns sql with the placeholders of the database module.
+        '''
+        return sql.replace('%s', self.placeholder)
+
+    def upsert_counts(self, features, categories):
+        '''
+        Adds to the existing counts, inserting the ones that don't exist yet.
+        '''
+        raise NotImplementedError
+
+    def feature_counts(self, features):
+        with self.checkout():
+            features = list(features)
+            counts = { }
+            for start in range(0, len(features), FEATURE_CHUNK_SIZE):
+                chunk = features[start:start + FEATURE_CHUNK_SIZE]
+                STORAGE_QUERIES.inc()
+                self.cursor.execute(
+                                    self.query(
+                                               '''
+                                               SELECT feature, category, count FROM feature_tbl
+                                               WHERE feature IN (%s)
+                                               ''' % ', '.join(['%s'] * len(chunk))
+                                              ),
+                                    chunk
+                                   )
+                for feat, cat, count in self.cursor.fetchall():
+                    counts.setdefault(feat, { })[cat] = float(count)
+            return counts
+
+    def category_counts(self):
+        with self.checkout():
+            STORAGE_QUERIES.inc()
+            self.cursor.execute('''SELECT category, count FROM category_tbl''')
+            return dict(
+                        [
+                         (category, float(count))
+                         for category, count in self.cursor.fetchall()
+                        ]
+                       )
+
+    def iter_features(self):
+        with self.checkout():
+            self.cursor.execute(
+                                '''
+                                SELECT feature, category, count FROM feature_tbl
+                                ORDER BY feature
+                                '''
+                               )
+            rows = self.cursor.fetchall()
+        feat, counts = None, { }
+        for row_feat, cat, count in rows:
+            if row_feat != feat:
+                if feat is not None:
+                    yield feat, counts
+                feat, counts = row_feat, { }
+            counts[cat] = float(count)
+        if feat is not None:
+            yield feat, counts
+
+    def add_counts(self, features, categories):
+        with self.checkout():
+            try:
+                self.upsert_counts(features, categories)
+                self.log_changes(set([feat for feat, cat in features]))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+
+    def remove_features(self, features):
+        with self.checkout():
+            features = list(features)
+            try:
+                for start in range(0, len(features), FEATURE_CHUNK_SIZE):
+                    chunk = features[start:start + FEATURE_CHUNK_SIZE]
+                    self.cursor.execute(
+                                        self.query(
+                                                   '''
+                                                   DELETE FROM feature_tbl
+                                                   WHERE feature IN (%s)
+                                                   ''' % ', '.join(['%s'] * len(chunk))
+                                                  ),
+                                        chunk
+                                       )
+                self.cursor.execute('''DELETE FROM changed_feature_tbl''')
+                self.bump_generation()
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+
+    def bump_generation(self):
+        '''
+        Increments the generation of the model, inside the current
+        transaction.
+        '''
+        self.cursor.execute(
+                            '''
+                            UPDATE generation_tbl SET generation = generation + 1
+                            WHERE id = 1
+                            '''
+                           )
+
+    def log_changes(self, features):
+        '''
+        Bumps the generation of the model and records features as changed in
+        it. Must be called inside the transaction that changes the counts.
+        Batches of more than CHANGE_LOG_BATCH features leave their generation
+        out of the log, which tells the caches to drop everything.
+        '''
+        self.bump_generation()
+        generation = self.generation()
+        if len(features) <= CHANGE_LOG_BATCH:
+            self.cursor.executemany(
+                                    self.query(
+                                               '''
+                                               INSERT INTO changed_feature_tbl
+                                               (generation, feature) VALUES (%s, %s)
+                                               '''
+                                              ),
+                                    [ (generation, feat) for feat in features ]
+                                   )
+        # forget about generations old enough for any cache to reload fully,
+        # and the oldest ones beyond CHANGE_LOG_ROWS features
+        oldest = generation - CHANGE_LOG_GENERATIONS
+        self.cursor.execute(
+                            self.query(
+                                       '''
+                                       SELECT generation FROM changed_feature_tbl
+                                       ORDER BY generation DESC LIMIT 1 OFFSET %s
+                                       '''
+                                      ),
+                            (CHANGE_LOG_ROWS,)
+                           )
+        row = self.cursor.fetchone()
+        if row is not None:
+            oldest = max(oldest, int(row[0]))
+        self.cursor.execute(
+                            self.query(
+                                       '''
+                                       DELETE FROM changed_feature_tbl
+                                       WHERE generation <= %s
+                                       '''
+                                      ),
+                            (oldest,)
+                           )
+
+    def generation(self):
+        with self.checkout():
+            STORAGE_QUERIES.inc()
+            self.cursor.execute('''SELECT generation FROM generation_tbl WHERE id = 1''')
+            return int(self.cursor.fetchone()[0])
+
+    def changed_features(self, since):
+        with self.checkout():
+            generation = self.generation()
+            # see whether the log covers every generation, and isn't longer
+            # than reloading, before reading it
+            STORAGE_QUERIES.inc()
+            self.cursor.execute(
+                                self.query(
+                                           '''
+                                           SELECT COUNT(DISTINCT generation), COUNT(*)
+                                           FROM changed_feature_tbl
+                                           WHERE generation > %s AND generation <= %s
+                                           '''
+                                          ),
+                                (since, generation)
+                               )
+            generations, rows = self.cursor.fetchone()
+            if generations != generation - since or rows > CHANGE_LOG_BATCH:
+                return None
+            STORAGE_QUERIES.inc()
+            self.cursor.execute(
+                                self.query(
+                                           '''
+                                           SELECT DISTINCT feature FROM changed_feature_tbl
+                                           WHERE generation > %s AND generation <= %s
+                                           '''
+                                          ),
+                                (since, generation)
+                               )
+            return set([ feat for feat, in self.cursor.fetchall() ])
+
+    def reset(self):
+        with self.checkout():
+            self.cursor.execute('''DELETE FROM feature_tbl''')
+            self.cursor.execute('''DELETE FROM category_tbl''')
+            # bump the generation without logging any features, which tells
+            # the caches of the model to drop everything
+            self.cursor.execute('''DELETE FROM changed_feature_tbl''')
+            self.bump_generation()
+            self.db.commit()
+
+    def sync(self):
+        with self.checkout():
+            # end the current transaction, so that the next reads see the
+            # counts committed by other connections since it started
+            self.db.commit()
+
+class SQLiteStorage(SQLStorage):
+    '''
+    Keeps the counts in a SQLite database, creating the tables if needed.
+    The database runs in WAL mode so web processes can keep reading while a
+    training job writes.
+    '''
+    placeholder = '?'
+    schema = '''
+             CREATE TABLE IF NOT EXISTS category_tbl (
+                 category TEXT NOT NULL PRIMARY KEY,
+                 count INTEGER NOT NULL
+             );
+             CREATE TABLE IF NOT EXISTS feature_tbl (
+                 feature TEXT NOT NULL,
+                 category TEXT NOT NULL,
+                 count INTEGER NOT NULL,
+                 PRIMARY KEY (feature, category)
+             );
+             CREATE TABLE IF NOT EXISTS generation_tbl (
+                 id INTEGER NOT NULL PRIMARY KEY,
+                 generation INTEGER NOT NULL
+             );
+             INSERT OR IGNORE INTO generation_tbl (id, generation) VALUES (1, 0);
+             CREATE TABLE IF NOT EXISTS changed_feature_tbl (
+                 generation INTEGER NOT NULL,
+                 feature TEXT NOT NULL
+             );
+             CREATE INDEX IF NOT EXISTS changed_generation_idx
+             ON changed_feature_tbl(generation);
+             '''
+
+    def __init__(self, path):
+        '''
+        path: the database file, ':memory:' for a throwaway database.
+        '''
+        # the connection is shared by the threads of the web frontend, which
+        # go through model_cache.ModelCache and its lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.cursor = self.db.cursor()
+        # reading the answer finishes the statement, which would otherwise
+        # keep the database locked for other connections
+        self.cursor.execute('''PRAGMA journal_mode=WAL''').fetchall()
+        self.cursor.executescript(self.schema)
+        self.db.commit()
+
+    def upsert_counts(self, features, categories):
+        # INSERT OR IGNORE followed by UPDATE works on any SQLite version,
+        # unlike INSERT ... ON CONFLICT DO UPDATE
+        self.cursor.executemany(
+                                '''
+                                INSERT OR IGNORE INTO feature_tbl
+                                (feature, category, count) VALUES (?, ?, 0)
+                                ''',
+                                features.keys()
+                               )
+        self.cursor.executemany(
+                                '''
+                                UPDATE feature_tbl SET count = count + ?
+                                WHERE feature = ? AND category = ?
+                                ''',
+                                [
+                                 (count, feat, cat)
+                                 for (feat, cat), count in features.items()
+                                ]
+                               )
+        self.cursor.executemany(
+                                '''
+                                INSERT OR IGNORE INTO category_tbl
+                                (category, count) VALUES (?, 0)
+                                ''',
+                                [ (cat,) for cat in categories ]
+                               )
+        self.cursor.executemany(
+                                '''
+                                UPDATE category_tbl SET count = count + ?
+                                WHERE category = ?
+                                ''',
+                                [ (count, cat) for cat, count in categories.items() ]
+                               )
+
+class MySQLStorage(SQLStorage):
+    '''
+    Keeps the counts in the MySQL database created by utils/create_schema.sql
+    through the pool of connections of the process to it. self.db and
+    self.cursor are the ones checked out by the calling thread.
+    '''
+    def __init__(self, db, pool=None):
+        '''
+        db: a dictionary with the information to connect to the database. This
+            dict has the following keys: dbname, host, usr, passwd, and
+            optionally pool_size, pool_idle_timeout.
+        pool: the ConnectionPool to use instead of the shared one for db.
+        '''
+        self.pool  = pool or mysql_pool(db)
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        return self.local.connection
+
+    @property
+    def cursor(self):
+        return self.local.cursor
+
+    def acquire(self):
+        depth = getattr(self.local, 'depth', 0)
+        if not depth:
+            self.local.connection = self.pool.get()
+            self.local.cursor = self.local.connection.cursor()
+        self.local.depth = depth + 1
+
+    def release(self, failed=False):
+        self.local.depth -= 1
+        if self.local.depth:
+            return
+        connection = self.local.connection
+        self.local.connection = self.local.cursor = None
+        # end the transaction, a connection handed out next starts afresh
+        # (and sees what other connections committed)
+        try:
+            if failed:
+                connection.rollback()
+            else:
+                connection.commit()
+        except Exception:
+            self.pool.put(connection, broken=True)
+            return
+        self.pool.put(connection)
+
+    def upsert_counts(self, features, categories):
+        self.cursor.executemany(
+                                '''
+                                INSERT INTO feature_tbl
+                                (feature, category, count) VALUES (%s, %s, %s)
+                                ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+                                ''',
+                                [
+                                 (feat, cat, count)
+                                 for (feat, cat), count in features.items()
+                                ]
+                               )
+        self.cursor.executemany(
+                                '''
+                                INSERT INTO category_tbl
+                                (category, count) VALUES (%s, %s)
+                                ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+                                ''',
+                                categories.items()
+                               )
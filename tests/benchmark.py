@@ -0,0 +1,196 @@
+#!/usr/bin/python
+#
+# filename: benchmark.py
+#
+# Benchmarks of the hot paths, run from the tests directory like the tests:
+#
+#   python benchmark.py [results.json]
+#
+# Everything runs against the corpora in data/ and an in-memory model, and
+# pages are downloaded from a local http server over data/pages, so the
+# numbers only depend on the code and the machine. The results are written as
+# json (to stdout by default) to compare them between releases.
+#
+import json, os, platform, sys, time
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+import crawler, page_classifier, scoring
+from page_classifier import Classifier, get_words
+from storage import MemoryStorage
+from model_cache import ModelCache
+from page_server import PAGES, serve_pages
+
+CORPORA = ['data/sports.txt', 'data/technology.txt']
+TRAINING = [('data/train_sports', 'sports'), ('data/train_tech', 'technology')]
+# times each measurement is repeated, the best run is kept
+REPEAT = 5
+# documents scored per (size, categories) for the latency percentiles
+SAMPLES = 200
+# words in the scored documents, and categories in the scoring model
+DOCUMENT_SIZES = [10, 100, 1000]
+CATEGORY_COUNTS = [2, 5, 20]
+PERCENTILES = [50, 90, 99]
+
+def read_lines(filenames):
+    lines = [ ]
+    for filename in filenames:
+        with open(filename, 'r') as file:
+            lines.extend([ line.strip() for line in file if line.strip() ])
+    return lines
+
+def best_time(function, repeat=REPEAT):
+    '''
+    Returns the shortest of repeat runs of function, in seconds.
+    '''
+    times = [ ]
+    for i in range(repeat):
+        started = time.time()
+        function()
+        times.append(time.time() - started)
+    return min(times)
+
+def percentiles(samples):
+    '''
+    Returns the PERCENTILES of samples, in milliseconds.
+    '''
+    samples = sorted(samples)
+    return dict(
+                [
+                 ('p%d' % p, 1000 * samples[min(len(samples) - 1, len(samples) * p // 100)])
+                 for p in PERCENTILES
+                ]
+               )
+
+def bench_get_words():
+    '''
+    Throughput of get_words over the corpora, with a cold and a warm lemma
+    cache.
+    '''
+    lines = read_lines(CORPORA)
+    words = sum([ len(line.split()) for line in lines ])
+    def run():
+        for line in lines:
+            get_words(line)
+    def run_cold():
+        page_classifier.default_tokenizer.lemmas.clear()
+        run()
+    cold = best_time(run_cold)
+    warm = best_time(run)
+    return {
+            'documents': len(lines),
+            'cold_words_per_second': words / cold,
+            'warm_words_per_second': words / warm,
+           }
+
+def bench_train():
+    '''
+    Documents trained per second one at a time, in batches, and from files.
+    '''
+    documents = dict([ (cat, read_lines([ filename ])) for filename, cat in TRAINING ])
+    total = sum([ len(lines) for lines in documents.values() ])
+    def train_each():
+        classifier = Classifier(get_words, MemoryStorage())
+        for cat, lines in documents.items():
+            for line in lines:
+                classifier.train(line, cat)
+    def train_batch():
+        classifier = Classifier(get_words, MemoryStorage())
+        for cat, lines in documents.items():
+            classifier.train_batch(lines, cat)
+    def train_from_file():
+        classifier = Classifier(get_words, MemoryStorage())
+        for filename, cat in TRAINING:
+            classifier.train_from_file(filename, cat)
+    return {
+            'documents': total,
+            'train_documents_per_second': total / best_time(train_each),
+            'train_batch_documents_per_second': total / best_time(train_batch),
+            'train_from_file_documents_per_second': total / best_time(train_from_file),
+           }
+
+def model_with_categories(count, lines):
+    '''
+    Returns a classifier trained with lines dealt round robin into count
+    categories.
+    '''
+    classifier = Classifier(get_words, MemoryStorage())
+    for i in range(count):
+        classifier.train_batch(lines[i::count], 'category%d' % i)
+    return classifier
+
+def bench_classify():
+    '''
+    Latency percentiles of classify for documents of DOCUMENT_SIZES words
+    against models of CATEGORY_COUNTS categories, through a warm model cache.
+    '''
+    lines = read_lines(CORPORA)
+    words = ' '.join(lines).split()
+    results = [ ]
+    for categories in CATEGORY_COUNTS:
+        classifier = model_with_categories(categories, lines)
+        model = ModelCache(classifier.storage)
+        for size in DOCUMENT_SIZES:
+            documents = [
+                         ' '.join([ words[(i * size + j) % len(words)] for j in range(size) ])
+                         for i in range(SAMPLES)
+                        ]
+            # warm the caches once
+            for document in documents:
+                classifier.classify(document, model)
+            samples = [ ]
+            for document in documents:
+                started = time.time()
+                classifier.classify(document, model)
+                samples.append(time.time() - started)
+            result = {'categories': categories, 'words': size}
+            result.update(percentiles(samples))
+            results.append(result)
+    return results
+
+def bench_pages():
+    '''
+    Speed of extracting the text of the fixtures with both parsers, and of
+    downloading and extracting them from the local server.
+    '''
+    pages = sorted(os.listdir(PAGES))
+    data = [ open(os.path.join(PAGES, page), 'rb').read() for page in pages ]
+    size = sum([ len(page) for page in data ])
+    server = serve_pages()
+    host = '127.0.0.1:%d' % server.server_address[1]
+    base = 'http://%s/' % host
+    results = {'pages': len(pages), 'bytes': size}
+    for name, fast_parser in [('beautifulsoup', False), ('streaming', True)]:
+        page_crawler = crawler.Crawler(delay=0, fast_parser=fast_parser)
+        def extract():
+            for page in data:
+                page_crawler.extract_text(page, 'utf-8')
+        def download():
+            for page in pages:
+                page_crawler.download_content(base + page)
+        results[name] = {
+                         'extract_bytes_per_second': size / best_time(extract),
+                         'download_pages_per_second': len(pages) / best_time(download),
+                        }
+        page_crawler.close_connection('http', host)
+    server.shutdown()
+    return results
+
+def run_benchmarks():
+    return {
+            'python': platform.python_version(),
+            'numpy': scoring.numpy is not None,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'get_words': bench_get_words(),
+            'train': bench_train(),
+            'classify': bench_classify(),
+            'pages': bench_pages(),
+           }
+
+if __name__ == '__main__':
+    results = json.dumps(run_benchmarks(), indent=2, sort_keys=True)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w') as file:
+            file.write(results + '\n')
+    else:
+        print results
@@ -0,0 +1,17 @@
+DB = {'backend': 'memory'}
+
+# the rest of the settings of the web frontend, for test_is_it_x
+X = 'sports'
+THRESHOLDS = { }
+MODEL_CACHE_BYTES = 1024 * 1024
+PAGE_MAX_BYTES = 2 * 1024 * 1024
+PAGE_DEADLINE  = 10
+EARLY_EXIT_MARGIN = None
+RESULT_CACHE_TTL  = 60 * 60
+RESULT_CACHE_SIZE = 100
+RESULT_CACHE_PATH = None
+BATCH_WORKERS   = 4
+BATCH_MAX_ITEMS = 10
+METRICS_ENABLED = False
+FEEDBACK_QUEUE_PATH = ':memory:'
+FEEDBACK_INTERVAL   = 5
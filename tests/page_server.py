@@ -0,0 +1,38 @@
+#!/usr/bin/python
+#
+# filename: page_server.py
+#
+# Local http server over the fixtures in data/pages, shared by the tests and
+# benchmark.py so that neither goes out to the web. Run from the tests
+# directory, like them.
+#
+import BaseHTTPServer, SimpleHTTPServer, SocketServer
+import os, threading
+
+PAGES = 'data/pages'
+
+class PageHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    '''
+    Serves the fixtures over keep-alive connections, quietly.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def translate_path(self, path):
+        return os.path.join(os.path.abspath(PAGES), os.path.basename(path))
+
+    def log_message(self, format, *args):
+        pass
+
+class PageServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def serve_pages(handler=PageHandler):
+    '''
+    Starts a local http server answering with handler, the fixtures by
+    default, and returns it.
+    '''
+    server = PageServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
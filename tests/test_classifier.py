@@ -2,12 +2,17 @@
 #
 #
 import os
+import re
 import sys
 import unittest
 
 DIR = '/'.join(os.getcwd().split('/')[:-1])
 sys.path.append(DIR)
-from page_classifier import Classifier,simple_get_words, get_words
+from page_classifier import Classifier,simple_get_words, get_words, Tokenizer
+from page_classifier import STOPWORDS
+import page_classifier
+from nltk.tokenize import WhitespaceTokenizer
+from nltk import WordNetLemmatizer, FreqDist
 
 train_sports = [
     'SPORTS OF THE TIMES; When Americans Are Involved, Fate Can be Fluid',
@@ -112,6 +117,69 @@ class ClassifierTestCase(unittest.TestCase):
          assert self.classifier.category_count('sports') == 4
          assert self.classifier.category_count('technology') == 4
 
+    def test_train_batch(self):
+         '''
+         Training a whole batch at once must leave the same counts as
+         training its items one at a time.
+         '''
+         self.classifier.train_batch(train_sports, 'sports')
+         assert self.classifier.category_count('sports') == 4
+         expected = { }
+         for item in train_sports:
+             for word in get_words(item):
+                 expected[word] = expected.get(word, 0) + 1
+         for word, count in expected.items():
+             assert self.classifier.feature_count(word, 'sports') == count
+
+    def test_train_parallel(self):
+         '''
+         Training from shards of the files in parallel must leave the same
+         counts as training from the files.
+         '''
+         files = [
+                  ('data/train_sports', 'sports'),
+                  ('data/train_tech', 'technology'),
+                 ]
+         # shards small enough to split lines
+         self.classifier.train_parallel(files, 2, 100)
+         parallel = dict(self.classifier.storage.iter_features())
+         categories = self.classifier.category_counts()
+         self.classifier.reset_classifier()
+         for filename, category in files:
+             self.classifier.train_from_file(filename, category)
+         assert self.classifier.category_counts() == categories
+         assert dict(self.classifier.storage.iter_features()) == parallel
+
+    def test_train_stream(self):
+         '''
+         Training from a stream of documents, counted in batches by the
+         workers, must leave the same counts as training from the file.
+         '''
+         with open('data/train_sports', 'r') as file:
+             documents = (line for line in file)
+             trained = self.classifier.train_stream(documents, 'sports', 2, 7)
+         streamed = dict(self.classifier.storage.iter_features())
+         categories = self.classifier.category_counts()
+         assert trained == categories['sports']
+         self.classifier.reset_classifier()
+         self.classifier.train_from_file('data/train_sports', 'sports')
+         assert self.classifier.category_counts() == categories
+         assert dict(self.classifier.storage.iter_features()) == streamed
+
+    def test_train_stream_on_trained(self):
+         '''
+         The keys of every batch are handed to on_trained, in order, once the
+         batch is in the model.
+         '''
+         with open('data/train_sports', 'r') as file:
+             documents = [ (i, line) for i, line in enumerate(file) if line.strip() ]
+         done = [ ]
+         def on_trained(keys):
+             done.extend(keys)
+             assert self.classifier.category_count('sports') == len(done)
+         self.classifier.train_stream(documents, 'sports', 2, 7, on_trained)
+         assert done == [ key for key, document in documents ]
+
     def test_feature_probability(self):
         '''
         '''
@@ -141,6 +209,65 @@ class ClassifierTestCase(unittest.TestCase):
         assert category_for_sport_item == 'sports', category_for_sport_item
         #assert category_for_tech_item  == 'technology', category_for_tech_item
 
+    def test_scores(self):
+        '''
+        The batched scores must match the per category probability for every
+        category the classifier knows about.
+        '''
+        training_data = [(train_sports, 'sports'), (train_tech, 'technology')]
+        for data, category in training_data:
+            f = lambda x: self.classifier.train(x, category)
+            map(f, data)
+        item = 'PERSONAL HEALTH; Lurking Menaces Can Threaten the Pleasures of Swimming'
+        scores = self.classifier.scores(item)
+        assert sorted(scores.keys()) == sorted(self.classifier.categories())
+        for category, score in scores.items():
+            expected = self.classifier.probability(item, category)
+            assert abs(score - expected) < 1e-9, (category, score, expected)
+
+    def test_scores_stream(self):
+        '''
+        Streamed without a margin, a document gets the same scores as in one
+        piece. With a decisive margin, the rest of it is left unread.
+        '''
+        self.classifier.train_from_file('data/train_tech', 'technology')
+        self.classifier.train_from_file('data/train_sports', 'sports')
+        fragments = open('data/test_sports', 'r').read().decode('utf-8').split()
+        streamed = self.classifier.scores_stream(iter(fragments))
+        scores = self.classifier.scores(' '.join(fragments))
+        assert sorted(streamed) == sorted(scores)
+        for category, score in scores.items():
+            assert abs(streamed[category] - score) < 1e-9, (category, streamed, scores)
+        read = [ ]
+        def counted():
+            for fragment in fragments:
+                read.append(fragment)
+                yield fragment
+        text_size = page_classifier.STREAM_TEXT_SIZE
+        page_classifier.STREAM_TEXT_SIZE = 50
+        try:
+            self.classifier.scores_stream(counted(), margin=1e9)
+            assert len(read) == len(fragments)
+            read = [ ]
+            self.classifier.classify_stream(counted(), margin=0.0)
+            assert 0 < len(read) < len(fragments), (len(read), len(fragments))
+        finally:
+            page_classifier.STREAM_TEXT_SIZE = text_size
+
+    def test_decide(self):
+        '''
+        The default threshold always decides, a category whose threshold
+        isn't met by the margin over the next one is left uncertain.
+        '''
+        probabilities = {'sports': -1.0, 'technology': -1.5}
+        assert self.classifier.decide(probabilities) == 'sports'
+        # the threshold is a margin on the scores
+        self.classifier.set_threshold('sports', 1.0)
+        assert self.classifier.decide(probabilities) is None
+        self.classifier.set_threshold('sports', 0.5)
+        assert self.classifier.decide(probabilities) == 'sports'
+        self.assertRaises(ValueError, self.classifier.set_threshold, 'sports', -1.0)
+
     def test_classify_large(self):
         '''
         Test classification with a larger data set, split 50/9 for training/test
@@ -167,5 +294,39 @@ class ClassifierTestCase(unittest.TestCase):
         '''
         self.classifier.reset_classifier()
 
+def reference_get_words(document):
+    '''
+    get_words as it was first written, to check the Tokenizer against.
+    '''
+    regex1 = re.compile('\W')          # match non-alphanumeric
+    regex2 = re.compile('&(#)*(\w)*;')  # match html entities
+    regex3 = re.compile('( ){2,}')      # match more than 2 spaces
+    lemmatizer = WordNetLemmatizer()
+    tokenizer  = WhitespaceTokenizer()
+    document   = regex3.sub(' ', regex2.sub(' ', regex1.sub(' ', document.lower())))
+    words = [
+             lemmatizer.lemmatize(word)
+             for word in tokenizer.tokenize(document)
+             if word not in STOPWORDS and len(word) > 2
+            ]
+    return FreqDist(words)
+
+class TokenizerTestCase(unittest.TestCase):
+    '''
+    Testing the tokenizer gives the same words as the original get_words
+    '''
+    def test_get_words(self):
+        documents  = open('data/sports.txt', 'r').readlines()
+        documents += open('data/technology.txt', 'r').readlines()
+        documents.append(u'Caf\xe9 &amp; games&#39;\tof the\nweek')
+        for document in documents:
+            assert get_words(document) == reference_get_words(document), document
+
+    def test_lemma_cache(self):
+        tokenizer = Tokenizer(cache_size=2)
+        words = list(tokenizer.iter_words('games players teams games'))
+        assert words == [tokenizer.lemmatizer.lemmatize(w) for w in ['games', 'players', 'teams', 'games']]
+        assert len(tokenizer.lemmas) <= 2
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#
+# filename: test_classify.py
+#
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+from model_file import export_model
+from page_classifier import Classifier, get_words
+from page_server import serve_pages
+from storage import MemoryStorage
+
+class ClassifyScriptTestCase(unittest.TestCase):
+    '''
+    Testing utils/classify.py writes a result for every line, in order,
+    even when some lines can't be classified.
+    '''
+    def setUp(self):
+        classifier = Classifier(get_words, MemoryStorage())
+        classifier.train_from_file('data/train_sports', 'sports')
+        classifier.train_from_file('data/train_tech', 'technology')
+        handle, self.model = tempfile.mkstemp()
+        os.close(handle)
+        export_model(classifier.storage, self.model)
+        self.server = serve_pages()
+        self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.model)
+
+    def classify(self, mode, lines):
+        '''
+        Runs the script on lines, returns its json results.
+        '''
+        script = subprocess.Popen(
+                                  [ sys.executable, 'classify.py', mode, '-', self.model, '2' ],
+                                  cwd=os.path.join(DIR, 'utils'),
+                                  stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE
+                                 )
+        output, errors = script.communicate('\n'.join(lines) + '\n')
+        assert script.returncode == 0, errors
+        return [ json.loads(line) for line in output.splitlines() ]
+
+    def test_bad_urls(self):
+        results = self.classify(
+                                'urls',
+                                [
+                                 self.base + '/sports.html',
+                                 'http://[::1/',
+                                 self.base + '/missing.html',
+                                 self.base + '/technology.html',
+                                ]
+                               )
+        assert [ result['line'] for result in results ] == [1, 2, 3, 4], results
+        assert results[0]['category'] == 'sports'
+        assert 'error' in results[1] and 'error' in results[2]
+        assert results[3]['category'] == 'technology'
+
+    def test_documents(self):
+        results = self.classify('documents', [ open('data/test_sports').readline().strip() ])
+        assert results[0]['category'] == 'sports', results
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,12 @@
 # filename: test_crawler.py
 #
 import os
+import shutil
 import sys
+import tempfile
+import time
 import unittest
+import BaseHTTPServer
 
 DIR = '/'.join(os.getcwd().split('/')[:-1])
 sys.path.append(DIR)
@@ -22,7 +26,22 @@ COOKING_URLS = [
                 'http://www.recipe.com/'
                ]
 
-from crawler import Crawler
+TEST_HTML = '''<!DOCTYPE html>
+<html>
+  <head><title>Sports</title><style>p { color: red; }</style></head>
+  <body>
+    <script>var skipped = true;</script>
+    <div><p>Derek Jeter &amp; the <b>Yankees</b></p><p>won again</p></div>
+    <a href="/scores#today">Scores</a> <a href="mailto:desk@example.com">Mail</a>
+  </body>
+</html>'''
+
+import crawler
+from crawler import Crawler, CrawlerError, HostLimiter, page_links, in_domains
+from crawler import text_fragments
+from frontier import Frontier
+from page_server import serve_pages
+from BeautifulSoup import BeautifulSoup
 class CrawlerTestCase(unittest.TestCase):
     '''
     Testing the functionality of the crawler
@@ -52,9 +71,342 @@ class CrawlerTestCase(unittest.TestCase):
         assert 'technology' in os.listdir(self.crawler.data_dir)
         assert 'cooking'    in os.listdir(self.crawler.data_dir)
 
+    def test_parse_content(self):
+        '''
+        Extract the text of a page, leaving out scripts and styles, also for
+        pages nested deeper than the recursion limit.
+        '''
+        content = self.crawler.parse_content(BeautifulSoup(TEST_HTML))
+        assert content.split() == [
+                                   'DOCTYPE', 'html', 'Sports', 'Derek',
+                                   'Jeter', '&amp;', 'the', 'Yankees',
+                                   'won', 'again', 'Scores', 'Mail',
+                                  ], content
+        deep_html = '<div>' * (sys.getrecursionlimit() * 2) + 'deep'
+        assert self.crawler.parse_content(BeautifulSoup(deep_html)) == 'deep'
+
+    def test_fast_parser(self):
+        '''
+        The streaming parser extracts the same text as BeautifulSoup.
+        '''
+        fast_crawler = Crawler('data', fast_parser=True)
+        expected = self.crawler.extract_text(TEST_HTML)
+        assert fast_crawler.extract_text(TEST_HTML).split() == expected.split()
+
+    def test_links(self):
+        '''
+        Both parsers find the links in a page, which are made absolute and
+        normalized, leaving out the ones that aren't to pages.
+        '''
+        links = [ ]
+        self.crawler.extract_text(TEST_HTML, None, links)
+        fast_links = [ ]
+        Crawler('data', fast_parser=True).extract_text(TEST_HTML, None, fast_links)
+        assert links == fast_links == ['/scores#today', 'mailto:desk@example.com'], links
+        hrefs = links + ['logo.png', 'HTTP://Example.com:80/scores', '../news']
+        assert page_links('http://example.com/sports/', hrefs) == [
+                                                                   'http://example.com/scores',
+                                                                   'http://example.com/news',
+                                                                  ]
+
+    def test_in_domains(self):
+        '''
+        Links are followed to the domains of the seeds and their subdomains.
+        '''
+        assert in_domains('www.example.com', ['example.com'])
+        assert in_domains('blog.example.com', ['example.com'])
+        assert not in_domains('example.com.evil.org', ['example.com'])
+        assert not in_domains('notexample.com', ['example.com'])
+
     def tearDown(self):
         pass
 
 
+# pages of a made up site and the pages they link to, x is on another host
+SITE = {
+        'a': ['b', 'c', 'http://localhost:%(port)d/site/x'],
+        'b': ['d'],
+        'c': ['d', 'e'],
+        'd': ['a'],
+        'e': [ ],
+        'x': [ ],
+       }
+
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves made up pages, remembering when each path was asked for:
+        /status/<code> --> an empty answer with that status
+        /page/<name>   --> a page with name as text, after sleeping for the
+                           seconds in the query string if any
+        /big/<size>    --> a page of size bytes
+        /drip/<chunks> --> a page sent in chunks of 1000 bytes (or the bytes in
+                           the query string), 0.1 seconds apart
+        /site/<name>   --> a page of SITE with name as text and its links
+    '''
+    protocol_version = 'HTTP/1.1'
+    hits = { }
+
+    def do_GET(self):
+        LocalHandler.hits.setdefault(self.path, [ ]).append(time.time())
+        path, query = (self.path.split('?', 1) + [ '' ])[:2]
+        parts = path.strip('/').split('/')
+        status, body = 200, ''
+        if parts[0] == 'status':
+            status = int(parts[1])
+        elif parts[0] == 'page':
+            if query:
+                time.sleep(float(query))
+            body = '<html><body><p>%s</p></body></html>' % parts[1]
+        elif parts[0] == 'big':
+            body = ('<p>' + 'word ' * int(parts[1]))[:int(parts[1])]
+        elif parts[0] == 'site':
+            port = self.server.server_address[1]
+            links = [
+                     '<a href="%s"></a>' % (link % {'port': port} if '://' in link else '/site/' + link)
+                     for link in SITE[parts[1]]
+                    ]
+            body = '<html><body><p>%s</p>%s</body></html>' % (parts[1], ''.join(links))
+        elif parts[0] == 'drip':
+            chunks, size = int(parts[1]), int(query or 1000)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(chunks * size))
+            self.end_headers()
+            for i in range(chunks):
+                try:
+                    self.wfile.write('x' * size)
+                    self.wfile.flush()
+                except IOError:
+                    # the crawler gave up on the page
+                    return
+                time.sleep(0.1)
+            return
+        else:
+            status = 404
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class LocalCrawlerTestCase(unittest.TestCase):
+    '''
+    Testing the politeness, retries and ordering of the crawler against a
+    local http server.
+    '''
+    def setUp(self):
+        LocalHandler.hits = { }
+        self.server = serve_pages(LocalHandler)
+        self.host = '127.0.0.1:%d' % self.server.server_address[1]
+        self.base = 'http://%s' % self.host
+        self.data_dir = tempfile.mkdtemp()
+        # no need to wait for real between retries
+        self.backoff = crawler.RETRY_BACKOFF
+        crawler.RETRY_BACKOFF = 0.01
+
+    def tearDown(self):
+        crawler.RETRY_BACKOFF = self.backoff
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.data_dir)
+
+    def test_host_limiter(self):
+        '''
+        Requests to a host are spaced delay seconds apart, requests to other
+        hosts aren't held up.
+        '''
+        limiter = HostLimiter(0.2)
+        started = time.time()
+        for i in range(3):
+            limiter.wait('example.com')
+        assert time.time() - started >= 0.4
+        started = time.time()
+        limiter.wait('example.org')
+        assert time.time() - started < 0.1
+
+    def test_host_delay(self):
+        '''
+        Pages of the same host downloaded by several workers still go out
+        delay seconds apart.
+        '''
+        page_crawler = Crawler(self.data_dir, workers=3, delay=0.2)
+        pages = [ self.base + '/page/%d' % i for i in range(3) ]
+        page_crawler.crawl(pages, 'label')
+        hits = sorted([ times[0] for times in LocalHandler.hits.values() ])
+        assert len(hits) == 3
+        for earlier, later in zip(hits, hits[1:]):
+            assert later - earlier >= 0.15, hits
+
+    def test_retries(self):
+        '''
+        Server errors are retried, client errors aren't.
+        '''
+        page_crawler = Crawler(delay=0, retries=2)
+        self.assertRaises(CrawlerError, page_crawler.download_content, self.base + '/status/503')
+        assert len(LocalHandler.hits['/status/503']) == 3
+        self.assertRaises(CrawlerError, page_crawler.download_content, self.base + '/status/404')
+        assert len(LocalHandler.hits['/status/404']) == 1
+
+    def test_crawl_order(self):
+        '''
+        Documents are written in the order of the pages, however long each
+        one takes to download, and pages that fail are left out.
+        '''
+        page_crawler = Crawler(self.data_dir, workers=4, delay=0)
+        pages = [
+                 self.base + '/page/first?0.3',
+                 self.base + '/page/second?0.2',
+                 self.base + '/status/404',
+                 self.base + '/page/third',
+                 self.base + '/page/fourth?0.1',
+                ]
+        page_crawler.crawl(pages, 'label')
+        with open(os.path.join(self.data_dir, 'label')) as file:
+            lines = [ line.strip() for line in file ]
+        assert lines == ['first', 'second', 'third', 'fourth'], lines
+
+    def test_max_bytes(self):
+        '''
+        Pages are cut off at max_bytes, the whole page comes through when
+        it's smaller.
+        '''
+        page_crawler = Crawler(delay=0, max_bytes=40000)
+        response = page_crawler.open_page(self.base + '/big/100000')
+        assert len(''.join(page_crawler.read_chunks(response))) == 40000
+        response = page_crawler.open_page(self.base + '/big/30000')
+        assert len(''.join(page_crawler.read_chunks(response))) == 30000
+
+    def test_deadline(self):
+        '''
+        A page still downloading after deadline seconds is cut off right
+        then, keeping what came before, however small the pieces it's sent
+        in.
+        '''
+        for path, deadline in [('/drip/60', 0.35), ('/drip/200?100', 1.0)]:
+            page_crawler = Crawler(delay=0, deadline=deadline)
+            started = time.time()
+            data = page_crawler.download_content(self.base + path)
+            elapsed = time.time() - started
+            assert deadline <= elapsed < deadline + 0.2, (path, elapsed)
+            assert 0 < len(data.strip()) < crawler.CHUNK_SIZE, (path, len(data))
+
+    def test_deadline_before_body(self):
+        '''
+        Time spent waiting for the headers, retrying and backing off counts
+        towards the deadline, the page is given up on when it runs out.
+        '''
+        crawler.RETRY_BACKOFF = 0.2
+        page_crawler = Crawler(delay=0, deadline=0.5, retries=5)
+        started = time.time()
+        self.assertRaises(CrawlerError, page_crawler.download_content, self.base + '/status/503')
+        assert time.time() - started < 0.7, time.time() - started
+        started = time.time()
+        self.assertRaises(CrawlerError, page_crawler.download_content, self.base + '/page/slow?2')
+        assert time.time() - started < 0.7, time.time() - started
+
+    def test_record_done(self):
+        '''
+        Pages generated with record False stay pending in the frontier until
+        given to record_done, failed ones are recorded right away.
+        '''
+        trained = Frontier(os.path.join(self.data_dir, 'trained.db'))
+        page_crawler = Crawler(delay=0, frontier=trained)
+        pages = [ self.base + '/page/one', self.base + '/status/404', self.base + '/page/two' ]
+        documents = page_crawler.iter_documents(pages, 'label', record=False)
+        first = documents.next()
+        assert [ content.strip() for page, content in [ first ] + list(documents) ] == ['one', 'two']
+        assert trained.counts('label') == {'pending': 2, 'failed': 1}
+        page_crawler.record_done([ first[0] ])
+        assert trained.counts('label') == {'pending': 1, 'failed': 1, 'done': 1}
+        # an interrupted run downloads again the pages not recorded
+        assert [ page for page, etag, last_modified in trained.pending('label') ] == [ pages[2] ]
+
+    def test_record_done_duplicates(self):
+        '''
+        A page given twice is recorded once per time it's generated, and a
+        document downloaded again before the first copy is recorded isn't
+        generated twice.
+        '''
+        page_crawler = Crawler(delay=0)
+        page = self.base + '/page/one'
+        documents = list(page_crawler.iter_documents([ page, page ], 'label', record=False))
+        assert [ url for url, content in documents ] == [ page, page ]
+        page_crawler.record_done([ page ])
+        page_crawler.record_done([ page ])
+        assert page_crawler.unrecorded == { } and page_crawler.reserved == { }
+
+        trained = Frontier(os.path.join(self.data_dir, 'trained.db'))
+        page_crawler = Crawler(delay=0, frontier=trained)
+        pages = [ page, page + '?0', self.base + '/page/two' ]
+        documents = list(page_crawler.iter_documents(pages, 'label', record=False))
+        assert [ url for url, content in documents ] == [ pages[0], pages[2] ]
+        assert trained.counts('label') == {'pending': 2, 'duplicate': 1}
+        page_crawler.record_done([ pages[0], pages[2] ])
+        assert trained.counts('label') == {'done': 2, 'duplicate': 1}
+        assert page_crawler.reserved == { }
+
+    def crawl_links(self, **limits):
+        '''
+        Crawls SITE from a and returns the documents written, in order.
+        '''
+        page_crawler = Crawler(self.data_dir, workers=2, delay=0, frontier=self.frontier)
+        page_crawler.crawl_links([ self.base + '/site/a' ], 'label', **limits)
+        with open(os.path.join(self.data_dir, 'label')) as file:
+            documents = [ line.strip() for line in file ]
+        os.remove(os.path.join(self.data_dir, 'label'))
+        return documents
+
+    def test_crawl_links(self):
+        '''
+        Links are followed breadth first up to max_depth, every page once,
+        within the limits of pages in all and per host, and off the domains
+        of the seeds only if asked to.
+        '''
+        self.frontier = None
+        assert self.crawl_links(max_depth=0) == ['a']
+        assert self.crawl_links(max_depth=1) == ['a', 'b', 'c']
+        assert self.crawl_links(max_depth=3) == ['a', 'b', 'c', 'd', 'e']
+        assert self.crawl_links(max_depth=1, same_domain=False) == ['a', 'b', 'c', 'x']
+        assert self.crawl_links(max_depth=3, max_pages=4) == ['a', 'b', 'c', 'd']
+        assert self.crawl_links(max_depth=1, max_per_host=2, same_domain=False) == ['a', 'b', 'x']
+
+    def test_crawl_links_again(self):
+        '''
+        With a frontier, crawling again downloads the pages again but doesn't
+        write their documents twice.
+        '''
+        self.frontier = Frontier(os.path.join(self.data_dir, 'frontier.db'))
+        assert self.crawl_links(max_depth=1) == ['a', 'b', 'c']
+        assert self.crawl_links(max_depth=2) == ['d', 'e']
+        assert len(LocalHandler.hits['/site/a']) == 2
+
+class TextFragmentsTestCase(unittest.TestCase):
+    '''
+    Testing the text of a page streamed in chunks is decoded right.
+    '''
+    def text(self, chunks, charset=None):
+        return u' '.join(text_fragments(chunks, charset))
+
+    def test_declared_charset(self):
+        html = u'<p>caf\xe9 cr\xe8me</p>'.encode('latin-1')
+        assert self.text([ html ], 'latin-1') == u'caf\xe9 cr\xe8me'
+
+    def test_meta_charset(self):
+        html = u'<meta charset="iso-8859-1"><p>caf\xe9</p>'.encode('latin-1')
+        assert self.text([ html ]) == u'caf\xe9'
+
+    def test_split_characters(self):
+        '''
+        Characters split between two chunks are put back together, and
+        undecodable bytes don't stop the page.
+        '''
+        html = u'<p>caf\xe9 \u20ac</p>'.encode('utf-8')
+        chunks = [ html[i:i + 1] for i in range(len(html)) ]
+        assert self.text(chunks) == u'caf\xe9 \u20ac'
+        assert self.text([ '<p>caf\xe9</p>' ]) == u'caf\ufffd'
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+#
+# filename: test_evaluation.py
+#
+import os
+import sys
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+from evaluation import read_labelled, score_matrix, cross_validate, threshold_sweep
+from page_classifier import Classifier, get_words
+from storage import MemoryStorage
+
+class EvaluationTestCase(unittest.TestCase):
+    '''
+    Testing the batched scores and cross-validation give the same numbers
+    as scoring one document at a time with a trained classifier.
+    '''
+    def setUp(self):
+        self.documents = read_labelled(
+                                       [
+                                        ('data/train_sports', 'sports'),
+                                        ('data/train_tech', 'technology'),
+                                       ]
+                                      )
+
+    def train(self, documents):
+        classifier = Classifier(get_words, MemoryStorage())
+        for document, cat in documents:
+            classifier.train(document, cat)
+        return classifier
+
+    def test_score_matrix(self):
+        classifier = self.train(self.documents)
+        test = read_labelled([('data/test_sports', 'sports'), ('data/test_tech', 'technology')])
+        categories, scores = score_matrix(classifier, test)
+        for (document, cat), row in zip(test, scores):
+            expected = classifier.scores(document)
+            for category, score in zip(categories, row):
+                assert abs(score - expected[category]) < 1e-9
+
+    def test_cross_validate(self):
+        categories, scores, labels = cross_validate(self.train([ ]), self.documents, 3)
+        assert labels == [ cat for document, cat in self.documents ]
+        # the second fold, scored by a classifier trained on the others
+        classifier = self.train([ d for i, d in enumerate(self.documents) if i % 3 != 1 ])
+        for i in range(1, len(self.documents), 3):
+            expected = classifier.scores(self.documents[i][0])
+            for category, score in zip(categories, scores[i]):
+                assert abs(score - expected[category]) < 1e-9
+
+    def test_threshold_sweep(self):
+        categories = ['sports', 'technology']
+        scores = [[-1.0, -3.0], [-1.0, -1.2], [-2.0, -1.0]]
+        labels = ['sports', 'technology', 'technology']
+        report = threshold_sweep(categories, scores, labels, [0.0, 0.5])
+        sports = [ line for line in report if line['category'] == 'sports' ]
+        assert sports[0]['predicted'] == 2 and sports[0]['precision'] == 0.5
+        assert sports[0]['recall'] == 1.0
+        # a margin of 0.2 is less than 0.5, that one is left uncertain
+        assert sports[1]['predicted'] == 1 and sports[1]['precision'] == 1.0
+
+if __name__ == '__main__':
+    unittest.main()
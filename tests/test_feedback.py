@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# filename: test_feedback.py
+#
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+import feedback
+from crawler import CrawlerError
+from feedback import FeedbackQueue, FeedbackTrainer
+from page_classifier import Classifier, simple_get_words
+from storage import MemoryStorage
+
+class PageCrawler(object):
+    '''
+    Stand in for the crawler, serves pages from a dictionary.
+    '''
+    def __init__(self, pages):
+        self.pages = pages
+
+    def download_content(self, url):
+        if url not in self.pages:
+            raise CrawlerError(url)
+        return self.pages[url]
+
+class FeedbackTestCase(unittest.TestCase):
+    '''
+    Testing reports stay queued until trained, and are trained in batches.
+    '''
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        self.queue = FeedbackQueue(self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_queue(self):
+        self.queue.put('http://a', 'sports')
+        self.queue.put('http://b', 'technology')
+        reports = self.queue.claim(10)
+        assert [ report[1:] for report in reports ] == [
+                                                        ('http://a', 'sports'),
+                                                        ('http://b', 'technology'),
+                                                       ]
+        # claimed reports aren't handed out twice, but aren't gone either
+        assert self.queue.claim(10) == [ ]
+        assert len(FeedbackQueue(self.filename)) == 2
+        self.queue.done([ reports[0][0] ])
+        assert len(self.queue) == 1
+
+    def test_claim_timeout(self):
+        self.queue.put('http://a', 'sports')
+        self.queue.claim(10)
+        timeout = feedback.CLAIM_TIMEOUT
+        feedback.CLAIM_TIMEOUT = -1
+        try:
+            assert len(self.queue.claim(10)) == 1
+        finally:
+            feedback.CLAIM_TIMEOUT = timeout
+
+    def test_release(self):
+        self.queue.put('http://a', 'sports')
+        self.queue.put('http://b', 'technology')
+        self.queue.claim(1)
+        # claims younger than the timeout are left alone
+        assert self.queue.release() == 0
+        assert [ report[1] for report in self.queue.claim(10) ] == [ 'http://b' ]
+        assert self.queue.release(-1) == 2
+        assert len(self.queue.claim(10)) == 2
+
+    def test_release_at_startup(self):
+        # a trainer died holding a claim
+        self.queue.put('http://a', 'sports')
+        self.queue.claim(10)
+        classifier = Classifier(simple_get_words, MemoryStorage())
+        trainer = FeedbackTrainer(
+                                  FeedbackQueue(self.filename),
+                                  classifier,
+                                  PageCrawler({ 'http://a': 'derek jeter homerun' }),
+                                  interval=60
+                                 )
+        timeout = feedback.CLAIM_TIMEOUT
+        feedback.CLAIM_TIMEOUT = -1
+        try:
+            trainer.start()
+            # the next trainer to start trains the report without waiting
+            # for its interval
+            for attempt in range(100):
+                if trainer.trained:
+                    break
+                time.sleep(0.05)
+        finally:
+            feedback.CLAIM_TIMEOUT = timeout
+        assert len(self.queue) == 0
+        assert trainer.trained == 1
+
+    def test_train_batch(self):
+        classifier = Classifier(simple_get_words, MemoryStorage())
+        trained = [ ]
+        trainer = FeedbackTrainer(
+                                  self.queue,
+                                  classifier,
+                                  PageCrawler(
+                                              {
+                                               'http://a': 'derek jeter homerun',
+                                               'http://b': 'robots everywhere',
+                                              }
+                                             ),
+                                  lambda: trained.append(True)
+                                 )
+        for url, category in [
+                              ('http://a', 'sports'),
+                              ('http://b', 'technology'),
+                              ('http://gone', 'sports'),
+                             ]:
+            self.queue.put(url, category)
+        generation = classifier.storage.generation()
+        assert trainer.train_batch() == 3
+        # the whole batch is a single update
+        assert classifier.storage.generation() == generation + 1
+        assert classifier.category_counts() == {'sports': 1.0, 'technology': 1.0}
+        assert classifier.feature_count('jeter', 'sports') == 1.0
+        assert trained == [ True ]
+        assert len(self.queue) == 0
+        assert trainer.train_batch() == 0
+
+if __name__ == '__main__':
+    unittest.main()
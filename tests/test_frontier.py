@@ -0,0 +1,89 @@
+#!/usr/bin/python
+#
+# filename: test_frontier.py
+#
+import os
+import sys
+import tempfile
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+from frontier import Frontier
+
+class FrontierTestCase(unittest.TestCase):
+    '''
+    Testing the frontier only hands out what's left to download, and
+    remembers the documents written.
+    '''
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        self.frontier = Frontier(self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_add(self):
+        self.frontier.add(['http://Example.com/a#top', 'http://example.com/b'], 'tech')
+        self.frontier.add(['http://example.com/a'], 'tech')
+        self.assertEqual(
+                         [ row[0] for row in self.frontier.pending('tech') ],
+                         ['http://example.com/a', 'http://example.com/b']
+                        )
+        self.assertEqual(self.frontier.pending('sports'), [ ])
+
+    def test_conflicts(self):
+        self.assertEqual(self.frontier.add(['http://example.com/a'], 'tech'), [ ])
+        self.frontier.record('http://example.com/a', 'done')
+        # a url is kept under the label it was first given, the others are
+        # reported
+        self.assertEqual(
+                         self.frontier.add(
+                                           ['http://example.com/a', 'http://example.com/b'],
+                                           'sports',
+                                           refetch=True
+                                          ),
+                         [('http://example.com/a', 'tech')]
+                        )
+        self.assertEqual(
+                         [ row[0] for row in self.frontier.pending('sports') ],
+                         ['http://example.com/b']
+                        )
+        self.assertEqual(self.frontier.pending('tech'), [ ])
+        self.assertEqual(self.frontier.add(['http://example.com/a'], 'tech'), [ ])
+
+    def test_record(self):
+        self.frontier.add(['http://example.com/a', 'http://example.com/b'], 'tech')
+        self.frontier.record('http://example.com/a', 'done', '"v1"', None, 'digest')
+        self.assertEqual(
+                         [ row[0] for row in self.frontier.pending('tech') ],
+                         ['http://example.com/b']
+                        )
+        self.assertEqual(self.frontier.owner('digest'), 'http://example.com/a')
+        self.assertEqual(self.frontier.owner('other'), None)
+        self.assertEqual(self.frontier.counts('tech'), {'done': 1, 'pending': 1})
+
+    def test_resume(self):
+        self.frontier.add(['http://example.com/a', 'http://example.com/b'], 'tech')
+        self.frontier.record('http://example.com/a', 'done')
+        resumed = Frontier(self.filename)
+        self.assertEqual(
+                         [ row[0] for row in resumed.pending('tech') ],
+                         ['http://example.com/b']
+                        )
+
+    def test_refetch(self):
+        self.frontier.add(['http://example.com/a'], 'tech')
+        self.frontier.record('http://example.com/a', 'done', '"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.frontier.add(['http://example.com/a'], 'tech')
+        self.assertEqual(self.frontier.pending('tech'), [ ])
+        self.frontier.add(['http://example.com/a'], 'tech', refetch=True)
+        self.assertEqual(
+                         self.frontier.pending('tech'),
+                         [('http://example.com/a', '"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')]
+                        )
+
+if __name__ == '__main__':
+    unittest.main()
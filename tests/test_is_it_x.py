@@ -0,0 +1,132 @@
+#!/usr/bin/python
+#
+# filename: test_is_it_x.py
+#
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+import is_it_x
+from page_server import serve_pages
+from page_classifier import Classifier, get_words
+from model_file import export_model
+from storage import MemoryStorage
+
+class BatchApiTestCase(unittest.TestCase):
+    '''
+    Testing the batch api classifies every item it's given, and turns down
+    batches that aren't made of strings.
+    '''
+    def setUp(self):
+        storage = MemoryStorage()
+        classifier = Classifier(get_words, storage)
+        classifier.train_from_file('data/train_sports', 'sports')
+        classifier.train_from_file('data/train_tech', 'technology')
+        # a fresh model and caches for every test
+        is_it_x.DB = storage
+        is_it_x.classifier = is_it_x.model = is_it_x.feedback_trainer = None
+        is_it_x.results = is_it_x.result_cache.ResultCache()
+        self.client = is_it_x.app.test_client()
+        self.server = serve_pages()
+        self.host = '127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, batch):
+        response = self.client.post(
+                                    '/api/classify/',
+                                    data=json.dumps(batch),
+                                    content_type='application/json'
+                                   )
+        return response.status_code, json.loads(response.data)
+
+    def test_batch(self):
+        status, body = self.post(
+                                 {
+                                  'urls': [
+                                           'http://%s/sports.html' % self.host,
+                                           '%s/technology.html' % self.host,
+                                          ],
+                                  'documents': [ open('data/test_sports').readline() ],
+                                 }
+                                )
+        assert status == 200, body
+        results = body['results']
+        assert [ entry.get('category') for entry in results ] == ['sports', 'technology', 'sports'], results
+        assert results[1]['url'] == '%s/technology.html' % self.host
+        assert 'text' not in results[2]
+
+    def test_failed_items(self):
+        '''
+        Items that can't be classified get an error, the others are still
+        classified.
+        '''
+        status, body = self.post(
+                                 {
+                                  'urls': [
+                                           'http://%s/missing.html' % self.host,
+                                           'http://[::1/',
+                                          ],
+                                  'documents': [ 'Derek Jeter hits a home run' ],
+                                 }
+                                )
+        assert status == 200, body
+        results = body['results']
+        assert 'error' in results[0] and 'error' in results[1], results
+        assert results[2]['category'] is not None
+
+    def test_bad_batches(self):
+        for batch in [
+                      ['http://example.com'],
+                      {'urls': 'http://example.com'},
+                      {'documents': ['some text', None]},
+                      {'urls': [ 'http://example.com/%d' % i for i in range(11) ]},
+                     ]:
+            status, body = self.post(batch)
+            assert status == 400, (batch, status)
+            assert 'error' in body
+
+class FeedbackTrainerTestCase(unittest.TestCase):
+    '''
+    Testing the feedback trainer writes to the store requests read, and
+    isn't started for read only models.
+    '''
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.storage.add_counts(
+                                {('ball', 'sports'): 2, ('code', 'technology'): 2},
+                                {'sports': 1, 'technology': 1}
+                               )
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        is_it_x.classifier = is_it_x.model = is_it_x.feedback_trainer = None
+        self.client = is_it_x.app.test_client()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_shared_storage(self):
+        is_it_x.DB = {'backend': 'memory'}
+        classifier, model = is_it_x.get_model()
+        assert is_it_x.feedback_trainer.classifier.storage is classifier.storage
+
+    def test_read_only(self):
+        export_model(self.storage, self.filename)
+        is_it_x.DB = {'backend': 'mmap', 'path': self.filename}
+        is_it_x.get_model()
+        assert is_it_x.feedback_trainer is None
+        response = self.client.post(
+                                    '/report_mistake/',
+                                    data={'url': 'http://example.com', 'category': 'sports'}
+                                   )
+        assert response.status_code == 404
+
+if __name__ == '__main__':
+    unittest.main()
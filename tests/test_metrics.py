@@ -0,0 +1,56 @@
+#!/usr/bin/python
+#
+# filename: test_metrics.py
+#
+import os
+import sys
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+import metrics
+
+class MetricsTestCase(unittest.TestCase):
+    '''
+    Testing metrics are only recorded when enabled, and how they render.
+    '''
+    def setUp(self):
+        self.counter = metrics.Counter('test_total', 'A counter')
+        self.histogram = metrics.Histogram('test_seconds', 'A histogram', (1, 10))
+
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.registry.remove(self.counter)
+        metrics.registry.remove(self.histogram)
+
+    def test_disabled(self):
+        self.counter.inc()
+        self.histogram.observe(5)
+        with metrics.timer(self.histogram):
+            pass
+        assert self.counter.value == 0
+        assert self.histogram.counts == [0, 0, 0]
+
+    def test_render(self):
+        metrics.enable()
+        self.counter.inc(2)
+        for value in [0.5, 5, 50]:
+            self.histogram.observe(value)
+        text = metrics.render([('test_gauge', 'A gauge', 3)])
+        for line in [
+                     '# TYPE test_total counter',
+                     'test_total 2.0',
+                     '# TYPE test_seconds histogram',
+                     'test_seconds_bucket{le="1"} 1.0',
+                     'test_seconds_bucket{le="10"} 2.0',
+                     'test_seconds_bucket{le="+Inf"} 3.0',
+                     'test_seconds_sum 55.5',
+                     'test_seconds_count 3.0',
+                     '# TYPE test_gauge gauge',
+                     'test_gauge 3.0',
+                    ]:
+            assert line in text.splitlines(), line
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+#
+# filename: test_model_cache.py
+#
+import os
+import sys
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+from model_cache import ModelCache
+from scoring import log_sums, numpy
+from storage import Storage
+
+class CountsSource(Storage):
+    '''
+    Minimal stand in for the classifier the cache reads from, keeps the
+    counts in dictionaries and logs the changes like the database does.
+    '''
+    def __init__(self):
+        self.features   = { }
+        self.categories = { }
+        self.log        = [ ]
+        self.reads      = 0
+
+    def add(self, feat, cat):
+        self.features.setdefault(feat, { })
+        self.features[feat][cat] = self.features[feat].get(cat, 0.0) + 1
+        self.categories[cat] = self.categories.get(cat, 0.0) + 1
+        self.log.append(set([feat]))
+
+    def sync(self):
+        pass
+
+    def generation(self):
+        return len(self.log)
+
+    def changed_features(self, since):
+        changed = set()
+        for features in self.log[since:]:
+            changed |= features
+        return changed
+
+    def feature_counts(self, features):
+        self.reads += 1
+        return dict(
+                    [
+                     (feat, dict(self.features[feat]))
+                     for feat in features if feat in self.features
+                    ]
+                   )
+
+    def category_counts(self):
+        return dict(self.categories)
+
+class ModelCacheTestCase(unittest.TestCase):
+    '''
+    Testing the cache refreshes only what changed
+    '''
+    def setUp(self):
+        self.source = CountsSource()
+        self.source.add('ball', 'sports')
+        self.source.add('robot', 'technology')
+        self.cache = ModelCache(self.source)
+        self.cache.refresh()
+
+    def test_feature_counts(self):
+        '''
+        Features are read from the source once, then served from the cache,
+        including features the model has never seen.
+        '''
+        counts = self.cache.feature_counts(['ball', 'unseen'])
+        assert counts == {'ball': {'sports': 1.0}}
+        counts = self.cache.feature_counts(['ball', 'unseen'])
+        assert counts == {'ball': {'sports': 1.0}}
+        assert self.source.reads == 1
+        assert self.cache.hits == 2 and self.cache.misses == 2
+
+    def test_refresh(self):
+        '''
+        After training, the changed features and categories are up to date
+        and the untouched features are still cached.
+        '''
+        self.cache.feature_counts(['ball', 'robot'])
+        self.source.add('ball', 'sports')
+        self.cache.refresh()
+        assert 'robot' in self.cache.features
+        assert self.cache.features['ball'] == {'sports': 2.0}
+        assert self.cache.category_counts()['sports'] == 2.0
+
+    def test_max_bytes(self):
+        '''
+        The cache never grows past its memory cap.
+        '''
+        self.cache.max_bytes = 1
+        self.cache.feature_counts(['ball', 'robot'])
+        assert self.cache.size <= 1
+        assert len(self.cache.features) == 0
+
+    def assert_log_sums(self, features):
+        '''
+        Checks the sums of the cache for features are the ones scoring gives
+        from the counts of the source.
+        '''
+        categories = self.source.category_counts()
+        sums = self.cache.log_sums(features, categories)
+        expected = log_sums(features, self.source.feature_counts(features), categories)
+        assert sorted(sums) == sorted(expected)
+        for category in expected:
+            assert abs(sums[category] - expected[category]) < 1e-9, (sums, expected)
+
+    def test_log_sums(self):
+        '''
+        Sums are the ones scoring gives from the counts. Count rows are kept
+        when only the counts of the categories change, and made again when
+        their feature changes or a category is added.
+        '''
+        self.assert_log_sums(['ball', 'robot', 'unseen'])
+        reads = self.source.reads
+        self.cache.log_sums(['ball', 'robot', 'unseen'])
+        assert self.source.reads == reads
+        if numpy is None:
+            return
+        assert sorted(self.cache.rows) == ['ball', 'robot']
+        ball = self.cache.rows['ball']
+        # a new document changing robot only
+        self.source.add('robot', 'technology')
+        self.cache.refresh()
+        assert self.cache.rows['ball'] is ball and 'robot' not in self.cache.rows
+        self.assert_log_sums(['ball', 'robot', 'unseen'])
+        self.source.add('pasta', 'cooking')
+        self.cache.refresh()
+        assert self.cache.rows == { }
+        self.assert_log_sums(['ball', 'pasta', 'unseen'])
+
+    def test_log_sums_recently_used(self):
+        '''
+        Features scored from their count rows are still the most recently
+        used, and the last to be evicted.
+        '''
+        self.cache.log_sums(['ball'])
+        self.cache.log_sums(['robot'])
+        self.cache.log_sums(['ball'])
+        # room for two features, the least recently used makes way
+        self.cache.max_bytes = self.cache.size + self.cache.rows_size
+        self.cache.log_sums(['unseen'])
+        assert 'ball' in self.cache.features
+        assert 'robot' not in self.cache.features
+
+if __name__ == '__main__':
+    unittest.main()
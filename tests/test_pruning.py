@@ -0,0 +1,60 @@
+#!/usr/bin/python
+#
+# filename: test_pruning.py
+#
+import os
+import sys
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+from pruning import information_gain, select_features, prune, copy_model
+from storage import MemoryStorage
+
+class PruningTestCase(unittest.TestCase):
+    '''
+    Testing features are ranked by how much they tell about the category,
+    and only the selected ones are kept.
+    '''
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.storage.add_counts(
+                                {
+                                 # only in sports documents
+                                 ('ball', 'sports'): 4,
+                                 # everywhere
+                                 ('the', 'sports'): 4,
+                                 ('the', 'technology'): 4,
+                                 # once
+                                 ('teh', 'technology'): 1,
+                                 # mostly technology
+                                 ('robot', 'technology'): 3,
+                                 ('robot', 'sports'): 1,
+                                },
+                                {'sports': 4, 'technology': 4}
+                               )
+
+    def test_information_gain(self):
+        categories = self.storage.category_counts()
+        counts = self.storage.feature_counts(['ball', 'the', 'robot'])
+        # a feature that splits the categories tells everything about them
+        assert abs(information_gain(counts['ball'], categories) - 1.0) < 1e-9
+        assert information_gain(counts['the'], categories) == 0.0
+        assert 0 < information_gain(counts['robot'], categories) < 1
+
+    def test_select_features(self):
+        assert select_features(self.storage, 2) == set(['ball', 'the', 'robot'])
+        assert select_features(self.storage, min_gain=0.15) == set(['ball', 'robot'])
+        # ball is the best for sports, robot for technology
+        assert select_features(self.storage, top_n=1) == set(['ball', 'robot'])
+
+    def test_prune(self):
+        copy = copy_model(self.storage)
+        assert prune(copy, set(['ball'])) == 3
+        assert dict(copy.iter_features()) == {'ball': {'sports': 4.0}}
+        # the original is untouched
+        assert len(list(self.storage.iter_features())) == 4
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#
+# filename: test_result_cache.py
+#
+import os
+import sys
+import tempfile
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+from result_cache import ResultCache, content_digest
+
+class ResultCacheTestCase(unittest.TestCase):
+    '''
+    Testing results are found by url and by content, and only for the
+    generation of the model they were computed with
+    '''
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.cache = ResultCache(path=self.path)
+        self.digest = content_digest('<html>Derek Jeter</html>')
+        self.cache.put('http://Example.com', self.digest, 1, 'sports')
+
+    def test_get_url(self):
+        assert self.cache.get_url('example.com/', 1) == 'sports'
+        assert self.cache.get_url('example.com/', 2) is None
+        assert self.cache.get_url('other.com', 1) is None
+        stats = self.cache.stats()
+        assert stats['url_hits'] == 1 and stats['misses'] == 2, stats
+
+    def test_get_content(self):
+        assert self.cache.get_url('mirror.com', 1) is None
+        assert self.cache.get_content('mirror.com', self.digest, 1) == 'sports'
+        assert self.cache.get_url('mirror.com', 1) == 'sports'
+        stats = self.cache.stats()
+        assert stats['content_hits'] == 1 and stats['misses'] == 0, stats
+
+    def test_shared(self):
+        '''
+        Another process sharing the database sees the results.
+        '''
+        other = ResultCache(path=self.path)
+        assert other.get_url('example.com', 1) == 'sports'
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=-1)
+        cache.put('example.com', self.digest, 1, 'sports')
+        assert cache.get_url('example.com', 1) is None
+
+    def tearDown(self):
+        os.remove(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
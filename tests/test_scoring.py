@@ -0,0 +1,49 @@
+#!/usr/bin/python
+#
+# filename: test_scoring.py
+#
+import os
+import sys
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+import scoring
+
+COUNTS = {
+          'ball':  {'sports': 3.0},
+          'game':  {'sports': 2.0, 'technology': 1.0},
+          'robot': {'technology': 4.0},
+         }
+CATEGORY_COUNTS = {'sports': 4.0, 'technology': 5.0, 'cooking': 0.0}
+
+class ScoringTestCase(unittest.TestCase):
+    '''
+    Testing the vectorized scores match the plain Python ones
+    '''
+    def test_numpy_log_sums(self):
+        if scoring.numpy is None:
+            return
+        for features in [['ball', 'game', 'unseen'], ['robot'], [ ]]:
+            expected = scoring.python_log_sums(features, COUNTS, CATEGORY_COUNTS)
+            sums = scoring.numpy_log_sums(features, COUNTS, CATEGORY_COUNTS)
+            assert sorted(sums) == sorted(expected)
+            for cat in expected:
+                assert abs(sums[cat] - expected[cat]) < 1e-9, (sums, expected)
+
+    def test_log_sums_add_up(self):
+        '''
+        Scoring a document a piece at a time gives the same scores.
+        '''
+        whole = scoring.score_features(['ball', 'game', 'robot'], COUNTS, CATEGORY_COUNTS)
+        sums = scoring.log_sums(['ball'], COUNTS, CATEGORY_COUNTS)
+        more = scoring.log_sums(['game', 'robot'], COUNTS, CATEGORY_COUNTS)
+        for cat in sums:
+            sums[cat] += more[cat]
+        pieces = scoring.scores_from_log_sums(sums, CATEGORY_COUNTS)
+        for cat in whole:
+            assert abs(whole[cat] - pieces[cat]) < 1e-9
+
+if __name__ == '__main__':
+    unittest.main()
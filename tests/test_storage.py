@@ -0,0 +1,295 @@
+#!/usr/bin/python
+#
+# filename: test_storage.py
+#
+import os
+import sys
+import tempfile
+import unittest
+
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+
+import sqlite3
+import storage
+import threading
+import time
+from model_cache import ModelCache
+from storage import MemoryStorage, SQLiteStorage, MySQLStorage, open_storage
+from storage import ConnectionPool, PoolTimeout
+from model_file import export_model
+from hashed_storage import HashedStorage
+from pruning import prune
+
+class StorageTests(object):
+    '''
+    Tests every store must pass, mixed into a TestCase per store that
+    defines create_storage.
+    '''
+    def setUp(self):
+        self.storage = self.create_storage()
+        self.storage.add_counts(
+                                {
+                                 ('ball', 'sports'): 2,
+                                 ('game', 'sports'): 1,
+                                 ('game', 'technology'): 3,
+                                },
+                                {'sports': 2, 'technology': 3}
+                               )
+
+    def test_counts(self):
+        '''
+        Counts added in a batch can be read one at a time and in a batch.
+        '''
+        assert self.storage.feature_count('ball', 'sports') == 2.0
+        assert self.storage.feature_count('ball', 'technology') == 0.0
+        assert self.storage.category_count('technology') == 3.0
+        assert self.storage.total_count() == 5
+        assert sorted(self.storage.categories()) == ['sports', 'technology']
+        counts = self.storage.feature_counts(['ball', 'game', 'unseen'])
+        assert counts == {
+                          'ball': {'sports': 2.0},
+                          'game': {'sports': 1.0, 'technology': 3.0},
+                         }, counts
+
+    def test_add_counts(self):
+        '''
+        Adding to existing counts increments them.
+        '''
+        self.storage.add_counts({('ball', 'sports'): 1}, {'sports': 1})
+        assert self.storage.feature_count('ball', 'sports') == 3.0
+        assert self.storage.category_count('sports') == 3.0
+
+    def test_changed_features(self):
+        '''
+        Every batch is a new generation that logs the features it changed,
+        and a reset invalidates everything before it.
+        '''
+        generation = self.storage.generation()
+        self.storage.add_counts({('ball', 'sports'): 1}, {'sports': 1})
+        self.storage.add_counts({('robot', 'technology'): 1}, {'technology': 1})
+        assert self.storage.generation() == generation + 2
+        changed = self.storage.changed_features(generation)
+        assert changed == set(['ball', 'robot']), changed
+        self.storage.reset()
+        assert self.storage.changed_features(generation) is None
+        assert self.storage.total_count() == 0
+
+    def test_change_log_limits(self):
+        '''
+        Batches of too many features aren't logged, and the log drops its
+        oldest generations past its size, both telling the caches to reload.
+        '''
+        limits = storage.CHANGE_LOG_BATCH, storage.CHANGE_LOG_ROWS
+        try:
+            storage.CHANGE_LOG_BATCH, storage.CHANGE_LOG_ROWS = 2, 100
+            generation = self.storage.generation()
+            self.storage.add_counts({('a', 'sports'): 1, ('b', 'sports'): 1, ('c', 'sports'): 1}, { })
+            assert self.storage.changed_features(generation) is None
+            generation = self.storage.generation()
+            self.storage.add_counts({('a', 'sports'): 1, ('b', 'sports'): 1}, { })
+            self.storage.add_counts({('c', 'sports'): 1}, { })
+            assert self.storage.changed_features(generation + 1) == set(['c'])
+            # more than CHANGE_LOG_BATCH features over both generations
+            assert self.storage.changed_features(generation) is None
+            storage.CHANGE_LOG_BATCH, storage.CHANGE_LOG_ROWS = 100, 3
+            generation = self.storage.generation()
+            self.storage.add_counts({('a', 'sports'): 1, ('b', 'sports'): 1}, { })
+            self.storage.add_counts({('c', 'sports'): 1}, { })
+            self.storage.add_counts({('d', 'sports'): 1}, { })
+            # the oldest generation went over CHANGE_LOG_ROWS
+            assert self.storage.changed_features(generation) is None
+            assert self.storage.changed_features(generation + 1) == set(['c', 'd'])
+        finally:
+            storage.CHANGE_LOG_BATCH, storage.CHANGE_LOG_ROWS = limits
+
+    def test_remove_features(self):
+        '''
+        Removed features lose every count, and the caches are told to reload
+        the whole model.
+        '''
+        generation = self.storage.generation()
+        self.storage.remove_features(['game', 'unseen'])
+        assert self.storage.feature_counts(['ball', 'game']) == {'ball': {'sports': 2.0}}
+        assert self.storage.category_counts() == {'sports': 2.0, 'technology': 3.0}
+        assert self.storage.generation() == generation + 1
+        assert self.storage.changed_features(generation) is None
+
+class MemoryStorageTestCase(StorageTests, unittest.TestCase):
+    def create_storage(self):
+        return MemoryStorage()
+
+class SQLiteStorageTestCase(StorageTests, unittest.TestCase):
+    def create_storage(self):
+        return open_storage({'backend': 'sqlite', 'path': ':memory:'})
+
+class MappedStorageTestCase(unittest.TestCase):
+    '''
+    Testing a model file has the same counts as the store it was exported
+    from.
+    '''
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.storage.add_counts(
+                                {
+                                 ('ball', 'sports'): 2,
+                                 ('game', 'sports'): 1,
+                                 ('game', 'technology'): 3,
+                                },
+                                {'sports': 2, 'technology': 3}
+                               )
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        export_model(self.storage, self.filename)
+        self.mapped = open_storage({'backend': 'mmap', 'path': self.filename})
+
+    def test_counts(self):
+        features = ['ball', 'game', 'unseen', 'aaa', 'zzz']
+        assert self.mapped.feature_counts(features) == self.storage.feature_counts(features)
+        assert self.mapped.category_counts() == self.storage.category_counts()
+        assert sorted(self.mapped.iter_features()) == sorted(self.storage.iter_features())
+
+    def tearDown(self):
+        self.mapped.close()
+        os.remove(self.filename)
+
+class HashedStorageTestCase(unittest.TestCase):
+    '''
+    Testing the hashed store counts like the others, survives a round trip
+    through its file and merges with another.
+    '''
+    def setUp(self):
+        self.storage = open_storage({'backend': 'hashed', 'bits': 12})
+        self.storage.add_counts(
+                                {
+                                 ('ball', 'sports'): 2,
+                                 ('game', 'sports'): 1,
+                                 ('game', 'technology'): 3,
+                                },
+                                {'sports': 2, 'technology': 3}
+                               )
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_counts(self):
+        counts = self.storage.feature_counts(['ball', 'game'])
+        assert counts == {
+                          'ball': {'sports': 2.0},
+                          'game': {'sports': 1.0, 'technology': 3.0},
+                         }, counts
+        assert self.storage.category_counts() == {'sports': 2.0, 'technology': 3.0}
+        assert len(self.storage.arrays['sports']) == 2 ** 12
+
+    def test_save(self):
+        self.storage.save(self.filename)
+        loaded = HashedStorage(path=self.filename)
+        assert loaded.bits == 12
+        assert loaded.generation() == self.storage.generation()
+        assert loaded.category_counts() == self.storage.category_counts()
+        assert list(loaded.iter_buckets()) == list(self.storage.iter_buckets())
+
+    def test_no_feature_names(self):
+        self.assertRaises(NotImplementedError, self.storage.iter_features)
+        self.assertRaises(NotImplementedError, export_model, self.storage, self.filename)
+        self.assertRaises(NotImplementedError, prune, self.storage, set(['ball']))
+
+    def test_merge(self):
+        other = HashedStorage(12)
+        other.add_counts({('ball', 'sports'): 1}, {'sports': 1})
+        self.storage.merge(other)
+        assert self.storage.feature_count('ball', 'sports') == 3.0
+        assert self.storage.category_count('sports') == 3.0
+        self.assertRaises(ValueError, self.storage.merge, HashedStorage(10))
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    '''
+    Testing connections are reused, capped, checked and put back by the
+    pooled store, over SQLite connections.
+    '''
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        SQLiteStorage(self.filename).add_counts({ }, {'sports': 2})
+        self.connected = 0
+        self.pool = ConnectionPool(self.connect, size=2, wait=0.1)
+
+    def tearDown(self):
+        self.pool.close()
+        os.remove(self.filename)
+
+    def connect(self):
+        self.connected += 1
+        return sqlite3.connect(self.filename, check_same_thread=False)
+
+    def test_reuse(self):
+        first = self.pool.get()
+        self.pool.put(first)
+        assert self.pool.get() is first
+        second = self.pool.get()
+        self.assertRaises(PoolTimeout, self.pool.get)
+        self.pool.put(second, broken=True)
+        assert self.pool.get() is not second
+        assert self.connected == 3
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        self.pool.put(self.pool.get())
+        self.pool.get()
+        assert self.connected == 2
+
+    def test_waits_for_connection(self):
+        self.pool.wait = 5
+        taken = [ self.pool.get(), self.pool.get() ]
+        threading.Timer(0.1, self.pool.put, [ taken[0] ]).start()
+        assert self.pool.get() is taken[0]
+
+    def test_checkout(self):
+        storage = MySQLStorage({ }, self.pool)
+        # every operation checks out a connection and puts it back
+        assert storage.category_counts() == {'sports': 2.0}
+        assert storage.generation() == 1
+        assert self.pool.opened == 1 and len(self.pool.idle) == 1
+        # in a checkout they share the one the thread holds
+        with storage.checkout():
+            connection = storage.db
+            storage.category_counts()
+            with storage.checkout():
+                assert storage.db is connection
+            assert len(self.pool.idle) == 0
+        assert len(self.pool.idle) == 1
+        # a connection an error left unusable isn't put back
+        try:
+            with storage.checkout():
+                storage.db.close()
+                raise ValueError
+        except ValueError:
+            pass
+        assert self.pool.opened == 0
+
+    def test_model_cache_checkout(self):
+        '''
+        A thread refreshing the model cache waits for a connection before
+        taking the lock of the cache, so the thread holding the only
+        connection can still get in.
+        '''
+        storage = MySQLStorage({ }, ConnectionPool(self.connect, size=1, wait=1))
+        cache = ModelCache(storage)
+        errors = [ ]
+        def refresh():
+            try:
+                cache.refresh()
+            except Exception, error:
+                errors.append(error)
+        with storage.checkout():
+            thread = threading.Thread(target=refresh)
+            thread.start()
+            time.sleep(0.1)
+            assert cache.category_counts() == {'sports': 2.0}
+        thread.join()
+        assert not errors, errors
+
+if __name__ == '__main__':
+    unittest.main()
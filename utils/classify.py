@@ -0,0 +1,93 @@
+#!/usr/bin/python
+#
+# Quick script to classify a big list of urls or of documents (one per line)
+# offline, writing one json line per input line to stdout, in input order:
+#
+#   python classify.py urls|documents <file or - for stdin> <model file> [workers]
+#
+# The model file is the one written by export_model.py, every worker process
+# maps it and scores with its own copy of the model cache.
+#
+import sys, os, json, threading, traceback
+from multiprocessing import Pool
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+import crawler, page_classifier, model_cache
+
+# lines handed to a worker at a time, and lines read ahead of the output
+CHUNK_SIZE = 16
+PENDING_CHUNKS = 8
+
+# each worker process loads these once
+classifier = None
+model = None
+page_crawler = None
+
+def load_model(model_path):
+    '''
+    Loads the model in a worker process.
+    '''
+    global classifier, model, page_crawler
+    classifier = page_classifier.Classifier(
+                                            page_classifier.get_words,
+                                            {'backend': 'mmap', 'path': model_path}
+                                           )
+    model = model_cache.ModelCache(classifier.storage)
+    page_crawler = crawler.Crawler()
+
+def classify_line(item):
+    '''
+    Returns the json result for a numbered line of the input.
+    '''
+    number, line, mode = item
+    result = {'line': number}
+    try:
+        if mode == 'urls':
+            result['url'] = line
+            fragments = page_crawler.stream_content(line)
+            scores = classifier.scores_stream(fragments, model)
+        else:
+            scores = classifier.scores(line, model)
+        result['category'] = classifier.decide(scores)
+        result['scores'] = scores
+    except crawler.CrawlerError, error:
+        result['error'] = str(error)
+    except Exception, error:
+        # a bad line mustn't take down the whole run
+        traceback.print_exc()
+        result['error'] = '%s: %s' % (error.__class__.__name__, error)
+    return json.dumps(result)
+
+def read_lines(lines, mode, pending):
+    '''
+    Generates the numbered non empty lines for the workers, waiting for the
+    results of earlier lines to be written before reading too far ahead.
+    '''
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line:
+            pending.acquire()
+            yield number, line, mode
+
+# read the mode, the input, the model file and optionally the number of
+# worker processes from the command line
+mode, input_path, model_path = sys.argv[1:4]
+if mode not in ('urls', 'documents'):
+    sys.exit('the mode is either urls or documents')
+workers = crawler.WORKERS
+if len(sys.argv) > 4:
+    workers = int(sys.argv[4])
+
+if input_path == '-':
+    lines = sys.stdin
+else:
+    lines = open(input_path, 'r')
+# the pool reads its input as fast as it can, so bound how much is in flight
+pending = threading.BoundedSemaphore(CHUNK_SIZE * PENDING_CHUNKS * workers)
+pool = Pool(workers, load_model, (model_path,))
+results = pool.imap(classify_line, read_lines(lines, mode, pending), CHUNK_SIZE)
+for result in results:
+    sys.stdout.write(result + '\n')
+    pending.release()
+pool.close()
+pool.join()
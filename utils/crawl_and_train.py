@@ -0,0 +1,47 @@
+#!/usr/bin/python
+#
+# Quick script to train the classifier straight from the pages at a list of
+# urls, without going through a training file: pages are downloaded, counted
+# and written to the database at the same time.
+#
+#   python crawl_and_train.py url_file label dbname host usr passwd [workers] [download workers]
+#
+import sys, os
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+import crawler, frontier, page_classifier
+
+# get the path to the file with a list of urls, the label for the data at said
+# urls and the data for the database from the command line, and optionally
+# the number of processes counting the pages and of pages downloaded at the
+# same time
+url_file, label = sys.argv[1], sys.argv[2]
+DB = {}
+DB['dbname'], DB['host'], DB['usr'], DB['passwd'] = sys.argv[3:7]
+workers = None
+if len(sys.argv) > 7:
+    workers = int(sys.argv[7])
+download_workers = crawler.WORKERS
+if len(sys.argv) > 8:
+    download_workers = int(sys.argv[8])
+
+# create our classifier, and a crawler remembering the pages trained with in
+# data/trained.db so running this again only trains with the new pages
+classifier = page_classifier.Classifier(page_classifier.get_words, DB)
+trained_pages = frontier.Frontier(DIR + os.sep + 'data' + os.sep + 'trained.db')
+downloader = crawler.Crawler(workers=download_workers, fast_parser=True,
+                             frontier=trained_pages)
+
+# get list of urls
+with open(url_file, 'r') as link_file:
+    urls = map(lambda x: x.strip('\n'), link_file.readlines())
+
+# train with the pages as they download, over a single connection. Pages are
+# recorded as trained only once the batch they're in is written, so an
+# interrupted run trains again with the ones that weren't
+documents = downloader.iter_documents(urls, label, record=False)
+with classifier.storage.checkout():
+    trained = classifier.train_stream(documents, label, workers,
+                                      on_trained=downloader.record_done)
+classifier.storage.close()
+print 'trained with %d pages' % trained
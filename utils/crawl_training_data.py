@@ -0,0 +1,42 @@
+#!/usr/bin/python
+#
+#
+# Downloads training data by following links from a few seed pages, breadth
+# first, staying on the domains of the seeds.
+#
+
+import sys, os
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+import crawler, frontier
+
+# get the path to the file with the seed urls and the label for the data
+# downloaded from the command line, and optionally how many links to follow
+# from a seed, how many pages to download in all and per host, and the number
+# of pages to download at the same time
+url_file, label = sys.argv[1], sys.argv[2]
+max_depth, max_pages = crawler.MAX_DEPTH, crawler.MAX_PAGES
+max_per_host, workers = crawler.MAX_PAGES_PER_HOST, crawler.WORKERS
+if len(sys.argv) > 3:
+    max_depth = int(sys.argv[3])
+if len(sys.argv) > 4:
+    max_pages = int(sys.argv[4])
+if len(sys.argv) > 5:
+    max_per_host = int(sys.argv[5])
+if len(sys.argv) > 6:
+    workers = int(sys.argv[6])
+
+# create our crawler, remembering what it downloaded in data/frontier.db so
+# the same document is never written twice. Running this again starts over
+# from the seeds (the pages are downloaded again), it doesn't resume
+crawl_state = frontier.Frontier(DIR + os.sep + 'data' + os.sep + 'frontier.db')
+downloader = crawler.Crawler(DIR + os.sep + 'data', True, workers, fast_parser=True,
+                             frontier=crawl_state)
+
+# get list of seeds
+with open(url_file, 'r') as link_file:
+    seeds = map(lambda x: x.strip('\n'), link_file.readlines())
+
+# download our content
+downloader.crawl_links(seeds, label, max_depth, max_pages, max_per_host)
+print crawl_state.counts(label)
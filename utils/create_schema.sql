@@ -13,4 +13,22 @@ CREATE TABLE feature_tbl (
 	PRIMARY KEY (id)
 );
 CREATE INDEX feature_idx ON feature_tbl(feature);
-CREATE INDEX category_idx ON category_tbl(category);
+-- training adds counts with INSERT ... ON DUPLICATE KEY UPDATE, which relies
+-- on these being unique
+CREATE UNIQUE INDEX feature_category_idx ON feature_tbl(feature, category);
+CREATE UNIQUE INDEX category_idx ON category_tbl(category);
+
+-- the generation goes up on every change to the counts, and the features that
+-- changed in it are logged so that caches can refresh just those
+CREATE TABLE generation_tbl (
+	id INTEGER NOT NULL,
+	generation INTEGER NOT NULL,
+	PRIMARY KEY(id)
+);
+INSERT INTO generation_tbl (id, generation) VALUES (1, 0);
+
+CREATE TABLE changed_feature_tbl (
+	generation INTEGER NOT NULL,
+	feature VARCHAR(255) NOT NULL
+);
+CREATE INDEX changed_generation_idx ON changed_feature_tbl(generation);
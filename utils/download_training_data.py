@@ -8,18 +8,27 @@
 import sys, os
 DIR = '/'.join(os.getcwd().split('/')[:-1])
 sys.path.append(DIR)
-import crawler
+import crawler, frontier
 
 # get the path to the file with a url or list of urls and the label for the
-# data at said url from the command line
+# data at said url from the command line, optionally the number of pages to
+# download at the same time, and refetch to download again the pages that
+# were already downloaded if they changed
 url_file, label = sys.argv[1], sys.argv[2]
+workers = crawler.WORKERS
+if len(sys.argv) > 3:
+    workers = int(sys.argv[3])
+refetch = len(sys.argv) > 4 and sys.argv[4] == 'refetch'
 
-# create our crawler
-downloader = crawler.Crawler(DIR + os.sep + 'data', True)
+# create our crawler, remembering what it downloaded in data/frontier.db so
+# running this again only downloads the new pages
+crawl_state = frontier.Frontier(DIR + os.sep + 'data' + os.sep + 'frontier.db')
+downloader = crawler.Crawler(DIR + os.sep + 'data', True, workers, frontier=crawl_state)
 
 # get list of urls
 with open(url_file, 'r') as link_file:
     urls = map(lambda x: x.strip('\n'), link_file.readlines())
 
 # download our content
-downloader.crawl(urls, label)
+downloader.crawl(urls, label, refetch)
+print crawl_state.counts(label)
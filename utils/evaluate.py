@@ -0,0 +1,39 @@
+#!/usr/bin/python
+#
+# Quick script to cross-validate the classifier on labelled files (one
+# document per line) and see how precision and recall of each category move
+# with its threshold, to pick the THRESHOLDS in config.py:
+#
+#   python evaluate.py folds file label [file label]...
+#
+# Everything happens in memory, the database isn't used.
+#
+import sys, os
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+import page_classifier, evaluation
+from storage import MemoryStorage
+
+# thresholds tried for every category, margins on the scores (see
+# Classifier.decide)
+THRESHOLDS = [0.0, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0]
+
+# read the number of folds and the labelled files from the command line
+folds = int(sys.argv[1])
+documents = evaluation.read_labelled(zip(sys.argv[2::2], sys.argv[3::2]))
+
+classifier = page_classifier.Classifier(page_classifier.get_words, MemoryStorage())
+categories, scores, labels = evaluation.cross_validate(classifier, documents, folds)
+decided = evaluation.decisions(classifier, categories, scores)
+correct = sum([ 1 for best, label in zip(decided, labels) if best == label ])
+print '%d documents, %d folds: %.1f%% accuracy' % (len(documents), folds, 100.0 * correct / len(documents))
+print
+print '%-20s %9s %9s %9s %9s' % ('category', 'threshold', 'precision', 'recall', 'predicted')
+for line in evaluation.threshold_sweep(categories, scores, labels, THRESHOLDS):
+    print '%-20s %9.2f %9.3f %9.3f %9d' % (
+                                           line['category'],
+                                           line['threshold'],
+                                           line['precision'],
+                                           line['recall'],
+                                           line['predicted']
+                                          )
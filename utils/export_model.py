@@ -0,0 +1,19 @@
+#!/usr/bin/python
+#
+# Quick script to dump the trained model from the database into a model file
+# that web processes can memory map (see model_file.py).
+#
+import sys, os
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+import storage, model_file
+
+# read the path of the model file to write
+model_path = sys.argv[1]
+# read the data for the database from command line
+# dbname, host, usr, passwd
+DB = {}
+DB['dbname'], DB['host'], DB['usr'], DB['passwd'] = sys.argv[2:6]
+
+# dump the model
+model_file.export_model(storage.open_storage(DB), model_path)
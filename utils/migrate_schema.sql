@@ -0,0 +1,46 @@
+-- Brings a database created by an older utils/create_schema.sql up to date.
+-- Run it once, with training stopped:
+--
+--   mysql -u <usr> -p <dbname> < migrate_schema.sql
+
+-- training adds counts with INSERT ... ON DUPLICATE KEY UPDATE, which needs
+-- (feature, category) and category to be unique. Older databases can hold
+-- several rows for the same one: their counts are added up into the first
+-- row and the others deleted before the unique indexes are created
+CREATE TEMPORARY TABLE feature_sum_tbl AS
+	SELECT MIN(id) AS id, SUM(count) AS count FROM feature_tbl
+	GROUP BY feature, category HAVING COUNT(*) > 1;
+UPDATE feature_tbl JOIN feature_sum_tbl ON feature_tbl.id = feature_sum_tbl.id
+	SET feature_tbl.count = feature_sum_tbl.count;
+DELETE duplicate FROM feature_tbl AS duplicate JOIN feature_tbl AS first
+	ON duplicate.feature = first.feature AND duplicate.category = first.category
+	AND duplicate.id > first.id;
+DROP TEMPORARY TABLE feature_sum_tbl;
+
+CREATE TEMPORARY TABLE category_sum_tbl AS
+	SELECT MIN(id) AS id, SUM(count) AS count FROM category_tbl
+	GROUP BY category HAVING COUNT(*) > 1;
+UPDATE category_tbl JOIN category_sum_tbl ON category_tbl.id = category_sum_tbl.id
+	SET category_tbl.count = category_sum_tbl.count;
+DELETE duplicate FROM category_tbl AS duplicate JOIN category_tbl AS first
+	ON duplicate.category = first.category AND duplicate.id > first.id;
+DROP TEMPORARY TABLE category_sum_tbl;
+
+CREATE UNIQUE INDEX feature_category_idx ON feature_tbl(feature, category);
+DROP INDEX category_idx ON category_tbl;
+CREATE UNIQUE INDEX category_idx ON category_tbl(category);
+
+-- the generation goes up on every change to the counts, and the features that
+-- changed in it are logged so that caches can refresh just those
+CREATE TABLE IF NOT EXISTS generation_tbl (
+	id INTEGER NOT NULL,
+	generation INTEGER NOT NULL,
+	PRIMARY KEY(id)
+);
+INSERT IGNORE INTO generation_tbl (id, generation) VALUES (1, 0);
+
+CREATE TABLE IF NOT EXISTS changed_feature_tbl (
+	generation INTEGER NOT NULL,
+	feature VARCHAR(255) NOT NULL,
+	INDEX changed_generation_idx (generation)
+);
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+#
+# Quick script to prune the features of the trained model that are too rare
+# or say too little about the category of a page (see pruning.py):
+#
+#   python prune_model.py [--dry-run] min_count top_n dbname host usr passwd [test_file label]...
+#
+# top_n caps the features kept for each category, 0 keeps them all. The size
+# of the model and its accuracy on the test files are reported before and
+# after pruning, with --dry-run the model is left as is.
+#
+import sys, os
+DIR = '/'.join(os.getcwd().split('/')[:-1])
+sys.path.append(DIR)
+import page_classifier, pruning, evaluation
+from storage import open_storage
+
+args = sys.argv[1:]
+dry_run = '--dry-run' in args
+if dry_run:
+    args.remove('--dry-run')
+# read the pruning thresholds, the data for the database and the test files
+# with their labels from the command line
+min_count, top_n = int(args[0]), int(args[1]) or None
+DB = {}
+DB['dbname'], DB['host'], DB['usr'], DB['passwd'] = args[2:6]
+test_files = zip(args[6::2], args[7::2])
+documents = evaluation.read_labelled(test_files)
+
+def report(name, storage):
+    classifier = page_classifier.Classifier(page_classifier.get_words, storage)
+    features = sum([ 1 for feat in storage.iter_features() ])
+    line = '%s: %d features' % (name, features)
+    if documents:
+        line += ', %.1f%% accuracy on %d test documents' % (
+                                                             100 * evaluation.accuracy(classifier, documents),
+                                                             len(documents)
+                                                            )
+    print line
+
+# try the pruning on a copy of the model first
+storage = open_storage(DB)
+pruned = pruning.copy_model(storage)
+report('before', pruned)
+keep = pruning.select_features(pruned, min_count, top_n=top_n)
+pruning.prune(pruned, keep)
+report('after', pruned)
+
+if not dry_run:
+    with storage.checkout():
+        print 'removed %d features' % pruning.prune(storage, keep)
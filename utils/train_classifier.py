@@ -11,12 +11,25 @@ import page_classifier
 # read data for file and label (assuming file is in data dir)
 file_path, label = sys.argv[1], sys.argv[2]
 # read the data for the database from command line
-# dbname, host, usr, passwd
+# dbname, host, usr, passwd and optionally the training batch size and the
+# number of processes to count the file with
 DB = {}
-DB['dbname'], DB['host'], DB['usr'], DB['passwd'] = sys.argv[3:]
+DB['dbname'], DB['host'], DB['usr'], DB['passwd'] = sys.argv[3:7]
+batch_size = page_classifier.TRAINING_BATCH_SIZE
+if len(sys.argv) > 7:
+    batch_size = int(sys.argv[7])
+workers = 1
+if len(sys.argv) > 8:
+    workers = int(sys.argv[8])
 
 # create our classifier
 classifier = page_classifier.Classifier(page_classifier.get_words, DB)
 
-# train it from file
-classifier.train_from_file(file_path, label)
+# train it from file, splitting it among several processes if asked to, over a
+# single connection
+with classifier.storage.checkout():
+    if workers > 1:
+        classifier.train_parallel([(file_path, label)], workers)
+    else:
+        classifier.train_from_file(file_path, label, batch_size)
+classifier.storage.close()